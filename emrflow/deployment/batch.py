@@ -0,0 +1,247 @@
+"""
+Submit many job runs at once. The artifacts of every job are uploaded once, job
+runs are started with bounded concurrency and tracked together.
+
+A spec is a .json or .yaml file (the latter requires the `yaml` extra) such as:
+
+    defaults:
+      s3_code_uri: s3://bucket/code
+      s3_logs_uri: s3://bucket/logs
+      spark_submit_parameters: --conf spark.submit.pyFiles=dist/project-dependency-src.zip
+    jobs:
+      - job_name: ingest
+        entry_point: jobs/ingest.py
+        entry_point_arguments: ["2024-01-01"]
+        tags: ["team:data"]
+"""
+
+import asyncio
+import json
+from typing import Dict, List, Optional
+
+import rich
+
+from emrflow.deployment.emr_sls import EMRServerless
+from emrflow.deployment.tracker import MultiJobTracker
+from emrflow.utils import DEFAULT_MULTIPART_CHUNK_SIZE, DEFAULT_UPLOAD_CONCURRENCY
+
+JOB_SPEC_DEFAULTS = {
+    "entry_point_arguments": None,
+    "spark_submit_parameters": "",
+    "s3_logs_uri": "",
+    "execution_timeout": 0,
+    "tags": None,
+}
+# state of a job whose job run could not be started
+SUBMIT_FAILED = "SUBMIT_FAILED"
+
+
+def load_job_specs(spec_path: str) -> List[Dict]:
+    """
+    Load the job definitions of a .json or .yaml spec, merged with its defaults
+    spec_path: str : path of the spec
+
+    return: List[Dict] : job definitions
+    """
+    with open(spec_path, "r") as spec_file:
+        if spec_path.endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError as ex:
+                raise ImportError(
+                    'Reading a .yaml spec requires PyYAML, run `pip install "emrflow[yaml]"` or use a .json spec'
+                ) from ex
+            spec = yaml.safe_load(spec_file)
+        else:
+            spec = json.load(spec_file)
+
+    defaults = {**JOB_SPEC_DEFAULTS, **spec.get("defaults", {})}
+    jobs = [{**defaults, **job} for job in spec.get("jobs", [])]
+
+    job_names = set()
+    for job in jobs:
+        for key in ["job_name", "entry_point", "s3_code_uri"]:
+            if not job.get(key):
+                raise ValueError(f"Job {job} is missing '{key}' in {spec_path}")
+        if job["job_name"] in job_names:
+            raise ValueError(f"Job name '{job['job_name']}' is not unique")
+        job_names.add(job["job_name"])
+
+    return jobs
+
+
+class BatchRunner:
+    """
+    Upload the union of the artifacts of several jobs once, then start and track
+    the job runs with a bounded number of concurrent runs
+    """
+
+    def __init__(
+        self,
+        emr_serverless: EMRServerless,
+        max_concurrency: int = 10,
+        ping_duration: int = 30,
+        max_calls_per_second: float = 5,
+        fail_fast: bool = False,
+        show_logs: bool = False,
+    ) -> None:
+        """
+        emr_serverless: EMRServerless : emr serverless application
+        max_concurrency: int : maximum job runs submitted and not finished at once,
+            also capped by the max concurrent runs of the application
+        ping_duration: int : maximum duration (in sec) between two status checks of a job
+        max_calls_per_second: float : maximum get_job_run calls per second
+        fail_fast: bool : stop submitting and tracking once a job does not succeed
+        show_logs: bool : show logs of the job runs
+        """
+        self._emr_serverless = emr_serverless
+        self._max_concurrency = max_concurrency
+        self._show_logs = show_logs
+        self.tracker = MultiJobTracker(
+            emr_serverless,
+            ping_duration=ping_duration,
+            max_calls_per_second=max_calls_per_second,
+            fail_fast=fail_fast,
+        )
+        self.job_run_ids = {}
+        self.submit_failures = {}
+
+    def get_concurrency(self) -> int:
+        """
+        Concurrency limit, respecting the max concurrent runs of the application
+
+        return: int : maximum concurrent job runs
+        """
+        application = self._emr_serverless.get_application()
+        max_concurrent_runs = application.get("schedulerConfiguration", {}).get(
+            "maxConcurrentRuns"
+        )
+        if max_concurrent_runs:
+            return max(min(self._max_concurrency, max_concurrent_runs), 1)
+        return max(self._max_concurrency, 1)
+
+    def upload(
+        self,
+        jobs: List[Dict],
+        excludes: Optional[List[str]] = None,
+        upload_concurrency: int = DEFAULT_UPLOAD_CONCURRENCY,
+        multipart_chunk_size: int = DEFAULT_MULTIPART_CHUNK_SIZE,
+        skip_unchanged: bool = True,
+        content_addressed: bool = False,
+    ) -> Dict[str, Dict]:
+        """
+        Upload the artifacts of all jobs once per s3 code uri
+        jobs: List[Dict] : job definitions
+        excludes: List[str] : local paths already available in S3
+        upload_concurrency: int : number of parallel uploads
+        multipart_chunk_size: int : size (in MB) of each part of a multipart upload
+        skip_unchanged: bool : skip artifacts whose content is already in S3
+        content_addressed: bool : store artifacts by digest under `cas/`
+
+        return: Dict[str, Dict] : src_dest_uri of each s3 code uri
+        """
+        artifacts = {}
+        for job in jobs:
+            job_artifacts = self._emr_serverless.get_artifacts(
+                spark_submit_parameters=job["spark_submit_parameters"]
+            )
+            # keep the order of first appearance, without duplicates
+            artifacts.setdefault(job["s3_code_uri"], {}).update(
+                dict.fromkeys(job_artifacts + [job["entry_point"]])
+            )
+
+        return {
+            s3_code_uri: self._emr_serverless.upload_artifacts(
+                s3_code_uri=s3_code_uri,
+                artifacts=list(code_artifacts),
+                excludes=excludes or [],
+                upload_concurrency=upload_concurrency,
+                multipart_chunk_size=multipart_chunk_size,
+                skip_unchanged=skip_unchanged,
+                content_addressed=content_addressed,
+            )
+            for s3_code_uri, code_artifacts in artifacts.items()
+        }
+
+    def submit(self, job: Dict, src_dest_uri: Dict) -> str:
+        """
+        Start a job run without waiting for it
+        job: Dict : job definition
+        src_dest_uri: Dict : dict containing key as src path and value as dest path in S3
+
+        return: str : job_run_id
+        """
+        return self._emr_serverless.run_job(
+            job_name=job["job_name"],
+            entry_point_uri=job["entry_point"],
+            entry_point_arguments=job["entry_point_arguments"],
+            spark_submit_opts=job["spark_submit_parameters"],
+            wait=False,
+            show_logs=False,
+            s3_code_uri=job["s3_code_uri"],
+            s3_logs_uri=job["s3_logs_uri"],
+            execution_timeout=job["execution_timeout"],
+            tags=job["tags"],
+            src_dest_uri=src_dest_uri,
+        )
+
+    async def submit_and_track(
+        self, job: Dict, src_dest_uri: Dict, semaphore: asyncio.Semaphore
+    ) -> Dict:
+        """
+        Submit a job once a concurrency slot is free and track it until it finishes.
+        A job that cannot be submitted ends in the SUBMIT_FAILED state
+        job: Dict : job definition
+        src_dest_uri: Dict : dict containing key as src path and value as dest path in S3
+        semaphore: asyncio.Semaphore : concurrency slots
+
+        return: Dict : jr_response
+        """
+        async with semaphore:
+            try:
+                job_run_id = await self.tracker.call(self.submit, job, src_dest_uri)
+            except Exception as ex:
+                # the other jobs of the batch keep running and being tracked
+                rich.print(f"Job {job['job_name']} could not be submitted: {ex}")
+                jr_response = {"state": SUBMIT_FAILED, "stateDetails": str(ex)}
+                self.submit_failures[job["job_name"]] = jr_response
+                return jr_response
+            self.job_run_ids[job["job_name"]] = job_run_id
+            return await self.tracker.track_job(job_run_id, self._show_logs)
+
+    async def _run(
+        self, jobs: List[Dict], src_dest_uris: Dict[str, Dict], concurrency: int
+    ):
+        semaphore = asyncio.Semaphore(concurrency)
+        async with self.tracker:
+            await self.tracker.wait_all(
+                [
+                    self.submit_and_track(
+                        job, src_dest_uris[job["s3_code_uri"]], semaphore
+                    )
+                    for job in jobs
+                ]
+            )
+
+    def run(self, jobs: List[Dict], **upload_options) -> Dict[str, Dict]:
+        """
+        Upload the artifacts, then submit and track every job
+        jobs: List[Dict] : job definitions
+        upload_options: options of `upload`
+
+        return: Dict[str, Dict] : jr_response of each job name
+        """
+        src_dest_uris = self.upload(jobs, **upload_options)
+        concurrency = self.get_concurrency()
+        rich.print(
+            f"Submitting {len(jobs)} jobs with at most {concurrency} running at once"
+        )
+        asyncio.run(self._run(jobs, src_dest_uris, concurrency))
+
+        return {
+            **{
+                job_name: self.tracker.responses.get(job_run_id, {})
+                for job_name, job_run_id in self.job_run_ids.items()
+            },
+            **self.submit_failures,
+        }
@@ -0,0 +1,97 @@
+"""
+Process-wide boto3 sessions and clients. Clients are thread safe, so one client per
+(service, region, profile) is shared by every deployment, uploader and tracker of
+the process instead of each creating its own with the default 10-connection pool.
+"""
+
+import threading
+from typing import Dict, Optional
+
+DEFAULT_CLIENT_CONFIG = {
+    # parallel uploads and multi-job trackers share the same connection pool
+    "max_pool_connections": 50,
+    "retry_mode": "standard",
+    "max_attempts": 5,
+    "connect_timeout": 10,
+    "read_timeout": 60,
+}
+
+_lock = threading.Lock()
+_client_config = dict(DEFAULT_CLIENT_CONFIG)
+_sessions = {}
+_clients = {}
+
+
+def configure_clients(**options) -> Dict:
+    """
+    Set the connection settings of the clients created from now on. Clients already
+    created are dropped so that the new settings apply everywhere.
+    options: settings among `DEFAULT_CLIENT_CONFIG`, e.g. max_pool_connections=100
+
+    return: Dict : settings in use
+    """
+    unknown = set(options) - set(DEFAULT_CLIENT_CONFIG)
+    if unknown:
+        raise ValueError(
+            f"Unknown client settings {sorted(unknown)}, expected one of {sorted(DEFAULT_CLIENT_CONFIG)}"
+        )
+    with _lock:
+        _client_config.update(options)
+        _clients.clear()
+        return dict(_client_config)
+
+
+def reset_clients():
+    """Drop the cached sessions and clients, and restore the default settings"""
+    with _lock:
+        _client_config.clear()
+        _client_config.update(DEFAULT_CLIENT_CONFIG)
+        _sessions.clear()
+        _clients.clear()
+
+
+def _get_session(profile: Optional[str]):
+    """Session of an AWS profile, the default credentials chain when empty"""
+    import boto3
+
+    session = _sessions.get(profile)
+    if session is None:
+        session = boto3.session.Session(profile_name=profile or None)
+        _sessions[profile] = session
+    return session
+
+
+def get_client(service: str, region: str = "", profile: str = ""):
+    """
+    Shared client of an AWS service
+    service: str : service name, e.g. s3
+    region: str : region, the default region of the profile when empty
+    profile: str : AWS profile, e.g. one assuming a role through `role_arn`
+
+    return: boto3.client : client
+    """
+    key = (service, region or None, profile or None)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+
+    from botocore.config import Config
+
+    # sessions are not thread safe, create clients one at a time
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            config = Config(
+                max_pool_connections=_client_config["max_pool_connections"],
+                retries={
+                    "mode": _client_config["retry_mode"],
+                    "max_attempts": _client_config["max_attempts"],
+                },
+                connect_timeout=_client_config["connect_timeout"],
+                read_timeout=_client_config["read_timeout"],
+            )
+            client = _get_session(profile or None).client(
+                service, region_name=region or None, config=config
+            )
+            _clients[key] = client
+    return client
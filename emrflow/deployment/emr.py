@@ -1,14 +1,34 @@
 """EMR class to interact with EMR"""
 
+import json
+import os
 from abc import ABC, abstractmethod
-from datetime import datetime, timedelta
-from time import sleep
-from typing import Dict, List, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from time import sleep, time
+from typing import Dict, Iterator, List, Optional, Tuple
 
-import boto3
 import rich
 
-from emrflow.utils import print_s3_gz, upload_package
+from emrflow.deployment.clients import get_client
+from emrflow.utils import (
+    CONTENT_ADDRESSED_DIR,
+    CONTENT_ADDRESSED_PATTERN,
+    DEFAULT_MULTIPART_CHUNK_SIZE,
+    DEFAULT_UPLOAD_CONCURRENCY,
+    AdaptivePoller,
+    is_throttling_error,
+    parse_bucket_uri,
+    upload_package,
+)
+
+JOB_TERMINAL_STATES = [
+    "SUCCESS",
+    "FAILED",
+    "CANCELLING",
+    "CANCELLED",
+    "COMPLETED",
+]
 
 
 class EMR(ABC):
@@ -22,6 +42,7 @@ class EMR(ABC):
         job_role: str,
         region: str,
         emr_type: str,
+        profile: str = "",
     ) -> None:
         """
         Initialize EMR class
@@ -29,18 +50,53 @@ class EMR(ABC):
         job_role: str : job role
         region: str : region
         emr_type: str : emr type
+        profile: str : AWS profile of the clients, the default credentials when empty
         """
 
         self.application_cluster_id = application_cluster_id
         self.job_role = job_role
-        self.s3_client = boto3.client("s3")
+        self.region = region
+        self.profile = profile
         self.s3_job_log_uri = ""
         self.err_log_uri = ""
         self.emr_type = emr_type
+        self._log_streamers = {}
+        # MetricsRecorder collecting the timings of the job runs, when set
+        self.metrics = None
+
+        # clients are shared by the process and fetched on first use, commands that
+        # do not call AWS skip importing boto3 altogether
+        self._s3_client = None
+        self._emr_client = None
+
+    @property
+    def s3_client(self):
+        """S3 client, created on first use"""
+        if self._s3_client is None:
+            self._s3_client = get_client("s3", profile=self.profile)
+        return self._s3_client
 
-        self.emr_client = boto3.client(emr_type)
-        if region:
-            self.emr_client = boto3.client(emr_type, region_name=region)
+    @s3_client.setter
+    def s3_client(self, client):
+        self._s3_client = client
+
+    @property
+    def emr_client(self):
+        """EMR client of the region, created on first use"""
+        if self._emr_client is None:
+            self._emr_client = get_client(
+                self.emr_type, region=self.region, profile=self.profile
+            )
+        return self._emr_client
+
+    @emr_client.setter
+    def emr_client(self, client):
+        self._emr_client = client
+
+    @abstractmethod
+    def get_job_log_prefix(self, s3_logs_uri: str, job_run_id: str) -> str:
+        """Abstract method to get the s3 uri of the logs of a job run"""
+        pass
 
     @abstractmethod
     def get_job_run(self, job_run_id: str) -> Dict:
@@ -62,6 +118,11 @@ class EMR(ABC):
         """Abstract method to list the jobs based on the states"""
         pass
 
+    @abstractmethod
+    def iter_job_runs(self, created_after: Optional[datetime] = None) -> Iterator:
+        """Abstract method to iterate over all job runs created after a date"""
+        pass
+
     @abstractmethod
     def cancel_job_run(self, job_run_id: str) -> Dict:
         """Abstract method for cancelling the job run"""
@@ -113,47 +174,153 @@ class EMR(ABC):
         return artifacts
 
     def upload_artifacts(
-        self, s3_code_uri: str, artifacts: List[str], excludes: List[str]
+        self,
+        s3_code_uri: str,
+        artifacts: List[str],
+        excludes: List[str],
+        upload_concurrency: int = DEFAULT_UPLOAD_CONCURRENCY,
+        multipart_chunk_size: int = DEFAULT_MULTIPART_CHUNK_SIZE,
+        skip_unchanged: bool = True,
+        content_addressed: bool = False,
     ) -> str:
         """
         Upload local artifacts to S3 bucket
         s3_code_uri: str : s3 code uri
         dist_dir: str : dist directory
+        upload_concurrency: int : number of parallel uploads
+        multipart_chunk_size: int : size (in MB) of each part of a multipart upload
+        skip_unchanged: bool : skip artifacts whose content is already in S3
+        content_addressed: bool : store artifacts by digest under `cas/`
 
         return: str : src_target
         """
-        src_targets = upload_package(self.s3_client, s3_code_uri, artifacts, excludes)
+        stats = {}
+        start = time()
+        src_targets = upload_package(
+            self.s3_client,
+            s3_code_uri,
+            artifacts,
+            excludes,
+            concurrency=upload_concurrency,
+            multipart_chunk_size=multipart_chunk_size,
+            skip_unchanged=skip_unchanged,
+            content_addressed=content_addressed,
+            stats=stats,
+        )
+        if self.metrics is not None:
+            self.metrics.record_upload(start, time(), stats["uploaded_bytes"])
         return src_targets
 
+    def gc_artifacts(
+        self, s3_code_uri: str, retention_days: int, dry_run: bool = False
+    ) -> List[str]:
+        """
+        Remove content-addressed artifacts not referenced by any recent job run.
+        Artifacts uploaded within the retention window are kept even if no job
+        run references them yet.
+        s3_code_uri: str : s3 code uri holding the `cas/` store
+        retention_days: int : job runs created in the last `retention_days` are scanned
+        dry_run: bool : only report the artifacts that would be removed
+
+        return: List[str] : removed s3 keys
+        """
+        created_after = datetime.now(timezone.utc) - timedelta(days=retention_days)
+        job_run_ids = [
+            job_run["id"] for job_run in self.iter_job_runs(created_after=created_after)
+        ]
+
+        # collect digests referenced by the recent job runs
+        with ThreadPoolExecutor(max_workers=DEFAULT_UPLOAD_CONCURRENCY) as executor:
+            job_runs = executor.map(self.get_job_run, job_run_ids)
+            referenced = {
+                digest
+                for job_run in job_runs
+                for digest in CONTENT_ADDRESSED_PATTERN.findall(
+                    json.dumps(job_run.get("jobDriver", {}))
+                )
+            }
+        rich.print(
+            f"{len(referenced)} artifacts referenced by {len(job_run_ids)} job runs"
+        )
+
+        bucket, prefix = parse_bucket_uri(s3_code_uri)
+        cas_prefix = os.path.join(prefix, CONTENT_ADDRESSED_DIR, "")
+        unreferenced = []
+        paginator = self.s3_client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=bucket, Prefix=cas_prefix):
+            for s3_object in page.get("Contents", []):
+                digest = s3_object["Key"][len(cas_prefix) :].split("/")[0]
+                if (
+                    digest not in referenced
+                    and s3_object["LastModified"] < created_after
+                ):
+                    unreferenced.append(s3_object["Key"])
+
+        rich.print(f"Unreferenced artifacts: {unreferenced}")
+        if dry_run:
+            return unreferenced
+
+        # delete_objects accepts at most 1000 keys per request
+        for start in range(0, len(unreferenced), 1000):
+            self.s3_client.delete_objects(
+                Bucket=bucket,
+                Delete={
+                    "Objects": [
+                        {"Key": key} for key in unreferenced[start : start + 1000]
+                    ],
+                    "Quiet": True,
+                },
+            )
+        return unreferenced
+
     def job_tracking(
-        self, job_run_id: str, show_logs: bool, ping_duration: int
+        self,
+        job_run_id: str,
+        show_logs: bool,
+        ping_duration: int,
+        show_executor_logs: bool = False,
     ) -> Tuple[bool, str, dict]:
         """
         Track job run status and logs
         job_run_id: str : job run id
         show_logs: bool : show logs of the job run
-        ping_duration: int : duration to ping the job run status
+        ping_duration: int : maximum duration between two job run status checks
+        show_executor_logs: bool : also show the logs of the executors
 
         return: bool : job_done
         return: str : job_state
         return: dict : jr_response
         """
-        job_done = False
         job_state = "SUBMITTED"
         jr_response = {}
         log_read_pos = 0
         start_time = datetime.now()
+        poller = AdaptivePoller(max_interval=ping_duration)
         rich.print(f"Log Location for job: {job_run_id} :- \n {self.s3_job_log_uri}")
         rich.print(
             f"Std err:- Log Location for job: {job_run_id} :- \n {self.err_log_uri}"
         )
 
-        while not job_done:
-            jr_response = self.get_job_run(job_run_id)
+        while True:
+            try:
+                jr_response = self.get_job_run(job_run_id)
+            except Exception as ex:
+                if not is_throttling_error(ex):
+                    raise
+                delay = poller.throttled()
+                rich.print(
+                    f"Throttled while getting job state, retrying in {delay:.0f}s"
+                )
+                sleep(delay)
+                continue
+
             new_state = jr_response.get("state")
-            if new_state != job_state:
+            state_changed = new_state != job_state
+            if state_changed:
                 rich.print(f"Job state is now: {new_state}")
                 job_state = new_state
+            if self.metrics is not None:
+                self.metrics.record_state(job_run_id, jr_response)
 
             if datetime.now() - start_time >= timedelta(minutes=10):
                 print(f"Dashboard: {self.get_dashboard_for_job_run(job_run_id)}")
@@ -161,51 +328,179 @@ class EMR(ABC):
 
             if show_logs:
                 try:
-                    log_read_pos = self.show_logs(job_run_id, log_read_pos=log_read_pos)
+                    log_read_pos = self.show_logs(
+                        job_run_id,
+                        log_read_pos=log_read_pos,
+                        jr_response=jr_response,
+                        executor_logs=show_executor_logs,
+                    )
                 except Exception as ex:
                     print(ex)
 
-            job_done = new_state in [
-                "SUCCESS",
-                "FAILED",
-                "CANCELLING",
-                "CANCELLED",
-                "COMPLETED",
-            ]
-            sleep(ping_duration)
+            if new_state in JOB_TERMINAL_STATES:
+                break
+            sleep(poller.next_delay(state_changed))
 
-        return job_done, jr_response.get("state"), jr_response
+        return True, jr_response.get("state"), jr_response
 
-    def show_logs(self, job_run_id: str, log_read_pos: int) -> int:
+    def __job_run_log_prefix(self, job_run_id: str, jr_response: Dict) -> str:
         """
-        Print logs of completed job_id
+        S3 uri of the logs of a job run, from its monitoring configuration
         job_run_id: str : job run id
-        log_read_pos: int : log read position
+        jr_response: Dict : job run
 
-        return: int : log_read_pos
+        return: str : s3 uri of the job run logs
         """
-        jr_response = self.get_job_run(job_run_id)
         s3_logs_uri = (
             jr_response.get("configurationOverrides")
             .get("monitoringConfiguration")
             .get("s3MonitoringConfiguration")
             .get("logUri")
         )
+        return self.get_job_log_prefix(s3_logs_uri, job_run_id)
 
-        try:
-            return print_s3_gz(
+    def download_logs(
+        self,
+        job_run_id: str,
+        dest: str = "",
+        directories: Optional[List[str]] = None,
+    ) -> Dict:
+        """
+        Download the log objects of a job run to the local log cache, in parallel.
+        Logs of a finished job run that were already downloaded are served from the
+        cache without any request.
+        job_run_id: str : job run id
+        dest: str : also copy the logs to this directory
+        directories: List[str] : only these directories of the job log prefix, e.g.
+            SPARK_DRIVER, all of them when None
+
+        return: Dict : key relative to the job log prefix to the local path
+        """
+        from emrflow.deployment.logs import LogCache
+        from emrflow.package.env_cache import link_or_copy
+
+        cache = LogCache()
+        if cache.is_complete(job_run_id, directories or [""]):
+            files = cache.files(job_run_id, directories)
+        else:
+            jr_response = self.get_job_run(job_run_id)
+            files = cache.sync(
                 self.s3_client,
-                self.s3_job_log_uri.replace("s3_logs_uri", s3_logs_uri).replace(
-                    "job_run_id", job_run_id
-                ),
-                last_position=log_read_pos,
+                job_run_id,
+                self.__job_run_log_prefix(job_run_id, jr_response),
+                directories=directories,
+                complete=jr_response.get("state") in JOB_TERMINAL_STATES,
+            )
+
+        if dest:
+            dest_files = {}
+            for relative_key, path in files.items():
+                dest_files[relative_key] = os.path.join(dest, relative_key)
+                os.makedirs(os.path.dirname(dest_files[relative_key]), exist_ok=True)
+                link_or_copy(path, dest_files[relative_key])
+            return dest_files
+        return files
+
+    def print_logs(self, job_run_id: str, executor_logs: bool = False) -> int:
+        """
+        Print the driver logs of a job run, and optionally the executor logs, from the
+        local log cache, downloading only the logs that are missing or changed
+        job_run_id: str : job run id
+        executor_logs: bool : also print the logs of the executors
+
+        return: int : number of lines printed
+        """
+        from emrflow.deployment.logs import DRIVER_DIR, EXECUTOR_DIR, print_local_logs
+
+        directories = [DRIVER_DIR] + ([EXECUTOR_DIR] if executor_logs else [])
+        return print_local_logs(self.download_logs(job_run_id, directories=directories))
+
+    def search_logs(
+        self,
+        job_run_id: str,
+        pattern: str,
+        context: int = 2,
+        max_matches: int = 0,
+        ignore_case: bool = False,
+    ) -> int:
+        """
+        Search every log object of a job run for a pattern, streaming the objects
+        concurrently. Objects already in the local log cache with the same ETag are
+        read from the cache, finished job runs fully cached make no request.
+        job_run_id: str : job run id
+        pattern: str : regular expression searched in every line
+        context: int : lines printed before and after each match
+        max_matches: int : stop after this many matches, 0 for no limit
+        ignore_case: bool : case insensitive search
+
+        return: int : number of matches
+        """
+        from emrflow.deployment.logs import LogCache, LogSearcher, list_log_objects
+
+        cache = LogCache()
+        if cache.is_complete(job_run_id, [""]):
+            log_objects = {
+                relative_key: lambda path=path: open(path, "rb")
+                for relative_key, path in cache.files(job_run_id).items()
+            }
+        else:
+            log_prefix = self.__job_run_log_prefix(
+                job_run_id, self.get_job_run(job_run_id)
             )
-        except Exception as e:
-            print("Error in printing logs")
-            return print_s3_gz(
+            bucket, _ = parse_bucket_uri(log_prefix)
+            log_objects = {}
+            for relative_key, item in list_log_objects(
+                self.s3_client, log_prefix
+            ).items():
+                path = cache.cached_path(job_run_id, relative_key, item.get("ETag"))
+                if path:
+                    log_objects[relative_key] = lambda path=path: open(path, "rb")
+                else:
+                    log_objects[relative_key] = lambda key=item["Key"]: (
+                        self.s3_client.get_object(Bucket=bucket, Key=key)["Body"]
+                    )
+
+        searcher = LogSearcher(
+            pattern, context=context, max_matches=max_matches, ignore_case=ignore_case
+        )
+        return searcher.search(log_objects)
+
+    def show_logs(
+        self,
+        job_run_id: str,
+        log_read_pos: int,
+        jr_response: Optional[Dict] = None,
+        executor_logs: bool = False,
+    ) -> int:
+        """
+        Print the new logs of a job run: driver stdout and stderr, and optionally the
+        executor logs, each line prefixed by its source
+        job_run_id: str : job run id
+        log_read_pos: int : log read position returned by the previous call, 0 to
+            print the logs from the start
+        jr_response: Dict : job run already fetched by the caller, if any
+        executor_logs: bool : also print the logs of the executors
+
+        return: int : log_read_pos
+        """
+        from emrflow.deployment.logs import LogStreamer
+
+        if jr_response is None:
+            jr_response = self.get_job_run(job_run_id)
+
+        # keep the streamer between polls so only new compressed bytes are fetched
+        streamer = self._log_streamers.get(job_run_id)
+        if streamer is None or streamer.position != log_read_pos:
+            streamer = LogStreamer(
                 self.s3_client,
-                self.err_log_uri.replace("s3_logs_uri", s3_logs_uri).replace(
-                    "job_run_id", job_run_id
-                ),
-                last_position=0,
+                self.__job_run_log_prefix(job_run_id, jr_response),
+                executor_logs=executor_logs,
             )
+            self._log_streamers[job_run_id] = streamer
+
+        finished = jr_response.get("state") in JOB_TERMINAL_STATES
+        streamer.print_new(final=finished)
+        if finished:
+            # nothing more is written, release the tailers of its logs
+            self._log_streamers.pop(job_run_id, None)
+        return streamer.position
@@ -1,13 +1,19 @@
 """EMR Serverless class"""
 
+import re
+from datetime import datetime
 from os.path import join
-from typing import Dict, List, Optional, Tuple
+from time import time
+from typing import Dict, Iterator, List, Optional, Tuple
 
 import rich
 
 from emrflow.deployment.emr import EMR
 from emrflow.utils import convert_to_dict
 
+# maximum number of job runs returned by a single list_job_runs call
+LIST_JOB_RUNS_PAGE_SIZE = 50
+
 
 class EMRServerless(EMR):
     """
@@ -19,12 +25,14 @@ class EMRServerless(EMR):
         application_id: str,
         job_role: str,
         region: str = "",
+        profile: str = "",
     ) -> None:
         super().__init__(
             application_cluster_id=application_id,
             job_role=job_role,
             region=region,
             emr_type="emr-serverless",
+            profile=profile,
         )
         self.s3_job_log_uri, self.err_log_uri = self.__get_s3_log_uri(
             "s3_logs_uri", "job_run_id"
@@ -39,32 +47,41 @@ class EMRServerless(EMR):
 
         return: str : s3_job_log_uri, err_log_uri
         """
-        s3_job_log_uri = join(
-            f"{s3_logs_uri}",
-            "applications",
-            self.application_cluster_id,
-            "jobs",
-            job_run_id,
-            "SPARK_DRIVER",
-            "stdout.gz",
-        )
+        job_log_prefix = self.get_job_log_prefix(s3_logs_uri, job_run_id)
+        s3_job_log_uri = join(job_log_prefix, "SPARK_DRIVER", "stdout.gz")
+        err_log_uri = join(job_log_prefix, "SPARK_DRIVER", "stderr.gz")
 
-        err_log_uri = join(
+        return s3_job_log_uri, err_log_uri
+
+    def get_job_log_prefix(self, s3_logs_uri: str, job_run_id: str) -> str:
+        """
+        Get the s3 uri under which the driver and executor logs of a job run are
+        written
+        s3_logs_uri: str : s3 logs uri of the job run
+        job_run_id: str : job run id
+
+        return: str : s3 uri of the job run logs
+        """
+        return join(
             f"{s3_logs_uri}",
             "applications",
             self.application_cluster_id,
             "jobs",
             job_run_id,
-            "SPARK_DRIVER",
-            "stderr.gz",
         )
 
-        return s3_job_log_uri, err_log_uri
-
     def __entry_point(
-        self, job_driver: Dict, s3_code_uri: str, entry_point_uri: str
+        self,
+        job_driver: Dict,
+        s3_code_uri: str,
+        entry_point_uri: str,
+        src_dest_uri: Optional[Dict] = None,
     ) -> Dict:
-        job_driver["sparkSubmit"]["entryPoint"] = f"{s3_code_uri}/{entry_point_uri}"
+        if src_dest_uri and entry_point_uri in src_dest_uri:
+            # uploaded location, which may be content-addressed
+            job_driver["sparkSubmit"]["entryPoint"] = src_dest_uri[entry_point_uri]
+        else:
+            job_driver["sparkSubmit"]["entryPoint"] = f"{s3_code_uri}/{entry_point_uri}"
         return job_driver
 
     def __spark_submit_parameters(
@@ -80,8 +97,18 @@ class EMRServerless(EMR):
         """
 
         if spark_submit_opts:
-            for key, value in src_dest_uri.items():
-                spark_submit_opts = spark_submit_opts.replace(key, value)
+            if src_dest_uri:
+                # substitute in a single pass, longest paths first, so an uploaded
+                # location is never rewritten again by a shorter local path
+                pattern = re.compile(
+                    "|".join(
+                        re.escape(key)
+                        for key in sorted(src_dest_uri, key=len, reverse=True)
+                    )
+                )
+                spark_submit_opts = pattern.sub(
+                    lambda match: src_dest_uri[match.group(0)], spark_submit_opts
+                )
 
             job_driver["sparkSubmit"][
                 "sparkSubmitParameters"
@@ -104,6 +131,17 @@ class EMRServerless(EMR):
             }
         return config_overrides
 
+    def get_application(self) -> Dict:
+        """
+        Get details of the EMR Serverless application
+
+        return: dict : application
+        """
+        application_response = self.emr_client.get_application(
+            applicationId=self.application_cluster_id
+        )
+        return application_response.get("application")
+
     def get_job_run(self, job_run_id: str) -> Dict:
         """
         Get job run details for a given job run id
@@ -128,18 +166,43 @@ class EMRServerless(EMR):
 
     def list_job_runs(self, max_results: int, states: List) -> List:
         """
-        List job runs
+        List job runs, following nextToken until max_results job runs are found
         max_results: int : maximum results
         states: List : states
 
         return: List : job_runs
         """
-        job_runs_response = self.emr_client.list_job_runs(
-            applicationId=self.application_cluster_id,
-            maxResults=max_results,
-            states=states,
-        )
-        return job_runs_response.get("jobRuns")
+        job_runs = []
+        kwargs = {
+            "applicationId": self.application_cluster_id,
+            "maxResults": min(max_results, LIST_JOB_RUNS_PAGE_SIZE),
+            "states": states,
+        }
+        while len(job_runs) < max_results:
+            job_runs_response = self.emr_client.list_job_runs(**kwargs)
+            job_runs.extend(job_runs_response.get("jobRuns"))
+            if not job_runs_response.get("nextToken"):
+                break
+            kwargs["nextToken"] = job_runs_response.get("nextToken")
+            kwargs["maxResults"] = min(
+                max_results - len(job_runs), LIST_JOB_RUNS_PAGE_SIZE
+            )
+        return job_runs[:max_results]
+
+    def iter_job_runs(self, created_after: Optional[datetime] = None) -> Iterator:
+        """
+        Iterate over all job runs, following the pagination of list_job_runs
+        created_after: datetime : only job runs created after this date
+
+        return: Iterator : job_runs
+        """
+        kwargs = {"applicationId": self.application_cluster_id}
+        if created_after:
+            kwargs["createdAtAfter"] = created_after
+
+        paginator = self.emr_client.get_paginator("list_job_runs")
+        for page in paginator.paginate(**kwargs):
+            yield from page.get("jobRuns", [])
 
     def cancel_job_run(self, job_run_id: str) -> Dict:
         """
@@ -167,6 +230,7 @@ class EMRServerless(EMR):
         ping_duration: int = 30,
         tags: Optional[List[str]] = None,
         src_dest_uri: Dict = None,
+        show_executor_logs: bool = False,
     ) -> str:
         """
         Submit a job to EMR Serverless
@@ -182,6 +246,7 @@ class EMRServerless(EMR):
         ping_duration (int): Duration between pings
         tags (List[str]): Custom tags for the job
         src_dest_uri (Dict): Source and destination URI
+        show_executor_logs (bool): Also show the logs of the executors
 
         return: str : job_run_id
         """
@@ -190,7 +255,9 @@ class EMRServerless(EMR):
             raise RuntimeError("--show_stdout requires --s3_logs_uri to be set.")
 
         job_driver = {"sparkSubmit": {}}
-        job_driver = self.__entry_point(job_driver, s3_code_uri, entry_point_uri)
+        job_driver = self.__entry_point(
+            job_driver, s3_code_uri, entry_point_uri, src_dest_uri
+        )
         job_driver = self.__spark_submit_parameters(
             job_driver, src_dest_uri, spark_submit_opts
         )
@@ -203,6 +270,7 @@ class EMRServerless(EMR):
         config_overrides = {}
         config_overrides = self.__configure_overrides(config_overrides, s3_logs_uri)
 
+        submit_start = time()
         response = self.emr_client.start_job_run(
             applicationId=self.application_cluster_id,
             executionRoleArn=self.job_role,
@@ -213,6 +281,8 @@ class EMRServerless(EMR):
             executionTimeoutMinutes=execution_timeout,
         )
         job_run_id = response.get("jobRunId")
+        if self.metrics is not None:
+            self.metrics.record_submit(job_run_id, job_name, submit_start, time())
 
         rich.print(f"Job submitted to EMR Serverless (Job Run ID: {job_run_id})")
         if not wait and not show_logs:
@@ -223,7 +293,7 @@ class EMRServerless(EMR):
             s3_logs_uri, job_run_id
         )
         _, job_state, jr_response = self.job_tracking(
-            job_run_id, show_logs, ping_duration
+            job_run_id, show_logs, ping_duration, show_executor_logs=show_executor_logs
         )
 
         if job_state != "SUCCESS":
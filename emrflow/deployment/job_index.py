@@ -0,0 +1,279 @@
+"""Local SQLite index of job runs for fast listing and searching"""
+
+import json
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from emrflow.deployment.emr import EMR, JOB_TERMINAL_STATES
+from emrflow.utils import get_emrflow_home
+
+# margin when refreshing, covers clock skew between this host and AWS
+SYNC_OVERLAP = timedelta(minutes=5)
+
+# states after which a job run no longer changes
+FINAL_STATES = [state for state in JOB_TERMINAL_STATES if state != "CANCELLING"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS job_runs (
+    application_id TEXT NOT NULL,
+    id TEXT NOT NULL,
+    name TEXT,
+    state TEXT,
+    created_at TEXT,
+    updated_at TEXT,
+    arn TEXT,
+    release_label TEXT,
+    details TEXT,
+    PRIMARY KEY (application_id, id)
+);
+CREATE INDEX IF NOT EXISTS job_runs_name ON job_runs (application_id, name);
+CREATE INDEX IF NOT EXISTS job_runs_state ON job_runs (application_id, state);
+CREATE INDEX IF NOT EXISTS job_runs_created_at ON job_runs (application_id, created_at);
+CREATE TABLE IF NOT EXISTS job_run_tags (
+    application_id TEXT NOT NULL,
+    job_run_id TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT,
+    PRIMARY KEY (application_id, job_run_id, key)
+);
+CREATE INDEX IF NOT EXISTS job_run_tags_key ON job_run_tags (application_id, key, value);
+CREATE TABLE IF NOT EXISTS sync_state (
+    application_id TEXT PRIMARY KEY,
+    last_sync TEXT
+);
+"""
+
+
+def to_utc_iso(value) -> Optional[str]:
+    """
+    Convert a datetime returned by boto3 to a sortable UTC ISO string
+    value: datetime : datetime with or without timezone
+
+    return: Optional[str] : ISO string
+    """
+    if not isinstance(value, datetime):
+        return value
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc).isoformat()
+
+
+class JobRunIndex:
+    """
+    Index of the job runs of an application kept in a local SQLite database. The
+    index is refreshed incrementally with `createdAtAfter`, going back to the
+    oldest job run that was not finished at the previous refresh.
+    """
+
+    def __init__(self, emr: EMR, db_path: Optional[str] = None, max_workers: int = 8):
+        """
+        emr: EMR : emr deployment whose job runs are indexed
+        db_path: str : SQLite database, defaults to <emrflow home>/job_runs.db
+        max_workers: int : parallel get_job_run calls fetching the tags of new runs
+        """
+        self._emr = emr
+        self._application_id = emr.application_cluster_id
+        self._max_workers = max_workers
+        self._db_path = db_path or os.path.join(get_emrflow_home(), "job_runs.db")
+        os.makedirs(os.path.dirname(os.path.abspath(self._db_path)), exist_ok=True)
+        self._connection = sqlite3.connect(self._db_path)
+        self._connection.row_factory = sqlite3.Row
+        self._connection.executescript(SCHEMA)
+
+    def close(self):
+        """Close the database"""
+        self._connection.close()
+
+    def _refresh_since(self) -> Optional[datetime]:
+        """
+        Creation date from which job runs must be listed again
+
+        return: Optional[datetime] : None when the index is empty
+        """
+        row = self._connection.execute(
+            "SELECT last_sync FROM sync_state WHERE application_id = ?",
+            (self._application_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        since = datetime.fromisoformat(row["last_sync"])
+
+        # job runs still running at the last refresh may have changed state
+        placeholders = ",".join("?" * len(FINAL_STATES))
+        row = self._connection.execute(
+            f"""SELECT MIN(created_at) AS created_at FROM job_runs
+            WHERE application_id = ? AND state NOT IN ({placeholders})""",
+            (self._application_id, *FINAL_STATES),
+        ).fetchone()
+        if row["created_at"]:
+            since = min(since, datetime.fromisoformat(row["created_at"]))
+        return since - SYNC_OVERLAP
+
+    def refresh(self) -> int:
+        """
+        Fetch the job runs created or updated since the last refresh
+
+        return: int : number of job runs fetched
+        """
+        sync_time = datetime.now(timezone.utc)
+        job_runs = list(self._emr.iter_job_runs(created_after=self._refresh_since()))
+
+        known = {
+            row["id"]: row["details"]
+            for row in self._connection.execute(
+                "SELECT id, details FROM job_runs WHERE application_id = ?",
+                (self._application_id,),
+            )
+        }
+        # tags are not part of list_job_runs, fetch them for runs not seen yet and
+        # keep the full details of finished runs which no longer change
+        to_describe = [
+            job_run["id"]
+            for job_run in job_runs
+            if job_run["id"] not in known
+            or (known[job_run["id"]] is None and job_run["state"] in FINAL_STATES)
+        ]
+        with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+            details = dict(
+                zip(to_describe, executor.map(self._emr.get_job_run, to_describe))
+            )
+
+        with self._connection:
+            for job_run in job_runs:
+                self._upsert(job_run, details.get(job_run["id"]))
+            self._connection.execute(
+                "INSERT OR REPLACE INTO sync_state (application_id, last_sync) VALUES (?, ?)",
+                (self._application_id, sync_time.isoformat()),
+            )
+        return len(job_runs)
+
+    def _upsert(self, job_run: Dict, details: Optional[Dict]):
+        """Insert or update a job run summary and, when fetched, its details"""
+        self._connection.execute(
+            """INSERT INTO job_runs
+            (application_id, id, name, state, created_at, updated_at, arn, release_label)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (application_id, id) DO UPDATE SET
+            name = excluded.name, state = excluded.state,
+            updated_at = excluded.updated_at""",
+            (
+                self._application_id,
+                job_run["id"],
+                job_run.get("name"),
+                job_run.get("state"),
+                to_utc_iso(job_run.get("createdAt")),
+                to_utc_iso(job_run.get("updatedAt")),
+                job_run.get("arn"),
+                job_run.get("releaseLabel"),
+            ),
+        )
+        if details is None:
+            return
+
+        if details.get("state") in FINAL_STATES:
+            self._save_details(details, job_run["id"])
+        for key, value in (details.get("tags") or {}).items():
+            self._connection.execute(
+                "INSERT OR REPLACE INTO job_run_tags VALUES (?, ?, ?, ?)",
+                (self._application_id, job_run["id"], key, value),
+            )
+
+    def _save_details(self, details: Dict, job_run_id: str):
+        self._connection.execute(
+            "UPDATE job_runs SET details = ? WHERE application_id = ? AND id = ?",
+            (
+                json.dumps(details, default=to_utc_iso),
+                self._application_id,
+                job_run_id,
+            ),
+        )
+
+    def save_details(self, details: Dict, job_run_id: Optional[str] = None):
+        """
+        Keep the get_job_run response of a finished job run
+        details: Dict : get_job_run response
+        job_run_id: str : job run id, defaults to the id of the response
+        """
+        with self._connection:
+            self._save_details(details, job_run_id or details.get("jobRunId"))
+
+    def get_details(self, job_run_id: str) -> Optional[Dict]:
+        """
+        Cached get_job_run response of a finished job run
+        job_run_id: str : job run id
+
+        return: Optional[Dict] : get_job_run response, None if not cached
+        """
+        row = self._connection.execute(
+            "SELECT details FROM job_runs WHERE application_id = ? AND id = ?",
+            (self._application_id, job_run_id),
+        ).fetchone()
+        if row is None or row["details"] is None:
+            return None
+        return json.loads(row["details"])
+
+    def search(
+        self,
+        name: Optional[str] = None,
+        states: Optional[List[str]] = None,
+        tags: Optional[Dict[str, str]] = None,
+        created_after: Optional[datetime] = None,
+        limit: Optional[int] = None,
+    ) -> List[Dict]:
+        """
+        Search indexed job runs, newest first
+        name: str : substring of the job name
+        states: List[str] : job run states
+        tags: Dict[str, str] : tags the job runs must all have
+        created_after: datetime : only job runs created after this date
+        limit: int : maximum results
+
+        return: List[Dict] : job runs
+        """
+        query = "SELECT * FROM job_runs WHERE application_id = ?"
+        params = [self._application_id]
+        if name:
+            query += " AND name LIKE ?"
+            params.append(f"%{name}%")
+        if states:
+            query += f" AND state IN ({','.join('?' * len(states))})"
+            params.extend(states)
+        if created_after:
+            query += " AND created_at > ?"
+            params.append(to_utc_iso(created_after))
+        for key, value in (tags or {}).items():
+            query += """ AND id IN (SELECT job_run_id FROM job_run_tags
+                WHERE application_id = ? AND key = ? AND value = ?)"""
+            params.extend([self._application_id, key, value])
+        query += " ORDER BY created_at DESC"
+        if limit:
+            query += " LIMIT ?"
+            params.append(limit)
+
+        job_runs = []
+        for row in self._connection.execute(query, params):
+            job_run = {
+                key: row[key]
+                for key in ["id", "name", "state", "created_at", "updated_at", "arn"]
+            }
+            job_run["tags"] = self.get_tags(row["id"])
+            job_runs.append(job_run)
+        return job_runs
+
+    def get_tags(self, job_run_id: str) -> Dict[str, str]:
+        """
+        Tags of an indexed job run
+        job_run_id: str : job run id
+
+        return: Dict[str, str] : tags
+        """
+        return {
+            row["key"]: row["value"]
+            for row in self._connection.execute(
+                "SELECT key, value FROM job_run_tags WHERE application_id = ? AND job_run_id = ?",
+                (self._application_id, job_run_id),
+            )
+        }
@@ -0,0 +1,566 @@
+"""Stream the driver and executor logs of a job run from S3, or serve them locally"""
+
+import codecs
+import gzip
+import io
+import json
+import os
+import re
+import threading
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from typing import IO, Callable, Dict, Iterator, List, Optional
+
+import rich
+from rich.markup import escape
+
+from emrflow.utils import S3GzipLogTailer, get_emrflow_home, parse_bucket_uri
+
+DRIVER_DIR = "SPARK_DRIVER"
+EXECUTOR_DIR = "SPARK_EXECUTOR"
+LOG_FILES = ["stdout.gz", "stderr.gz"]
+SOURCE_STYLES = {"stdout": "cyan", "stderr": "magenta"}
+LOG_CACHE_MANIFEST = "manifest.json"
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+LOCAL_READ_BYTES = 1024 * 1024
+
+
+def log_source(relative_key: str) -> Optional[str]:
+    """
+    Name of the log source of an object of the job log prefix
+    relative_key: str : key relative to the job log prefix, e.g.
+        SPARK_EXECUTOR/3/stderr.gz
+
+    return: Optional[str] : e.g. `executor 3 stderr`, None if not a log stream
+    """
+    parts = relative_key.split("/")
+    if parts[-1] not in LOG_FILES:
+        return None
+    stream = parts[-1][: -len(".gz")]
+    if parts[:-1] == [DRIVER_DIR]:
+        return f"driver {stream}"
+    if len(parts) == 3 and parts[0] == EXECUTOR_DIR:
+        return f"executor {parts[1]} {stream}"
+    return None
+
+
+def format_log_line(source: str, line: str) -> str:
+    """
+    Log line prefixed by its source, styled by stream
+    source: str : log source, e.g. `driver stdout`
+    line: str : log line
+
+    return: str : rich markup of the line
+    """
+    style = SOURCE_STYLES[source.rsplit(" ", 1)[-1]]
+    return f"[{style}]{source}[/{style}] | {escape(line)}"
+
+
+class LogStreamer:
+    """
+    Tail the driver stdout and stderr of a job run, and optionally the logs of
+    every executor. Each log has its own tailer and offset. On every poll, listing
+    the log prefix finds the logs that changed, only those are fetched, in parallel,
+    and their new lines are printed prefixed by their source.
+    """
+
+    def __init__(
+        self,
+        s3_client,
+        log_prefix: str,
+        executor_logs: bool = False,
+        max_workers: int = 16,
+    ):
+        """
+        s3_client: boto3.client : s3 client
+        log_prefix: str : s3 uri of the logs of the job run,
+            <logUri>/applications/<application id>/jobs/<job run id>
+        executor_logs: bool : also stream the executor logs
+        max_workers: int : logs fetched in parallel
+        """
+        self._s3_client = s3_client
+        self._log_prefix = log_prefix.rstrip("/")
+        self._bucket, self._prefix = parse_bucket_uri(self._log_prefix)
+        self._directories = [DRIVER_DIR] + ([EXECUTOR_DIR] if executor_logs else [])
+        self._max_workers = max_workers
+        self._tailers = {}
+        self._etags = {}
+        self._partial_lines = {}
+        self._can_list = True
+
+    @property
+    def position(self) -> int:
+        """Number of decompressed bytes read so far, across all logs"""
+        return sum(tailer.position for tailer in self._tailers.values())
+
+    def _list_logs(self) -> Dict[str, Dict]:
+        """
+        Log objects of the job run. Without s3:ListBucket, the driver logs are
+        looked up directly, executor logs cannot be found
+
+        return: Dict[str, Dict] : source to the key and ETag of its object
+        """
+        from botocore.exceptions import ClientError
+
+        if not self._can_list:
+            return self._head_driver_logs()
+
+        logs = {}
+        paginator = self._s3_client.get_paginator("list_objects_v2")
+        try:
+            for directory in self._directories:
+                for page in paginator.paginate(
+                    Bucket=self._bucket, Prefix=f"{self._prefix}/{directory}/"
+                ):
+                    for item in page.get("Contents", []):
+                        source = log_source(item["Key"][len(self._prefix) + 1 :])
+                        if source:
+                            logs[source] = {
+                                "key": item["Key"],
+                                "etag": item.get("ETag"),
+                            }
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") != "AccessDenied":
+                raise
+            self._can_list = False
+            rich.print(
+                "Listing the logs is not allowed, streaming the driver logs only"
+            )
+            return self._head_driver_logs()
+        return logs
+
+    def _head_driver_logs(self) -> Dict[str, Dict]:
+        """
+        Driver log objects of the job run, found by their well-known keys
+
+        return: Dict[str, Dict] : source to the key and ETag of its object
+        """
+        from botocore.exceptions import ClientError
+
+        logs = {}
+        for name in LOG_FILES:
+            key = f"{self._prefix}/{DRIVER_DIR}/{name}"
+            try:
+                response = self._s3_client.head_object(Bucket=self._bucket, Key=key)
+            except ClientError:
+                # not written yet, without s3:ListBucket S3 answers 403 for it
+                continue
+            logs[log_source(f"{DRIVER_DIR}/{name}")] = {
+                "key": key,
+                "etag": response.get("ETag"),
+            }
+        return logs
+
+    def _read(self, source: str) -> Optional[str]:
+        """New logs of a source, None if they could not be fetched"""
+        try:
+            return self._tailers[source].read()
+        except Exception as e:
+            rich.print(f"Could not read the {source} logs: {escape(str(e))}")
+            return None
+
+    def poll(self) -> Dict[str, str]:
+        """
+        Fetch the logs appended since the previous poll
+
+        return: Dict[str, str] : source to its new logs, for logs that changed
+        """
+        changed = {}
+        for source, log in sorted(self._list_logs().items()):
+            if source not in self._tailers:
+                self._tailers[source] = S3GzipLogTailer(
+                    self._s3_client, f"s3://{self._bucket}/{log['key']}"
+                )
+            # an unchanged ETag means nothing was appended
+            if log["etag"] is None or log["etag"] != self._etags.get(source):
+                changed[source] = log["etag"]
+
+        if not changed:
+            return {}
+        with ThreadPoolExecutor(
+            max_workers=min(self._max_workers, len(changed))
+        ) as executor:
+            texts = dict(zip(changed, executor.map(self._read, changed)))
+
+        new_logs = {}
+        for source, text in texts.items():
+            # failed reads are retried on the next poll
+            if text is not None:
+                self._etags[source] = changed[source]
+                new_logs[source] = text
+        return new_logs
+
+    def print_new(self, final: bool = False) -> int:
+        """
+        Print the new lines of every log, prefixed by their source. Incomplete lines
+        are held until they end, or until the final call.
+        final: bool : the job run is over, print incomplete lines as well
+
+        return: int : number of lines printed
+        """
+        lines = []
+        for source, text in self.poll().items():
+            text = self._partial_lines.pop(source, "") + text
+            complete, newline, partial = text.rpartition("\n")
+            if partial:
+                self._partial_lines[source] = partial
+            if newline:
+                lines.extend(
+                    format_log_line(source, line) for line in complete.split("\n")
+                )
+        if final:
+            lines.extend(
+                format_log_line(source, partial)
+                for source, partial in sorted(self._partial_lines.items())
+            )
+            self._partial_lines = {}
+
+        if lines:
+            rich.print("\n".join(lines))
+        return len(lines)
+
+
+def list_log_objects(
+    s3_client, log_prefix: str, directories: Optional[List[str]] = None
+) -> Dict:
+    """
+    Objects under the log prefix of a job run
+    s3_client: boto3.client : s3 client
+    log_prefix: str : s3 uri of the logs of the job run
+    directories: List[str] : only list these directories, the whole prefix when None
+
+    return: Dict : key relative to the job log prefix to the listed object
+    """
+    bucket, prefix = parse_bucket_uri(log_prefix.rstrip("/"))
+    listed = {}
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for directory in directories or [""]:
+        list_prefix = f"{prefix}/{directory}/" if directory else f"{prefix}/"
+        for page in paginator.paginate(Bucket=bucket, Prefix=list_prefix):
+            for item in page.get("Contents", []):
+                listed[item["Key"][len(prefix) + 1 :]] = item
+    return listed
+
+
+class LogCache:
+    """
+    Log objects of job runs downloaded to <emrflow home>/logs/<job run id>. A manifest
+    records the ETag of every downloaded object, so a sync only downloads the objects
+    that changed. Once a directory of a finished job run was synced, its logs are
+    served locally without any S3 request.
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None, max_workers: int = 16):
+        """
+        cache_dir: str : cache directory, defaults to <emrflow home>/logs
+        max_workers: int : objects downloaded in parallel
+        """
+        self._cache_dir = cache_dir or os.path.join(get_emrflow_home(), "logs")
+        self._max_workers = max_workers
+
+    def job_dir(self, job_run_id: str) -> str:
+        """Directory of the cached logs of a job run"""
+        return os.path.join(self._cache_dir, job_run_id)
+
+    def _manifest_path(self, job_run_id: str) -> str:
+        return os.path.join(self.job_dir(job_run_id), LOG_CACHE_MANIFEST)
+
+    def _load_manifest(self, job_run_id: str) -> Dict:
+        """ETag of every cached object, and the directories synced after the end"""
+        try:
+            with open(self._manifest_path(job_run_id), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"objects": {}, "complete": []}
+
+    def _save_manifest(self, job_run_id: str, manifest: Dict):
+        path = self._manifest_path(job_run_id)
+        with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        os.replace(f"{path}.tmp", path)
+
+    def is_complete(self, job_run_id: str, directories: List[str]) -> bool:
+        """
+        Whether the directories were synced after the job run finished
+        job_run_id: str : job run id
+        directories: List[str] : directories relative to the job log prefix, an empty
+            string for the whole prefix
+
+        return: bool : the cached logs are final
+        """
+        complete = self._load_manifest(job_run_id)["complete"]
+        return "" in complete or all(directory in complete for directory in directories)
+
+    def cached_path(
+        self, job_run_id: str, relative_key: str, etag: str
+    ) -> Optional[str]:
+        """
+        Local copy of a log object, if it was downloaded with the same ETag
+        job_run_id: str : job run id
+        relative_key: str : key relative to the job log prefix
+        etag: str : current ETag of the object
+
+        return: Optional[str] : local path, None if not cached or outdated
+        """
+        path = os.path.join(self.job_dir(job_run_id), relative_key)
+        cached_etag = self._load_manifest(job_run_id)["objects"].get(relative_key)
+        if etag is not None and cached_etag == etag and os.path.isfile(path):
+            return path
+        return None
+
+    def files(self, job_run_id: str, directories: Optional[List[str]] = None) -> Dict:
+        """
+        Cached log files of a job run
+        job_run_id: str : job run id
+        directories: List[str] : only the files of these directories, all when None
+
+        return: Dict : key relative to the job log prefix to the local path
+        """
+        return {
+            relative_key: os.path.join(self.job_dir(job_run_id), relative_key)
+            for relative_key in sorted(self._load_manifest(job_run_id)["objects"])
+            if directories is None
+            or any(
+                relative_key.startswith(f"{directory}/") for directory in directories
+            )
+        }
+
+    def _download(self, s3_client, bucket: str, key: str, dest: str):
+        """Download an object, only replacing `dest` once it is complete"""
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        s3_client.download_file(bucket, key, f"{dest}.tmp")
+        os.replace(f"{dest}.tmp", dest)
+
+    def sync(
+        self,
+        s3_client,
+        job_run_id: str,
+        log_prefix: str,
+        directories: Optional[List[str]] = None,
+        complete: bool = False,
+    ) -> Dict:
+        """
+        Download the log objects of a job run that are missing or changed
+        s3_client: boto3.client : s3 client
+        job_run_id: str : job run id
+        log_prefix: str : s3 uri of the logs of the job run
+        directories: List[str] : only sync these directories, the whole prefix when None
+        complete: bool : the job run is over, its logs will not change anymore
+
+        return: Dict : key relative to the job log prefix to the local path
+        """
+        bucket, _ = parse_bucket_uri(log_prefix.rstrip("/"))
+        job_dir = self.job_dir(job_run_id)
+        manifest = self._load_manifest(job_run_id)
+
+        listed = list_log_objects(s3_client, log_prefix, directories)
+        changed = [
+            relative_key
+            for relative_key, item in listed.items()
+            if manifest["objects"].get(relative_key) != item.get("ETag")
+            or not os.path.isfile(os.path.join(job_dir, relative_key))
+        ]
+        if changed:
+            rich.print(f"Downloading {len(changed)} log objects of {job_run_id}")
+            with ThreadPoolExecutor(
+                max_workers=min(self._max_workers, len(changed))
+            ) as executor:
+                list(
+                    executor.map(
+                        lambda relative_key: self._download(
+                            s3_client,
+                            bucket,
+                            listed[relative_key]["Key"],
+                            os.path.join(job_dir, relative_key),
+                        ),
+                        changed,
+                    )
+                )
+
+        os.makedirs(job_dir, exist_ok=True)
+        for relative_key in changed:
+            manifest["objects"][relative_key] = listed[relative_key].get("ETag")
+        if complete:
+            manifest["complete"] = sorted(
+                set(manifest["complete"]) | set(directories or [""])
+            )
+        self._save_manifest(job_run_id, manifest)
+        return self.files(job_run_id, directories)
+
+
+def read_gzip_text(path: str, chunk_size: int = LOCAL_READ_BYTES) -> Iterator[str]:
+    """
+    Decompress a local gzip log chunk by chunk. Logs of a running job run end with
+    a truncated member, the text decompressed so far is returned instead of failing
+    path: str : local gzip log
+    chunk_size: int : compressed bytes read at a time
+
+    return: Iterator[str] : decompressed text
+    """
+    decompressor = zlib.decompressobj(GZIP_WBITS)
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            output = []
+            data = chunk
+            # logs made of concatenated gzip members
+            while data:
+                output.append(decompressor.decompress(data))
+                if not decompressor.eof:
+                    break
+                data = decompressor.unused_data
+                decompressor = zlib.decompressobj(GZIP_WBITS)
+            text = decoder.decode(b"".join(output))
+            if text:
+                yield text
+    text = decoder.decode(b"", final=True)
+    if text:
+        yield text
+
+
+def print_local_logs(files: Dict) -> int:
+    """
+    Print downloaded driver and executor logs, each line prefixed by its source.
+    Lines are printed while the logs are decompressed
+    files: Dict : key relative to the job log prefix to the local path
+
+    return: int : number of lines printed
+    """
+    printed = 0
+    for relative_key, path in sorted(files.items()):
+        source = log_source(relative_key)
+        if source is None:
+            continue
+        pending = ""
+        for text in read_gzip_text(path):
+            lines = (pending + text).split("\n")
+            pending = lines.pop()
+            if lines:
+                rich.print("\n".join(format_log_line(source, line) for line in lines))
+                printed += len(lines)
+        if pending:
+            rich.print(format_log_line(source, pending))
+            printed += 1
+    return printed
+
+
+class LogSearcher:
+    """
+    Search log objects for a pattern. Objects are searched concurrently, each one
+    streamed through the gzip decompressor and matched line by line, so memory use
+    does not depend on the size of the logs. Matches are printed as soon as they are
+    found with their source, line number and context lines, and the search stops
+    once `max_matches` matches were printed.
+    """
+
+    def __init__(
+        self,
+        pattern: str,
+        context: int = 2,
+        max_matches: int = 0,
+        ignore_case: bool = False,
+        max_workers: int = 16,
+    ):
+        """
+        pattern: str : regular expression searched in every line
+        context: int : lines printed before and after each match
+        max_matches: int : stop after this many matches, 0 for no limit
+        ignore_case: bool : case insensitive search
+        max_workers: int : log objects searched in parallel
+        """
+        self._regex = re.compile(pattern, re.IGNORECASE if ignore_case else 0)
+        self._context = context
+        self._max_matches = max_matches
+        self._max_workers = max_workers
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.matches = 0
+
+    def _emit(self, match: Dict):
+        """Print a match unless enough matches were already printed"""
+        with self._lock:
+            if self._stop.is_set():
+                return
+            self.matches += 1
+            style = SOURCE_STYLES.get(match["source"].rsplit(" ", 1)[-1], "yellow")
+            source = f"[{style}]{escape(match['source'])}[/{style}]"
+            first_line = match["line_number"] - len(match["before"])
+            lines = ["--"] if self._context and self.matches > 1 else []
+            lines.extend(
+                f"{source}-{first_line + i}- {escape(line)}"
+                for i, line in enumerate(match["before"])
+            )
+            lines.append(
+                f"{source}:{match['line_number']}: [bold]{escape(match['line'])}[/bold]"
+            )
+            lines.extend(
+                f"{source}-{match['line_number'] + i + 1}- {escape(line)}"
+                for i, line in enumerate(match["after"])
+            )
+            rich.print("\n".join(lines))
+            if self._max_matches and self.matches >= self._max_matches:
+                self._stop.set()
+
+    def _search_object(self, relative_key: str, opener: Callable[[], IO[bytes]]):
+        """
+        Stream a log object and emit its matches
+        relative_key: str : key relative to the job log prefix
+        opener: Callable : returns the binary stream of the object
+        """
+        if self._stop.is_set():
+            return
+        source = log_source(relative_key) or relative_key
+        before = deque(maxlen=self._context)
+        pending = []
+
+        with closing(opener()) as raw:
+            stream = gzip.GzipFile(fileobj=raw) if relative_key.endswith(".gz") else raw
+            text = io.TextIOWrapper(stream, encoding="utf-8", errors="replace")
+            for line_number, line in enumerate(text, 1):
+                if self._stop.is_set():
+                    return
+                line = line.rstrip("\n")
+                # the context after a match may contain other matches
+                for match in pending:
+                    match["after"].append(line)
+                while pending and len(pending[0]["after"]) >= self._context:
+                    self._emit(pending.pop(0))
+                if self._regex.search(line):
+                    match = {
+                        "source": source,
+                        "line_number": line_number,
+                        "line": line,
+                        "before": list(before),
+                        "after": [],
+                    }
+                    if self._context:
+                        pending.append(match)
+                    else:
+                        self._emit(match)
+                before.append(line)
+        for match in pending:
+            self._emit(match)
+
+    def _search_safe(self, item):
+        relative_key, opener = item
+        try:
+            self._search_object(relative_key, opener)
+        except Exception as e:
+            rich.print(f"Could not search {relative_key}: {escape(str(e))}")
+
+    def search(self, log_objects: Dict[str, Callable[[], IO[bytes]]]) -> int:
+        """
+        Search log objects concurrently
+        log_objects: Dict : key relative to the job log prefix to a callable
+            opening the binary stream of the object
+
+        return: int : number of matches printed
+        """
+        if log_objects:
+            with ThreadPoolExecutor(
+                max_workers=min(self._max_workers, len(log_objects))
+            ) as executor:
+                list(executor.map(self._search_safe, sorted(log_objects.items())))
+        return self.matches
@@ -0,0 +1,430 @@
+"""
+Timings and resource utilization of job runs: how long the artifacts took to upload,
+the job run to be accepted, queued, scheduled and run, and what it consumed. Records
+are kept in a local JSONL or SQLite store, and can be exported as Prometheus text or
+OpenTelemetry spans.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from emrflow.utils import get_emrflow_home
+
+# states of a job run before it reaches a terminal state
+TRACKED_STATES = ["SUBMITTED", "PENDING", "SCHEDULED", "RUNNING"]
+RESOURCE_UTILIZATION_KEYS = ["vCPUHour", "memoryGBHour", "storageGBHour"]
+# a submission started longer than this after the previous upload or submission
+# starts a new batch, which is not credited with the earlier uploads
+BATCH_GAP_SECONDS = 60
+# the JSONL store keeps this file and one rotated file
+JSONL_MAX_BYTES = 16 * 1024**2
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS job_run_metrics (
+    application_id TEXT NOT NULL,
+    job_run_id TEXT NOT NULL,
+    job_name TEXT,
+    recorded_at REAL,
+    record TEXT,
+    PRIMARY KEY (application_id, job_run_id)
+);
+CREATE INDEX IF NOT EXISTS job_run_metrics_recorded_at ON job_run_metrics (recorded_at);
+"""
+
+
+def default_metrics_path() -> str:
+    """Default metrics store, <emrflow home>/metrics.jsonl"""
+    return os.path.join(get_emrflow_home(), "metrics.jsonl")
+
+
+class JsonlMetricsStore:
+    """
+    Records appended as JSON lines to a file. Once the file reaches `max_bytes`
+    it is rotated to `<path>.1`, replacing the previous rotated file
+    """
+
+    def __init__(self, path: str, max_bytes: int = JSONL_MAX_BYTES):
+        """
+        path: str : JSONL file
+        max_bytes: int : size of the file rotated before appending, 0 to never rotate
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def append(self, record: Dict):
+        """Append a record"""
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        line = json.dumps(record) + "\n"
+        with self._lock:
+            if (
+                self.max_bytes
+                and os.path.isfile(self.path)
+                and os.path.getsize(self.path) >= self.max_bytes
+            ):
+                os.replace(self.path, f"{self.path}.1")
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+    def records(self, since: Optional[float] = None) -> List[Dict]:
+        """
+        Stored records, oldest first
+        since: float : only records recorded after this epoch time
+
+        return: List[Dict] : records
+        """
+        records = []
+        for path in [f"{self.path}.1", self.path]:
+            if not os.path.isfile(path):
+                continue
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    record = json.loads(line)
+                    if since is None or record.get("recorded_at", 0) >= since:
+                        records.append(record)
+        return records
+
+
+class SqliteMetricsStore:
+    """Records kept in a SQLite database, one row per job run"""
+
+    def __init__(self, path: str):
+        """
+        path: str : SQLite database
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # records are appended from the tracking threads
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.executescript(SQLITE_SCHEMA)
+
+    def append(self, record: Dict):
+        """Store a record, replacing a previous record of the same job run"""
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO job_run_metrics VALUES (?, ?, ?, ?, ?)",
+                (
+                    record.get("application_id"),
+                    record.get("job_run_id"),
+                    record.get("job_name"),
+                    record.get("recorded_at"),
+                    json.dumps(record),
+                ),
+            )
+
+    def records(self, since: Optional[float] = None) -> List[Dict]:
+        """
+        Stored records, oldest first
+        since: float : only records recorded after this epoch time
+
+        return: List[Dict] : records
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT record FROM job_run_metrics WHERE recorded_at >= ? ORDER BY recorded_at",
+                (since or 0,),
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+
+def open_metrics_store(path: Optional[str] = None):
+    """
+    Metrics store of a path, SQLite for .db/.sqlite files and JSONL otherwise
+    path: str : store path, defaults to <emrflow home>/metrics.jsonl
+
+    return: JsonlMetricsStore | SqliteMetricsStore : store
+    """
+    path = os.path.expanduser(path or default_metrics_path())
+    if path.endswith((".db", ".sqlite", ".sqlite3")):
+        return SqliteMetricsStore(path)
+    return JsonlMetricsStore(path)
+
+
+def phase_durations(phases: List[Dict]) -> Dict[str, float]:
+    """
+    Total duration of each phase of a record
+    phases: List[Dict] : phases with their name, start and end epoch times
+
+    return: Dict[str, float] : phase name to its duration in seconds
+    """
+    durations = {}
+    for phase in phases:
+        durations[phase["name"]] = durations.get(phase["name"], 0) + round(
+            phase["end"] - phase["start"], 3
+        )
+    return durations
+
+
+class MetricsRecorder:
+    """
+    Collect the timings of the job runs submitted and tracked by an EMR deployment.
+    The uploads preceding a batch of submissions are added up and attributed to the
+    job runs of that batch only, and the time spent in each state is measured
+    between the polls that observed the state changes. A record is written once a
+    job run seen before its end reaches a terminal state.
+    """
+
+    def __init__(
+        self,
+        store=None,
+        application_id: str = "",
+        exporters: Optional[List[Callable[[Dict], None]]] = None,
+    ):
+        """
+        store: JsonlMetricsStore | SqliteMetricsStore : where records are written,
+            defaults to <emrflow home>/metrics.jsonl
+        application_id: str : application of the job runs
+        exporters: List[Callable] : called with every written record, e.g.
+            OpenTelemetrySpanExporter
+        """
+        self.store = store or open_metrics_store()
+        self._application_id = application_id
+        self._exporters = exporters or []
+        self._lock = threading.Lock()
+        self._pending_uploads = []
+        self._batch = None
+        self._runs = {}
+
+    def record_upload(self, start: float, end: float, uploaded_bytes: int):
+        """
+        Record an upload of artifacts, attributed to the next batch of submissions
+        start: float : epoch time the upload started
+        end: float : epoch time the upload ended
+        uploaded_bytes: int : bytes uploaded, skipped artifacts excluded
+        """
+        with self._lock:
+            self._pending_uploads.append(
+                {"start": start, "end": end, "bytes": uploaded_bytes}
+            )
+
+    def _batch_uploads(self, start: float, end: float) -> List[Dict]:
+        """
+        Uploads credited to a submission: the uploads made since the previous batch
+        start a new batch, later submissions belong to it while they follow each
+        other within BATCH_GAP_SECONDS
+        """
+        if self._pending_uploads:
+            self._batch = {
+                "uploads": self._pending_uploads,
+                "last": max(upload["end"] for upload in self._pending_uploads),
+            }
+            self._pending_uploads = []
+        if self._batch is None or start - self._batch["last"] > BATCH_GAP_SECONDS:
+            self._batch = None
+            return []
+        self._batch["last"] = max(self._batch["last"], end)
+        return self._batch["uploads"]
+
+    def _new_run(self, job_run_id: str, job_name: Optional[str]) -> Dict:
+        run = {
+            "application_id": self._application_id,
+            "job_run_id": job_run_id,
+            "job_name": job_name,
+            "upload_bytes": None,
+            "phases": [],
+            "state": None,
+        }
+        self._runs[job_run_id] = run
+        return run
+
+    def record_submit(self, job_run_id: str, job_name: str, start: float, end: float):
+        """
+        Record the submission of a job run, which is SUBMITTED from then on
+        job_run_id: str : job run id
+        job_name: str : job name
+        start: float : epoch time start_job_run was called
+        end: float : epoch time start_job_run returned
+        """
+        with self._lock:
+            run = self._new_run(job_run_id, job_name)
+            uploads = self._batch_uploads(start, end)
+            if uploads:
+                run["upload_bytes"] = sum(upload["bytes"] for upload in uploads)
+                run["phases"].extend(
+                    {"name": "upload", "start": upload["start"], "end": upload["end"]}
+                    for upload in sorted(uploads, key=lambda upload: upload["start"])
+                )
+            run["phases"].append({"name": "submit", "start": start, "end": end})
+            run["state"] = {"name": "SUBMITTED", "start": end}
+
+    def record_state(
+        self, job_run_id: str, jr_response: Dict, at: Optional[float] = None
+    ) -> Optional[Dict]:
+        """
+        Record the state of a polled job run, and write its record once the job run
+        reached a terminal state
+        job_run_id: str : job run id
+        jr_response: Dict : get_job_run response
+        at: float : epoch time of the poll, now by default
+
+        return: Optional[Dict] : the written record, when the job run is over
+        """
+        at = at or time.time()
+        state = jr_response.get("state")
+        with self._lock:
+            run = self._runs.get(job_run_id)
+            if run is None:
+                # a job run already over when first seen has no timings, and may
+                # have been recorded by the process which tracked it
+                if state not in TRACKED_STATES:
+                    return None
+                run = self._new_run(job_run_id, jr_response.get("name"))
+            if run["state"] and run["state"]["name"] == state:
+                return None
+            if run["state"]:
+                run["phases"].append({**run["state"], "end": at})
+            if state in TRACKED_STATES:
+                run["state"] = {"name": state, "start": at}
+                return None
+            del self._runs[job_run_id]
+
+        record = self._build_record(run, jr_response, at)
+        self.store.append(record)
+        for exporter in self._exporters:
+            exporter(record)
+        return record
+
+    def _build_record(self, run: Dict, jr_response: Dict, at: float) -> Dict:
+        """Final record of a job run"""
+        phases = run["phases"]
+        record = {
+            "application_id": run["application_id"],
+            "job_run_id": run["job_run_id"],
+            "job_name": run["job_name"] or jr_response.get("name"),
+            "final_state": jr_response.get("state"),
+            "recorded_at": at,
+            "tags": jr_response.get("tags") or {},
+            "upload_bytes": run["upload_bytes"],
+            "phases": phases,
+            "durations": phase_durations(phases),
+            "end_to_end_seconds": (
+                round(at - phases[0]["start"], 3) if phases else None
+            ),
+            "total_execution_seconds": jr_response.get("totalExecutionDurationSeconds"),
+            "total_resource_utilization": jr_response.get(
+                "totalResourceUtilization", {}
+            ),
+            "billed_resource_utilization": jr_response.get(
+                "billedResourceUtilization", {}
+            ),
+        }
+        if jr_response.get("queuedDurationMilliseconds") is not None:
+            record["queued_seconds"] = jr_response["queuedDurationMilliseconds"] / 1000
+        return record
+
+
+def _prometheus_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def prometheus_text(records: List[Dict]) -> str:
+    """
+    Records in the Prometheus text exposition format, e.g. for the textfile
+    collector of the node exporter
+    records: List[Dict] : metrics records
+
+    return: str : exposition text
+    """
+    metrics = {
+        "emrflow_job_phase_seconds": (
+            "Time spent by a job run in each phase: upload, submit and every state",
+            [],
+        ),
+        "emrflow_job_end_to_end_seconds": (
+            "Time from the start of the upload to the end of the job run",
+            [],
+        ),
+        "emrflow_job_upload_bytes": ("Bytes uploaded before the job run", []),
+        "emrflow_job_resource_utilization": (
+            "Resources consumed by a job run, total or billed",
+            [],
+        ),
+    }
+    for record in records:
+        labels = {
+            "job_name": record.get("job_name"),
+            "job_run_id": record.get("job_run_id"),
+            "state": record.get("final_state"),
+        }
+
+        def sample(name: str, value, **extra_labels):
+            if value is None:
+                return
+            text = ",".join(
+                f'{key}="{_prometheus_label(label)}"'
+                for key, label in {**labels, **extra_labels}.items()
+            )
+            metrics[name][1].append(f"{name}{{{text}}} {value}")
+
+        for phase, seconds in record.get("durations", {}).items():
+            sample("emrflow_job_phase_seconds", seconds, phase=phase)
+        sample("emrflow_job_end_to_end_seconds", record.get("end_to_end_seconds"))
+        sample("emrflow_job_upload_bytes", record.get("upload_bytes"))
+        for kind in ["total", "billed"]:
+            utilization = record.get(f"{kind}_resource_utilization") or {}
+            for resource in RESOURCE_UTILIZATION_KEYS:
+                sample(
+                    "emrflow_job_resource_utilization",
+                    utilization.get(resource),
+                    kind=kind,
+                    resource=resource,
+                )
+
+    lines = []
+    for name, (help_text, samples) in metrics.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
+
+
+class OpenTelemetrySpanExporter:
+    """
+    Emit every record as a trace: a span for the job run with a child span per
+    phase, through the tracer provider configured for the process
+    """
+
+    def __init__(self):
+        try:
+            from opentelemetry import trace
+        except ImportError as ex:
+            raise ImportError(
+                "Exporting metrics as spans requires OpenTelemetry, run `pip install opentelemetry-sdk`"
+            ) from ex
+        self._trace = trace
+        self._tracer = trace.get_tracer("emrflow")
+
+    def __call__(self, record: Dict):
+        phases = record["phases"]
+        if not phases:
+            return
+        attributes = {
+            "emrflow.job_run_id": record["job_run_id"],
+            "emrflow.job_name": record["job_name"] or "",
+            "emrflow.final_state": record["final_state"] or "",
+        }
+        for kind in ["total", "billed"]:
+            for resource, value in (
+                record.get(f"{kind}_resource_utilization") or {}
+            ).items():
+                attributes[f"emrflow.{kind}.{resource}"] = value
+
+        job_span = self._tracer.start_span(
+            "emr job run",
+            start_time=int(phases[0]["start"] * 1e9),
+            attributes=attributes,
+        )
+        context = self._trace.set_span_in_context(job_span)
+        for phase in phases:
+            span = self._tracer.start_span(
+                phase["name"], context=context, start_time=int(phase["start"] * 1e9)
+            )
+            span.end(end_time=int(phase["end"] * 1e9))
+        job_span.end(end_time=int(record["recorded_at"] * 1e9))
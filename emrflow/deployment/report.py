@@ -0,0 +1,224 @@
+"""
+Resource utilization report of the job runs of an application: vCPU, memory and
+storage hours aggregated by job name, state or tag, with per job name trends to
+compare what the jobs consume against how long they run.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from emrflow.deployment.emr import EMR
+from emrflow.deployment.job_index import FINAL_STATES, JobRunIndex
+from emrflow.deployment.metrics import RESOURCE_UTILIZATION_KEYS
+
+SPARK_LINE_TICKS = "▁▂▃▄▅▆▇█"
+# runs shown in the sparkline of a job name
+SPARK_LINE_RUNS = 20
+UNGROUPED = "(none)"
+
+
+def job_run_usage(job_run: Dict, details: Dict) -> Dict:
+    """
+    Usage of a job run from its get_job_run response
+    job_run: Dict : indexed job run, with its id, name, state, created_at and tags
+    details: Dict : get_job_run response
+
+    return: Dict : job run with its runtime and total and billed utilization
+    """
+    total = details.get("totalResourceUtilization") or {}
+    billed = details.get("billedResourceUtilization") or {}
+    usage = {
+        "id": job_run["id"],
+        "name": job_run["name"],
+        "state": details.get("state", job_run["state"]),
+        "created_at": job_run["created_at"],
+        "tags": job_run.get("tags") or {},
+        "runtime_hours": (details.get("totalExecutionDurationSeconds") or 0) / 3600,
+    }
+    for key in RESOURCE_UTILIZATION_KEYS:
+        usage[key] = total.get(key) or 0
+        usage[f"billed_{key}"] = billed.get(key) or 0
+    return usage
+
+
+def collect_usage(
+    emr: EMR,
+    index: JobRunIndex,
+    since: datetime,
+    refresh: bool = True,
+    max_workers: int = 8,
+) -> List[Dict]:
+    """
+    Usage of the job runs created since a date. The index is refreshed with the
+    paginated job run listing, the details of finished job runs come from the index,
+    the other ones are fetched concurrently and kept once the job runs are finished.
+    emr: EMR : emr deployment of the job runs
+    index: JobRunIndex : index of the job runs of the application
+    since: datetime : only job runs created after this date
+    refresh: bool : refresh the index first
+    max_workers: int : parallel get_job_run calls
+
+    return: List[Dict] : usage of every job run, oldest first
+    """
+    if refresh:
+        index.refresh()
+    job_runs = index.search(created_after=since)
+
+    details = {job_run["id"]: index.get_details(job_run["id"]) for job_run in job_runs}
+    missing = [job_run_id for job_run_id, value in details.items() if value is None]
+    if missing:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            fetched = dict(zip(missing, executor.map(emr.get_job_run, missing)))
+        # the index connection stays on this thread
+        for job_run_id, response in fetched.items():
+            details[job_run_id] = response
+            if response.get("state") in FINAL_STATES:
+                index.save_details(response, job_run_id)
+
+    return [
+        job_run_usage(job_run, details[job_run["id"]])
+        for job_run in sorted(job_runs, key=lambda job_run: job_run["created_at"])
+    ]
+
+
+def validate_group_by(group_by: str):
+    """
+    Check a grouping before any job run is fetched
+    group_by: str : name, state or tag:<key>
+    """
+    if group_by in ["name", "state"] or (
+        group_by.startswith("tag:") and group_by[len("tag:") :]
+    ):
+        return
+    raise ValueError(f"Unknown grouping {group_by}, use name, state or tag:<key>")
+
+
+def group_value(usage: Dict, group_by: str) -> str:
+    """
+    Group of a job run
+    usage: Dict : job run usage
+    group_by: str : name, state or tag:<key>
+
+    return: str : value of the job run for the grouping
+    """
+    validate_group_by(group_by)
+    if group_by.startswith("tag:"):
+        return usage["tags"].get(group_by[len("tag:") :], UNGROUPED)
+    return usage[group_by] or UNGROUPED
+
+
+def aggregate_usage(usages: List[Dict], group_by: str) -> List[Dict]:
+    """
+    Usage summed by group, highest billed vCPU hours first
+    usages: List[Dict] : job run usages
+    group_by: str : name, state or tag:<key>
+
+    return: List[Dict] : group, runs, failed runs, runtime and utilization totals,
+        with the average vCPUs and memory held while running
+    """
+    groups = {}
+    for usage in usages:
+        group = groups.setdefault(
+            group_value(usage, group_by),
+            {"runs": 0, "failed": 0, "runtime_hours": 0},
+        )
+        group["runs"] += 1
+        group["failed"] += (
+            usage["state"] in FINAL_STATES and usage["state"] != "SUCCESS"
+        )
+        group["runtime_hours"] += usage["runtime_hours"]
+        for key in RESOURCE_UTILIZATION_KEYS:
+            group[key] = group.get(key, 0) + usage[key]
+            group[f"billed_{key}"] = (
+                group.get(f"billed_{key}", 0) + usage[f"billed_{key}"]
+            )
+
+    rows = []
+    for name, group in groups.items():
+        runtime_hours = group["runtime_hours"]
+        rows.append(
+            {
+                "group": name,
+                **group,
+                "avg_vcpu": group["vCPUHour"] / runtime_hours if runtime_hours else 0,
+                "avg_memory_gb": (
+                    group["memoryGBHour"] / runtime_hours if runtime_hours else 0
+                ),
+            }
+        )
+    return sorted(rows, key=lambda row: row["billed_vCPUHour"], reverse=True)
+
+
+def spark_line(values: List[float]) -> str:
+    """
+    Sparkline of a series, e.g. ▁▃█
+    values: List[float] : series
+
+    return: str : one tick per value
+    """
+    highest = max(values, default=0)
+    if not highest:
+        return SPARK_LINE_TICKS[0] * len(values)
+    return "".join(
+        SPARK_LINE_TICKS[round(value / highest * (len(SPARK_LINE_TICKS) - 1))]
+        for value in values
+    )
+
+
+def relative_change(values: List[float]) -> Optional[float]:
+    """
+    Change of the mean of the second half of a series over its first half
+    values: List[float] : series, oldest first
+
+    return: Optional[float] : relative change, None with less than 2 values
+    """
+    if len(values) < 2:
+        return None
+    middle = len(values) // 2
+    before = sum(values[:middle]) / middle
+    after = sum(values[middle:]) / (len(values) - middle)
+    if not before:
+        return None
+    return (after - before) / before
+
+
+def job_name_trends(usages: List[Dict]) -> List[Dict]:
+    """
+    Trends of every job name over its successive runs
+    usages: List[Dict] : job run usages, oldest first
+
+    return: List[Dict] : per job name, its runs, mean runtime and utilization per
+        run, the average vCPUs and memory held while running, the change of the
+        runtime and vCPU hours between the older and newer runs, and a sparkline
+        of the vCPU hours of the last runs
+    """
+    runs_by_name = {}
+    for usage in usages:
+        runs_by_name.setdefault(usage["name"] or UNGROUPED, []).append(usage)
+
+    trends = []
+    for name, runs in sorted(runs_by_name.items()):
+        runtimes = [run["runtime_hours"] for run in runs]
+        vcpu_hours = [run["vCPUHour"] for run in runs]
+        runtime_hours = sum(runtimes)
+        trends.append(
+            {
+                "name": name,
+                "runs": len(runs),
+                "avg_runtime_minutes": runtime_hours / len(runs) * 60,
+                "avg_vCPUHour": sum(vcpu_hours) / len(runs),
+                "avg_memoryGBHour": sum(run["memoryGBHour"] for run in runs)
+                / len(runs),
+                "avg_vcpu": sum(vcpu_hours) / runtime_hours if runtime_hours else 0,
+                "avg_memory_gb": (
+                    sum(run["memoryGBHour"] for run in runs) / runtime_hours
+                    if runtime_hours
+                    else 0
+                ),
+                "runtime_change": relative_change(runtimes),
+                "vCPUHour_change": relative_change(vcpu_hours),
+                "vCPUHour_spark_line": spark_line(vcpu_hours[-SPARK_LINE_RUNS:]),
+            }
+        )
+    return trends
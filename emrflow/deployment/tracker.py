@@ -0,0 +1,225 @@
+"""Track several job runs concurrently from a single process"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Dict, List, Optional
+
+import rich
+
+from emrflow.deployment.emr import EMR, JOB_TERMINAL_STATES
+from emrflow.utils import AdaptivePoller, is_throttling_error
+
+# state of a job run whose status could not be fetched, it is not a job run state
+TRACKING_FAILED = "TRACKING_FAILED"
+
+
+class RateLimiter:
+    """
+    Space out the API calls shared by every tracked job
+    """
+
+    def __init__(self, max_calls_per_second: float):
+        """
+        max_calls_per_second: float : maximum calls per second across all jobs
+        """
+        self._interval = 1.0 / max_calls_per_second
+        self._next_call = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        """Wait until the next call is allowed"""
+        async with self._lock:
+            now = asyncio.get_running_loop().time()
+            delay = self._next_call - now
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._next_call = max(now, self._next_call) + self._interval
+
+    def pause(self, delay: float):
+        """
+        Hold every call for `delay` seconds, used when the API throttles
+        delay: float : delay in seconds
+        """
+        now = asyncio.get_running_loop().time()
+        self._next_call = max(self._next_call, now + delay)
+
+
+class MultiJobTracker:
+    """
+    Follow several job runs from one process with asyncio. Every job shares one
+    rate-limited `get_job_run` scheduler and logs are tailed only for the jobs
+    that request it.
+    """
+
+    def __init__(
+        self,
+        emr: EMR,
+        ping_duration: int = 30,
+        max_calls_per_second: float = 5,
+        fail_fast: bool = False,
+        max_workers: int = 32,
+        show_executor_logs: bool = False,
+    ) -> None:
+        """
+        emr: EMR : emr deployment used to query the job runs
+        ping_duration: int : maximum duration (in sec) between two status checks of a job
+        max_calls_per_second: float : maximum get_job_run calls per second
+        fail_fast: bool : stop tracking once a job does not succeed
+        max_workers: int : threads running the blocking boto3 calls
+        show_executor_logs: bool : also show the executor logs of the jobs whose
+            logs are shown
+        """
+        self._emr = emr
+        self._ping_duration = ping_duration
+        self._max_calls_per_second = max_calls_per_second
+        self._fail_fast = fail_fast
+        self._max_workers = max_workers
+        self._show_executor_logs = show_executor_logs
+        self._executor = None
+        self._limiter = None
+        self.responses = {}
+
+    async def call(self, func, *args, **kwargs):
+        """Run a blocking boto3 call without blocking the event loop"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, lambda: func(*args, **kwargs))
+
+    async def get_job_run(self, job_run_id: str) -> Dict:
+        """
+        Get job run details through the shared rate limiter
+        job_run_id: str : job run id
+
+        return: dict : jr_response
+        """
+        await self._limiter.wait()
+        return await self.call(self._emr.get_job_run, job_run_id)
+
+    async def track_job(self, job_run_id: str, show_logs: bool = False) -> Dict:
+        """
+        Track a single job run until it reaches a terminal state. An error other
+        than throttling stops tracking this job run only, its state is then
+        TRACKING_FAILED
+        job_run_id: str : job run id
+        show_logs: bool : show logs of the job run
+
+        return: dict : jr_response
+        """
+        job_state = None
+        log_read_pos = 0
+        poller = AdaptivePoller(max_interval=self._ping_duration)
+
+        while True:
+            try:
+                jr_response = await self.get_job_run(job_run_id)
+            except Exception as ex:
+                if not is_throttling_error(ex):
+                    # the job run may still be running, only its tracking stops
+                    rich.print(f"Job {job_run_id} could not be tracked: {ex}")
+                    jr_response = {
+                        **self.responses.get(job_run_id, {}),
+                        "jobRunId": job_run_id,
+                        "state": TRACKING_FAILED,
+                        "stateDetails": str(ex),
+                    }
+                    self.responses[job_run_id] = jr_response
+                    return jr_response
+                # slow down every tracked job, not only this one
+                delay = poller.throttled()
+                self._limiter.pause(delay)
+                await asyncio.sleep(delay)
+                continue
+
+            self.responses[job_run_id] = jr_response
+            new_state = jr_response.get("state")
+            state_changed = new_state != job_state
+            if state_changed:
+                rich.print(f"Job {job_run_id} state is now: {new_state}")
+                job_state = new_state
+            if self._emr.metrics is not None:
+                # the store writes to disk, keep it off the event loop
+                await self.call(self._emr.metrics.record_state, job_run_id, jr_response)
+
+            if show_logs:
+                try:
+                    log_read_pos = await self.call(
+                        self._emr.show_logs,
+                        job_run_id,
+                        log_read_pos=log_read_pos,
+                        jr_response=jr_response,
+                        executor_logs=self._show_executor_logs,
+                    )
+                except Exception as ex:
+                    print(ex)
+
+            if new_state in JOB_TERMINAL_STATES:
+                return jr_response
+            await asyncio.sleep(poller.next_delay(state_changed))
+
+    async def __aenter__(self):
+        """Start the shared rate limiter and the pool running the boto3 calls"""
+        self._limiter = RateLimiter(self._max_calls_per_second)
+        self._executor = ThreadPoolExecutor(max_workers=self._max_workers)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._executor.shutdown(wait=False)
+
+    async def wait_all(self, coroutines: List[Awaitable[Dict]]):
+        """
+        Wait for tracking coroutines returning a jr_response. With `fail_fast`, the
+        remaining coroutines are cancelled once a job does not succeed.
+        coroutines: List[Awaitable[Dict]] : tracking coroutines
+        """
+        pending = {asyncio.ensure_future(coroutine) for coroutine in coroutines}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                failed = [
+                    task.result()
+                    for task in done
+                    if task.result().get("state") != "SUCCESS"
+                ]
+                if failed and self._fail_fast:
+                    rich.print(
+                        f"Job {failed[0].get('jobRunId')} ended in state {failed[0].get('state')}, stop tracking"
+                    )
+                    break
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    async def track(
+        self, job_run_ids: List[str], show_logs_for: Optional[List[str]] = None
+    ) -> Dict[str, Dict]:
+        """
+        Track job runs until all of them, or the first failure with `fail_fast`,
+        reach a terminal state
+        job_run_ids: List[str] : job run ids
+        show_logs_for: List[str] : job run ids whose logs are shown
+
+        return: Dict[str, Dict] : jr_response of each job run
+        """
+        show_logs_for = show_logs_for or []
+        async with self:
+            await self.wait_all(
+                [
+                    self.track_job(job_run_id, job_run_id in show_logs_for)
+                    for job_run_id in job_run_ids
+                ]
+            )
+        return self.responses
+
+    def run(
+        self, job_run_ids: List[str], show_logs_for: Optional[List[str]] = None
+    ) -> Dict[str, Dict]:
+        """
+        Blocking entry point of `track`
+        job_run_ids: List[str] : job run ids
+        show_logs_for: List[str] : job run ids whose logs are shown
+
+        return: Dict[str, Dict] : jr_response of each job run
+        """
+        return asyncio.run(self.track(job_run_ids, show_logs_for))
@@ -0,0 +1,269 @@
+"""
+Run a DAG of dependent jobs. Each job is submitted as soon as the jobs it depends on
+succeed, independent branches run in parallel and the progress is persisted to a
+state file so an interrupted or failed workflow can be resumed. The state file is
+removed once every job succeeded, and ignored when the spec changed.
+
+The spec has the same format as `run-batch`, each job listing its upstream jobs:
+
+    jobs:
+      - job_name: ingest
+        entry_point: jobs/ingest.py
+      - job_name: transform
+        entry_point: jobs/transform.py
+        depends_on: ["ingest"]
+"""
+
+import asyncio
+import hashlib
+import heapq
+import itertools
+import json
+import os
+from typing import Dict, List
+
+import rich
+
+from emrflow.deployment.batch import BatchRunner
+from emrflow.deployment.emr import JOB_TERMINAL_STATES
+
+UPSTREAM_FAILED = "UPSTREAM_FAILED"
+
+
+def sort_jobs(jobs: List[Dict]) -> List[Dict]:
+    """
+    Sort jobs so that every job comes after the jobs it depends on
+    jobs: List[Dict] : job definitions with an optional `depends_on` list
+
+    return: List[Dict] : sorted job definitions
+    """
+    jobs_by_name = {job["job_name"]: job for job in jobs}
+    for job in jobs:
+        for upstream in job.get("depends_on") or []:
+            if upstream not in jobs_by_name:
+                raise ValueError(
+                    f"Job '{job['job_name']}' depends on unknown job '{upstream}'"
+                )
+
+    sorted_jobs = []
+    visiting = set()
+    visited = set()
+
+    def visit(name: str):
+        if name in visited:
+            return
+        if name in visiting:
+            raise ValueError(f"Jobs have a circular dependency through '{name}'")
+        visiting.add(name)
+        for upstream in jobs_by_name[name].get("depends_on") or []:
+            visit(upstream)
+        visiting.discard(name)
+        visited.add(name)
+        sorted_jobs.append(jobs_by_name[name])
+
+    for job in jobs:
+        visit(job["job_name"])
+    return sorted_jobs
+
+
+def spec_hash(jobs: List[Dict]) -> str:
+    """
+    Hash of the job definitions of a workflow
+    jobs: List[Dict] : job definitions
+
+    return: str : sha256 of the definitions
+    """
+    return hashlib.sha256(
+        json.dumps(jobs, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+def critical_path_lengths(jobs: List[Dict]) -> Dict[str, int]:
+    """
+    Number of jobs on the longest chain starting at each job
+    jobs: List[Dict] : job definitions sorted by `sort_jobs`
+
+    return: Dict[str, int] : length of the longest downstream chain of each job
+    """
+    lengths = {job["job_name"]: 1 for job in jobs}
+    for job in reversed(jobs):
+        for upstream in job.get("depends_on") or []:
+            lengths[upstream] = max(lengths[upstream], lengths[job["job_name"]] + 1)
+    return lengths
+
+
+class PrioritySemaphore:
+    """
+    Semaphore handing free slots to the waiter with the highest priority first
+    """
+
+    def __init__(self, slots: int):
+        """
+        slots: int : number of concurrent holders
+        """
+        self._slots = slots
+        self._waiters = []
+        self._counter = itertools.count()
+
+    async def acquire(self, priority: int):
+        """
+        Wait for a free slot
+        priority: int : waiters with a higher priority get a slot first
+        """
+        if self._slots > 0 and not self._waiters:
+            self._slots -= 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (-priority, next(self._counter), waiter))
+        await waiter
+
+    def release(self):
+        """Hand the slot to the next waiter, or free it"""
+        while self._waiters:
+            _, _, waiter = heapq.heappop(self._waiters)
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._slots += 1
+
+
+class WorkflowRunner(BatchRunner):
+    """
+    Submit each job of a DAG once its upstream jobs succeed, sharing one status
+    poller for every running job and persisting progress to a state file
+    """
+
+    def __init__(self, emr_serverless, state_file: str, **kwargs) -> None:
+        """
+        emr_serverless: EMRServerless : emr serverless application
+        state_file: str : json file where the progress of the workflow is saved
+        kwargs: options of `BatchRunner`
+        """
+        super().__init__(emr_serverless, **kwargs)
+        self._state_file = state_file
+        self._spec_hash = None
+        self.state = {}
+
+    def load_state(self, jobs: List[Dict]) -> Dict[str, Dict]:
+        """
+        Load the progress of a previous run of the same workflow
+        jobs: List[Dict] : job definitions, a state saved for other definitions is
+            ignored
+
+        return: Dict[str, Dict] : job_run_id and state of each job
+        """
+        self._spec_hash = spec_hash(jobs)
+        self.state = {}
+        if os.path.exists(self._state_file):
+            with open(self._state_file, "r") as state_file:
+                saved = json.load(state_file)
+            if saved.get("spec_hash") == self._spec_hash:
+                self.state = saved.get("jobs", {})
+                rich.print(f"Resuming workflow from {self._state_file}")
+            else:
+                rich.print(
+                    f"Ignoring {self._state_file}, it was saved for another version of the spec"
+                )
+        return self.state
+
+    def save_state(self):
+        """Persist the progress of the workflow"""
+        tmp_path = f"{self._state_file}.tmp"
+        with open(tmp_path, "w") as state_file:
+            json.dump(
+                {"spec_hash": self._spec_hash, "jobs": self.state},
+                state_file,
+                indent=2,
+            )
+        os.replace(tmp_path, self._state_file)
+
+    def _update_state(self, job_name: str, **values):
+        self.state[job_name] = {**self.state.get(job_name, {}), **values}
+        self.save_state()
+
+    async def run_node(
+        self,
+        job: Dict,
+        src_dest_uri: Dict,
+        upstream_tasks: List[asyncio.Future],
+        semaphore: PrioritySemaphore,
+        priority: int,
+    ) -> Dict:
+        """
+        Run a job once its upstream jobs succeed
+        job: Dict : job definition
+        src_dest_uri: Dict : dict containing key as src path and value as dest path in S3
+        upstream_tasks: List[asyncio.Future] : tasks of the upstream jobs
+        semaphore: PrioritySemaphore : concurrency slots
+        priority: int : length of the longest downstream chain of the job
+
+        return: Dict : jr_response
+        """
+        job_name = job["job_name"]
+        previous = self.state.get(job_name, {})
+        if previous.get("state") == "SUCCESS":
+            rich.print(f"Job {job_name} already succeeded, skipping")
+            return {"jobRunId": previous.get("job_run_id"), "state": "SUCCESS"}
+
+        upstream_responses = await asyncio.gather(*upstream_tasks)
+        if any(response.get("state") != "SUCCESS" for response in upstream_responses):
+            rich.print(f"Job {job_name} skipped, an upstream job did not succeed")
+            self._update_state(job_name, state=UPSTREAM_FAILED)
+            return {"state": UPSTREAM_FAILED}
+
+        await semaphore.acquire(priority)
+        try:
+            job_run_id = previous.get("job_run_id")
+            if not job_run_id or previous.get("state") in JOB_TERMINAL_STATES + [
+                UPSTREAM_FAILED
+            ]:
+                job_run_id = await self.tracker.call(self.submit, job, src_dest_uri)
+                self._update_state(job_name, job_run_id=job_run_id, state="SUBMITTED")
+            else:
+                rich.print(f"Resume tracking job {job_name} (Job Run ID: {job_run_id})")
+
+            self.job_run_ids[job_name] = job_run_id
+            jr_response = await self.tracker.track_job(job_run_id, self._show_logs)
+            self._update_state(job_name, state=jr_response.get("state"))
+            return jr_response
+        finally:
+            semaphore.release()
+
+    async def _run(
+        self, jobs: List[Dict], src_dest_uris: Dict[str, Dict], concurrency: int
+    ):
+        semaphore = PrioritySemaphore(concurrency)
+        priorities = critical_path_lengths(jobs)
+        tasks = {}
+        async with self.tracker:
+            for job in jobs:
+                tasks[job["job_name"]] = asyncio.ensure_future(
+                    self.run_node(
+                        job,
+                        src_dest_uris[job["s3_code_uri"]],
+                        [tasks[upstream] for upstream in job.get("depends_on") or []],
+                        semaphore,
+                        priorities[job["job_name"]],
+                    )
+                )
+            await self.tracker.wait_all(list(tasks.values()))
+
+    def run(self, jobs: List[Dict], **upload_options) -> Dict[str, Dict]:
+        """
+        Upload the artifacts, then run the jobs following their dependencies
+        jobs: List[Dict] : job definitions
+        upload_options: options of `upload`
+
+        return: Dict[str, Dict] : job_run_id and state of each job
+        """
+        jobs = sort_jobs(jobs)
+        self.load_state(jobs)
+        super().run(jobs, **upload_options)
+
+        # a finished workflow starts from scratch when it is run again
+        if len(self.state) == len(jobs) and all(
+            job_state.get("state") == "SUCCESS" for job_state in self.state.values()
+        ):
+            if os.path.exists(self._state_file):
+                os.remove(self._state_file)
+        return self.state
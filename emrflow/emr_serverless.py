@@ -8,8 +8,15 @@ import rich
 import typer
 from typing_extensions import Annotated
 
+from emrflow.deployment.clients import configure_clients
 from emrflow.deployment.emr_sls import EMRServerless
-from emrflow.package.build_package import build_package
+from emrflow.package import DEFAULT_PRUNE_PATTERNS
+from emrflow.utils import (
+    DEFAULT_MULTIPART_CHUNK_SIZE,
+    DEFAULT_UPLOAD_CONCURRENCY,
+    convert_to_dict,
+    parse_duration,
+)
 
 app = typer.Typer(pretty_exceptions_show_locals=False)
 global_obj_dict = {"emr_serverless": None}
@@ -23,16 +30,40 @@ def init_connection(
             help="Serverless configuration .json file",
         ),
     ] = str(Path.home())
-    + "/emr_serverless_config.json"
+    + "/emr_serverless_config.json",
 ):
     """Initialize connection with EMR Serverless"""
     rich.print(f"~~Config Path: {config_path}~~")
     # Open and read the JSON config file
     with open(config_path, "r") as config_file:
         config = json.load(config_file)
+    # optional connection settings of the boto3 clients, e.g. max_pool_connections
+    if config.get("client_config"):
+        configure_clients(**config["client_config"])
     global_obj_dict["emr_serverless"] = EMRServerless(
-        config["application_id"], config["job_role"], config["region"]
+        config["application_id"],
+        config["job_role"],
+        config["region"],
+        profile=config.get("profile", ""),
     )
+    # timings of the job runs, only recorded when enabled in the config
+    metrics_config = config.get("metrics", {})
+    if metrics_config.get("enabled", False):
+        from emrflow.deployment.metrics import (
+            MetricsRecorder,
+            OpenTelemetrySpanExporter,
+            open_metrics_store,
+        )
+
+        global_obj_dict["emr_serverless"].metrics = MetricsRecorder(
+            open_metrics_store(metrics_config.get("store")),
+            application_id=config["application_id"],
+            exporters=(
+                [OpenTelemetrySpanExporter()]
+                if metrics_config.get("opentelemetry")
+                else []
+            ),
+        )
     rich.print("Connection established!!")
 
 
@@ -84,8 +115,82 @@ def package_dependencies(
             help="Proxy endpoint",
         ),
     ] = "",
+    env_cache: Annotated[
+        bool,
+        typer.Option(
+            help="Reuse an environment already packaged with the same python version, commands and lockfiles (poetry.lock, requirements.txt...) from the local cache in ~/.emrflow/env_cache",
+        ),
+    ] = True,
+    env_cache_uri: Annotated[
+        str,
+        typer.Option(
+            help="S3 prefix of an environment cache shared across machines. Environments already built with the same fingerprint are used from there without download, fresh builds are published, and `run` references the archive in S3 instead of uploading it. Cannot be combined with --no-env-cache",
+        ),
+    ] = "",
+    docker_cache: Annotated[
+        str,
+        typer.Option(
+            help="BuildKit layer cache of --env-type docker builds, imported and exported with --cache-from/--cache-to. A local directory (starting with /, . or ~, requires a docker-container buildx builder), a registry reference such as registry.example.com/emrflow/cache, or a raw buildx cache spec",
+        ),
+    ] = "",
+    s3_code_uri: Annotated[
+        str,
+        typer.Option(
+            help="Upload each package to this location of s3 as soon as it is built, while the other one is still building. `run` then skips the unchanged artifacts",
+        ),
+    ] = "",
+    stream_upload: Annotated[
+        bool,
+        typer.Option(
+            help="Stream the project archive and docker environments to --s3-code-uri while they are written, without reading them back from disk. conda environments are uploaded once packed",
+        ),
+    ] = False,
+    keep_local: Annotated[
+        bool,
+        typer.Option(
+            help="Also write the streamed packages to the output directory. With --no-keep-local only a .s3uri file pointing to S3 is left, for runners with little disk space",
+        ),
+    ] = True,
+    env_pack_threads: Annotated[
+        int,
+        typer.Option(
+            help="Threads compressing the environment archive with conda-pack, -1 for every core",
+        ),
+    ] = -1,
+    env_compress_level: Annotated[
+        int,
+        typer.Option(
+            min=0,
+            max=9,
+            help="gzip level of the environment archive, from 0 (fastest, largest) to 9. The archive stays a .tar.gz that spark.archives can unpack",
+        ),
+    ] = 4,
+    env_prune: Annotated[
+        bool,
+        typer.Option(
+            help="Remove the files matching --env-prune-patterns from the environment before packing it, and report its size before and after",
+        ),
+    ] = False,
+    env_prune_patterns: Annotated[
+        List[str],
+        typer.Option(
+            help="File or directory names removed by --env-prune, or paths relative to the environment root when they contain a /",
+        ),
+    ] = DEFAULT_PRUNE_PATTERNS,
+    env_compile_pyc: Annotated[
+        bool,
+        typer.Option(
+            help="Precompile the .pyc files of the environment with its python, so executors do not compile modules on import",
+        ),
+    ] = False,
 ):
     """Package dependencies for the project"""
+    from emrflow.package.build_package import build_package
+
+    s3_client = None
+    if (s3_code_uri or env_cache_uri) and global_obj_dict["emr_serverless"] is not None:
+        s3_client = global_obj_dict["emr_serverless"].s3_client
+
     build_package(
         output_dir=output_dir,
         package_project=package_project,
@@ -95,6 +200,17 @@ def package_dependencies(
         env_exec_cmd=env_exec_cmd,
         env_python_version=env_python_version,
         env_proxy=env_proxy,
+        env_cache=env_cache,
+        env_cache_uri=env_cache_uri,
+        docker_cache=docker_cache,
+        s3_code_uri=s3_code_uri,
+        s3_client=s3_client,
+        stream_upload=stream_upload,
+        keep_local=keep_local,
+        env_pack_threads=env_pack_threads,
+        env_compress_level=env_compress_level,
+        env_prune_patterns=env_prune_patterns if env_prune else None,
+        env_compile_pyc=env_compile_pyc,
     )
 
 
@@ -126,7 +242,7 @@ def run(
     ping_duration: Annotated[
         Optional[int],
         typer.Option(
-            help="Ping duration (in sec) to check the status when job tracking is enabled",
+            help="Maximum ping duration (in sec) to check the status when job tracking is enabled. Polling starts faster after submission and state changes, then backs off up to this value",
         ),
     ] = 30,
     tags: Annotated[
@@ -145,12 +261,42 @@ def run(
         bool,
         typer.Option(help="Show the output of logs after job is finished"),
     ] = False,
+    show_executor_logs: Annotated[
+        bool,
+        typer.Option(
+            help="With --show-output, also stream the stdout and stderr of every executor",
+        ),
+    ] = False,
     exclude_paths: Annotated[
         List[str],
         typer.Option(
             help="File paths to be excluded during the upload process (Useful when reusing the artifacts already available in S3). e.g 'dist/pyspark_deps.tar.gz'",
         ),
     ] = [],
+    upload_concurrency: Annotated[
+        int,
+        typer.Option(
+            help="Number of artifacts uploaded in parallel, also used as the number of parts uploaded concurrently for large artifacts",
+        ),
+    ] = DEFAULT_UPLOAD_CONCURRENCY,
+    multipart_chunk_size: Annotated[
+        int,
+        typer.Option(
+            help="Size (in MB) of each part when uploading large artifacts with multipart upload",
+        ),
+    ] = DEFAULT_MULTIPART_CHUNK_SIZE,
+    skip_unchanged: Annotated[
+        bool,
+        typer.Option(
+            help="Skip uploading artifacts whose content hash matches the object already in S3",
+        ),
+    ] = True,
+    content_addressed: Annotated[
+        bool,
+        typer.Option(
+            help="Store artifacts by content hash under <s3-code-uri>/cas/ so identical artifacts are shared across job runs",
+        ),
+    ] = False,
 ):
     """Run PySpark job on EMR Serverless"""
     rich.print("Running emr serverless application!!")
@@ -169,6 +315,10 @@ def run(
         s3_code_uri=s3_code_uri,
         artifacts=artifacts + [entry_point],
         excludes=exclude_paths,
+        upload_concurrency=upload_concurrency,
+        multipart_chunk_size=multipart_chunk_size,
+        skip_unchanged=skip_unchanged,
+        content_addressed=content_addressed,
     )
 
     # Submit PySpark job to EMR Serverless
@@ -185,6 +335,226 @@ def run(
         ping_duration=ping_duration,
         tags=tags,
         src_dest_uri=src_dest_uri,
+        show_executor_logs=show_executor_logs,
+    )
+    return response
+
+
+@app.command()
+def run_batch(
+    spec: Annotated[
+        str,
+        typer.Option(
+            help="Path of a .json or .yaml file listing the jobs (job_name, entry_point, entry_point_arguments, spark_submit_parameters, s3_code_uri, s3_logs_uri, execution_timeout, tags) and optional defaults",
+        ),
+    ],
+    max_concurrency: Annotated[
+        int,
+        typer.Option(
+            help="Maximum number of job runs submitted and not finished at once, also capped by the max concurrent runs of the application",
+        ),
+    ] = 10,
+    ping_duration: Annotated[
+        Optional[int],
+        typer.Option(
+            help="Maximum ping duration (in sec) between two status checks of a job. Polling starts faster after state changes, then backs off up to this value",
+        ),
+    ] = 30,
+    show_output: Annotated[
+        bool,
+        typer.Option(help="Show the logs of every job"),
+    ] = False,
+    fail_fast: Annotated[
+        bool,
+        typer.Option(help="Stop submitting and tracking once one job does not succeed"),
+    ] = False,
+    exclude_paths: Annotated[
+        List[str],
+        typer.Option(
+            help="File paths to be excluded during the upload process (Useful when reusing the artifacts already available in S3). e.g 'dist/pyspark_deps.tar.gz'",
+        ),
+    ] = [],
+    upload_concurrency: Annotated[
+        int,
+        typer.Option(
+            help="Number of artifacts uploaded in parallel, also used as the number of parts uploaded concurrently for large artifacts",
+        ),
+    ] = DEFAULT_UPLOAD_CONCURRENCY,
+    multipart_chunk_size: Annotated[
+        int,
+        typer.Option(
+            help="Size (in MB) of each part when uploading large artifacts with multipart upload",
+        ),
+    ] = DEFAULT_MULTIPART_CHUNK_SIZE,
+    skip_unchanged: Annotated[
+        bool,
+        typer.Option(
+            help="Skip uploading artifacts whose content hash matches the object already in S3",
+        ),
+    ] = True,
+    content_addressed: Annotated[
+        bool,
+        typer.Option(
+            help="Store artifacts by content hash under <s3-code-uri>/cas/ so identical artifacts are shared across job runs",
+        ),
+    ] = False,
+) -> Dict[str, Dict]:
+    """Submit many PySpark jobs on EMR Serverless, uploading their artifacts once"""
+    from emrflow.deployment.batch import BatchRunner, load_job_specs
+
+    jobs = load_job_specs(spec)
+    runner = BatchRunner(
+        global_obj_dict["emr_serverless"],
+        max_concurrency=max_concurrency,
+        ping_duration=ping_duration,
+        fail_fast=fail_fast,
+        show_logs=show_output,
+    )
+    responses = runner.run(
+        jobs,
+        excludes=exclude_paths,
+        upload_concurrency=upload_concurrency,
+        multipart_chunk_size=multipart_chunk_size,
+        skip_unchanged=skip_unchanged,
+        content_addressed=content_addressed,
+    )
+
+    failed = {}
+    for job in jobs:
+        state = responses.get(job["job_name"], {}).get("state", "NOT_SUBMITTED")
+        rich.print(
+            f"Job: {job['job_name']}, ID: {runner.job_run_ids.get(job['job_name'])}, STATE: {state}"
+        )
+        if state != "SUCCESS":
+            failed[job["job_name"]] = state
+    if failed:
+        raise Exception(f"Jobs did not succeed: {failed}")
+    return responses
+
+
+@app.command()
+def run_workflow(
+    spec: Annotated[
+        str,
+        typer.Option(
+            help="Path of a .json or .yaml file listing the jobs (job_name, entry_point, entry_point_arguments, spark_submit_parameters, s3_code_uri, s3_logs_uri, execution_timeout, tags, depends_on) and optional defaults",
+        ),
+    ],
+    state_file: Annotated[
+        str,
+        typer.Option(
+            help="File where the progress of the workflow is saved, an existing file saved for the same spec resumes the workflow. It is removed once every job succeeded. Defaults to <spec>.state.json",
+        ),
+    ] = "",
+    max_concurrency: Annotated[
+        int,
+        typer.Option(
+            help="Maximum number of job runs submitted and not finished at once, also capped by the max concurrent runs of the application. Jobs on the longest dependency chain get a slot first",
+        ),
+    ] = 10,
+    ping_duration: Annotated[
+        Optional[int],
+        typer.Option(
+            help="Maximum ping duration (in sec) between two status checks of a job. Polling starts faster after state changes, then backs off up to this value",
+        ),
+    ] = 30,
+    show_output: Annotated[
+        bool,
+        typer.Option(help="Show the logs of every job"),
+    ] = False,
+    fail_fast: Annotated[
+        bool,
+        typer.Option(
+            help="Stop the whole workflow once one job does not succeed, instead of only the jobs depending on it"
+        ),
+    ] = False,
+    exclude_paths: Annotated[
+        List[str],
+        typer.Option(
+            help="File paths to be excluded during the upload process (Useful when reusing the artifacts already available in S3). e.g 'dist/pyspark_deps.tar.gz'",
+        ),
+    ] = [],
+    upload_concurrency: Annotated[
+        int,
+        typer.Option(
+            help="Number of artifacts uploaded in parallel, also used as the number of parts uploaded concurrently for large artifacts",
+        ),
+    ] = DEFAULT_UPLOAD_CONCURRENCY,
+    multipart_chunk_size: Annotated[
+        int,
+        typer.Option(
+            help="Size (in MB) of each part when uploading large artifacts with multipart upload",
+        ),
+    ] = DEFAULT_MULTIPART_CHUNK_SIZE,
+    skip_unchanged: Annotated[
+        bool,
+        typer.Option(
+            help="Skip uploading artifacts whose content hash matches the object already in S3",
+        ),
+    ] = True,
+    content_addressed: Annotated[
+        bool,
+        typer.Option(
+            help="Store artifacts by content hash under <s3-code-uri>/cas/ so identical artifacts are shared across job runs",
+        ),
+    ] = False,
+) -> Dict[str, Dict]:
+    """Run a DAG of PySpark jobs, each submitted once the jobs it depends on succeed"""
+    from emrflow.deployment.batch import load_job_specs
+    from emrflow.deployment.workflow import WorkflowRunner
+
+    jobs = load_job_specs(spec)
+    runner = WorkflowRunner(
+        global_obj_dict["emr_serverless"],
+        state_file=state_file or f"{spec}.state.json",
+        max_concurrency=max_concurrency,
+        ping_duration=ping_duration,
+        fail_fast=fail_fast,
+        show_logs=show_output,
+    )
+    responses = runner.run(
+        jobs,
+        excludes=exclude_paths,
+        upload_concurrency=upload_concurrency,
+        multipart_chunk_size=multipart_chunk_size,
+        skip_unchanged=skip_unchanged,
+        content_addressed=content_addressed,
+    )
+
+    failed = {}
+    for job in jobs:
+        job_state = responses.get(job["job_name"], {})
+        state = job_state.get("state", "NOT_SUBMITTED")
+        rich.print(
+            f"Job: {job['job_name']}, ID: {job_state.get('job_run_id')}, STATE: {state}"
+        )
+        if state != "SUCCESS":
+            failed[job["job_name"]] = state
+    if failed:
+        raise Exception(f"Jobs did not succeed: {failed}")
+    return responses
+
+
+@app.command()
+def gc_artifacts(
+    s3_code_uri: Annotated[
+        str,
+        typer.Option(help="Location of s3 holding the content-addressed artifacts"),
+    ],
+    retention_days: Annotated[
+        int,
+        typer.Option(
+            help="Keep artifacts referenced by job runs created in the last N days, or uploaded in that period",
+        ),
+    ] = 30,
+    dry_run: Annotated[
+        bool,
+        typer.Option(help="Only list the artifacts that would be removed"),
+    ] = False,
+) -> List[str]:
+    """Remove content-addressed artifacts that no recent job run references"""
+    response = global_obj_dict["emr_serverless"].gc_artifacts(
+        s3_code_uri=s3_code_uri, retention_days=retention_days, dry_run=dry_run
     )
     return response
 
@@ -227,6 +597,59 @@ def list_job_runs(
     return response
 
 
+@app.command()
+def search_job_runs(
+    name: Annotated[
+        Optional[str],
+        typer.Option(help="Part of the job name"),
+    ] = None,
+    tags: Annotated[
+        Optional[List[str]],
+        typer.Option(help="Tags the job runs must have such as --tags key:value"),
+    ] = None,
+    states: Annotated[
+        Optional[List[str]],
+        typer.Option(help="Job run states e.g. --states SUCCESS --states FAILED"),
+    ] = None,
+    limit: Annotated[
+        int,
+        typer.Option(help="The maximum number of job runs that can be listed"),
+    ] = 50,
+    refresh: Annotated[
+        bool,
+        typer.Option(
+            help="Fetch the job runs created since the last refresh before searching",
+        ),
+    ] = True,
+) -> List[Dict]:
+    """Search job runs in the local index of the application"""
+    from rich.table import Table
+
+    from emrflow.deployment.job_index import JobRunIndex
+
+    index = JobRunIndex(global_obj_dict["emr_serverless"])
+    try:
+        if refresh:
+            rich.print(f"Refreshed {index.refresh()} job runs")
+        response = index.search(
+            name=name, states=states, tags=convert_to_dict(tags), limit=limit
+        )
+    finally:
+        index.close()
+
+    table = Table("ID", "Name", "State", "Created At", "Tags")
+    for job_run in response:
+        table.add_row(
+            job_run["id"],
+            job_run["name"],
+            job_run["state"],
+            job_run["created_at"],
+            ", ".join(f"{key}:{value}" for key, value in job_run["tags"].items()),
+        )
+    rich.print(table)
+    return response
+
+
 @app.command()
 def get_job_run(
     job_id: Annotated[
@@ -284,20 +707,90 @@ def resume_job_tracking(
         bool,
         typer.Option(help="Show the output of logs after job is finished"),
     ] = True,
+    show_executor_logs: Annotated[
+        bool,
+        typer.Option(
+            help="With --show-output, also stream the stdout and stderr of every executor",
+        ),
+    ] = False,
     ping_duration: Annotated[
         Optional[int],
         typer.Option(
-            help="Ping duration (in sec) that status when job tracking is enabled",
+            help="Maximum ping duration (in sec) to check the status when job tracking is enabled. Polling starts faster after state changes, then backs off up to this value",
         ),
     ] = 30,
 ) -> Dict:
     """Resume job tracking"""
     _, _, jr_response = global_obj_dict["emr_serverless"].job_tracking(
-        job_id, show_output, ping_duration
+        job_id, show_output, ping_duration, show_executor_logs=show_executor_logs
     )
     return jr_response
 
 
+@app.command()
+def track(
+    job_id: Annotated[
+        List[str],
+        typer.Option(
+            help="Job IDs to track, e.g. --job-id <id-1> --job-id <id-2>",
+        ),
+    ],
+    show_output: Annotated[
+        bool,
+        typer.Option(help="Show the logs of every tracked job"),
+    ] = False,
+    show_output_for: Annotated[
+        List[str],
+        typer.Option(help="Show the logs of these jobs only"),
+    ] = [],
+    show_executor_logs: Annotated[
+        bool,
+        typer.Option(
+            help="Also stream the stdout and stderr of every executor of the jobs whose logs are shown",
+        ),
+    ] = False,
+    ping_duration: Annotated[
+        Optional[int],
+        typer.Option(
+            help="Maximum ping duration (in sec) between two status checks of a job. Polling starts faster after state changes, then backs off up to this value",
+        ),
+    ] = 30,
+    max_calls_per_second: Annotated[
+        float,
+        typer.Option(
+            help="Maximum number of get_job_run calls per second across all jobs",
+        ),
+    ] = 5,
+    fail_fast: Annotated[
+        bool,
+        typer.Option(help="Stop tracking as soon as one job does not succeed"),
+    ] = False,
+) -> Dict[str, Dict]:
+    """Track several job runs concurrently"""
+    from emrflow.deployment.tracker import MultiJobTracker
+
+    tracker = MultiJobTracker(
+        global_obj_dict["emr_serverless"],
+        ping_duration=ping_duration,
+        max_calls_per_second=max_calls_per_second,
+        fail_fast=fail_fast,
+        show_executor_logs=show_executor_logs,
+    )
+    responses = tracker.run(
+        job_id, show_logs_for=job_id if show_output else show_output_for
+    )
+
+    failed = {}
+    for job_run_id in job_id:
+        state = responses.get(job_run_id, {}).get("state")
+        rich.print(f"Job: {job_run_id}, STATE: {state}")
+        if state != "SUCCESS":
+            failed[job_run_id] = state
+    if failed:
+        raise Exception(f"Jobs did not succeed: {failed}")
+    return responses
+
+
 @app.command()
 def get_logs(
     job_id: Annotated[
@@ -306,7 +799,303 @@ def get_logs(
             help="Job ID",
         ),
     ],
-) -> str:
-    """Get logs for job run"""
-    response = global_obj_dict["emr_serverless"].show_logs(job_id, log_read_pos=0)
-    return response
+    show_executor_logs: Annotated[
+        bool,
+        typer.Option(
+            help="Also print the stdout and stderr of every executor",
+        ),
+    ] = False,
+    all_logs: Annotated[
+        bool,
+        typer.Option(
+            "--all",
+            help="Download every log object of the job run instead of printing the logs",
+        ),
+    ] = False,
+    dest: Annotated[
+        str,
+        typer.Option(
+            help="With --all, directory where the logs are copied",
+        ),
+    ] = "",
+) -> int:
+    """
+    Get logs for job run. Logs are downloaded to a local cache (~/.emrflow/logs), so the
+    logs of finished job runs are only downloaded once.
+    """
+    from emrflow.deployment.logs import LogCache
+
+    emr_serverless = global_obj_dict["emr_serverless"]
+    if all_logs:
+        files = emr_serverless.download_logs(job_id, dest=dest)
+        location = dest or LogCache().job_dir(job_id)
+        rich.print(f"{len(files)} log objects of {job_id} available in {location}")
+        return len(files)
+    return emr_serverless.print_logs(job_id, executor_logs=show_executor_logs)
+
+
+@app.command()
+def search_logs(
+    job_id: Annotated[
+        str,
+        typer.Option(
+            help="Job ID",
+        ),
+    ],
+    pattern: Annotated[
+        str,
+        typer.Option(
+            help="Regular expression searched in every line of the driver and executor logs",
+        ),
+    ],
+    context: Annotated[
+        int,
+        typer.Option(
+            help="Lines shown before and after each match",
+            min=0,
+        ),
+    ] = 2,
+    max_matches: Annotated[
+        int,
+        typer.Option(
+            help="Stop after this many matches, 0 for no limit",
+            min=0,
+        ),
+    ] = 0,
+    ignore_case: Annotated[
+        bool,
+        typer.Option(
+            help="Case insensitive search",
+        ),
+    ] = False,
+) -> int:
+    """Search the logs of a job run, streaming every log object concurrently"""
+    matches = global_obj_dict["emr_serverless"].search_logs(
+        job_id,
+        pattern,
+        context=context,
+        max_matches=max_matches,
+        ignore_case=ignore_case,
+    )
+    rich.print(f"{matches} matches found")
+    return matches
+
+
+@app.command()
+def metrics(
+    since: Annotated[
+        str,
+        typer.Option(
+            help="Only job runs recorded within this duration, e.g. 12h, 7d, 2w",
+        ),
+    ] = "7d",
+    output_format: Annotated[
+        str,
+        typer.Option(
+            "--format",
+            help="table, jsonl or prometheus (text exposition format)",
+        ),
+    ] = "table",
+    output: Annotated[
+        str,
+        typer.Option(
+            help="Write the metrics to this file instead of printing them, e.g. for the textfile collector of the Prometheus node exporter",
+        ),
+    ] = "",
+) -> List[Dict]:
+    """Show the recorded timings and resource utilization of job runs"""
+    import time
+
+    from rich.table import Table
+
+    from emrflow.deployment.metrics import (
+        RESOURCE_UTILIZATION_KEYS,
+        TRACKED_STATES,
+        open_metrics_store,
+        prometheus_text,
+    )
+
+    recorder = global_obj_dict["emr_serverless"].metrics
+    store = recorder.store if recorder is not None else open_metrics_store()
+    records = store.records(since=time.time() - parse_duration(since))
+
+    if output_format == "table":
+        phases = ["upload", "submit"] + TRACKED_STATES
+        table = Table(
+            "Job Run ID",
+            "Name",
+            "State",
+            "Upload MB",
+            *(f"{phase} s" for phase in phases),
+            "End to End s",
+            *RESOURCE_UTILIZATION_KEYS,
+        )
+        for record in records:
+            utilization = record.get("total_resource_utilization") or {}
+            table.add_row(
+                record["job_run_id"],
+                record.get("job_name"),
+                record.get("final_state"),
+                (
+                    f"{record['upload_bytes'] / 1024 ** 2:.1f}"
+                    if record.get("upload_bytes") is not None
+                    else ""
+                ),
+                *(
+                    (
+                        f"{record['durations'][phase]:.1f}"
+                        if phase in record["durations"]
+                        else ""
+                    )
+                    for phase in phases
+                ),
+                (
+                    f"{record['end_to_end_seconds']:.1f}"
+                    if record.get("end_to_end_seconds") is not None
+                    else ""
+                ),
+                *(str(utilization.get(key, "")) for key in RESOURCE_UTILIZATION_KEYS),
+            )
+        rich.print(table)
+        return records
+
+    if output_format == "jsonl":
+        text = "".join(json.dumps(record) + "\n" for record in records)
+    elif output_format == "prometheus":
+        text = prometheus_text(records)
+    else:
+        raise typer.BadParameter(
+            f"Unknown format {output_format}, use table, jsonl or prometheus"
+        )
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(text)
+        rich.print(f"{len(records)} job runs written to {output}")
+    else:
+        print(text, end="")
+    return records
+
+
+@app.command()
+def report(
+    since: Annotated[
+        str,
+        typer.Option(
+            help="Only job runs created within this duration, e.g. 12h, 7d, 2w",
+        ),
+    ] = "7d",
+    group_by: Annotated[
+        str,
+        typer.Option(
+            help="Aggregate the job runs by name, state or tag:<key>, e.g. tag:team",
+        ),
+    ] = "name",
+    refresh: Annotated[
+        bool,
+        typer.Option(
+            help="Fetch the job runs created since the last refresh of the local index",
+        ),
+    ] = True,
+    max_workers: Annotated[
+        int,
+        typer.Option(
+            help="Number of job run details fetched in parallel",
+            min=1,
+        ),
+    ] = 8,
+) -> List[Dict]:
+    """Report the vCPU, memory and storage usage of job runs, with trends per job name"""
+    from datetime import datetime, timedelta, timezone
+
+    from rich.table import Table
+
+    from emrflow.deployment.job_index import JobRunIndex
+    from emrflow.deployment.report import (
+        aggregate_usage,
+        collect_usage,
+        job_name_trends,
+        validate_group_by,
+    )
+
+    # fail before fetching every job run
+    try:
+        validate_group_by(group_by)
+    except ValueError as ex:
+        raise typer.BadParameter(str(ex)) from ex
+
+    created_after = datetime.now(timezone.utc) - timedelta(
+        seconds=parse_duration(since)
+    )
+    index = JobRunIndex(global_obj_dict["emr_serverless"], max_workers=max_workers)
+    try:
+        usages = collect_usage(
+            global_obj_dict["emr_serverless"],
+            index,
+            created_after,
+            refresh=refresh,
+            max_workers=max_workers,
+        )
+    finally:
+        index.close()
+
+    table = Table(
+        group_by,
+        "Runs",
+        "Failed",
+        "Runtime h",
+        "vCPU h",
+        "Memory GB h",
+        "Storage GB h",
+        "Billed vCPU h",
+        "Billed Memory GB h",
+        "Avg vCPUs",
+        "Avg Memory GB",
+        title=f"Job runs of the last {since} by {group_by}",
+    )
+    for row in aggregate_usage(usages, group_by):
+        table.add_row(
+            row["group"],
+            str(row["runs"]),
+            str(row["failed"]),
+            f"{row['runtime_hours']:.2f}",
+            f"{row['vCPUHour']:.2f}",
+            f"{row['memoryGBHour']:.2f}",
+            f"{row['storageGBHour']:.2f}",
+            f"{row['billed_vCPUHour']:.2f}",
+            f"{row['billed_memoryGBHour']:.2f}",
+            f"{row['avg_vcpu']:.1f}",
+            f"{row['avg_memory_gb']:.1f}",
+        )
+    rich.print(table)
+
+    def change(value) -> str:
+        return "" if value is None else f"{value:+.0%}"
+
+    table = Table(
+        "Name",
+        "Runs",
+        "Avg Runtime min",
+        "Runtime Trend",
+        "Avg vCPU h",
+        "vCPU h Trend",
+        "vCPU h per Run",
+        "Avg Memory GB h",
+        "Avg vCPUs",
+        "Avg Memory GB",
+        title="Trends per job name",
+    )
+    for trend in job_name_trends(usages):
+        table.add_row(
+            trend["name"],
+            str(trend["runs"]),
+            f"{trend['avg_runtime_minutes']:.1f}",
+            change(trend["runtime_change"]),
+            f"{trend['avg_vCPUHour']:.2f}",
+            change(trend["vCPUHour_change"]),
+            trend["vCPUHour_spark_line"],
+            f"{trend['avg_memoryGBHour']:.2f}",
+            f"{trend['avg_vcpu']:.1f}",
+            f"{trend['avg_memory_gb']:.1f}",
+        )
+    rich.print(table)
+    return usages
@@ -0,0 +1,14 @@
+"""Build the project and environment packages"""
+
+# payload executors never use, names matched anywhere in the environment and
+# paths containing a / matched from its root. Kept here so the CLI defaults do not
+# load the packaging modules. `tests` is not listed, some libraries import their
+# tests package at runtime
+DEFAULT_PRUNE_PATTERNS = [
+    "__pycache__",
+    "*.a",
+    "*.js.map",
+    "share/doc",
+    "share/man",
+    "share/info",
+]
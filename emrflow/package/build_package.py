@@ -1,47 +1,117 @@
 """Build package for the project"""
 
-from typing import List
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional, Tuple
 
 import rich
 
-from emrflow.package.create_env import create_conda_env, create_docker_env
-from emrflow.package.project_dependency_src import create_packaged_dependency_src
+from emrflow.package.create_env import (
+    DEFAULT_PACK_COMPRESS_LEVEL,
+    DEFAULT_PACK_THREADS,
+    create_conda_env,
+    create_docker_env,
+)
+from emrflow.package.env_cache import (
+    ENV_ARCHIVE_NAME,
+    EnvCache,
+    RemoteEnvCache,
+    env_fingerprint,
+)
+from emrflow.package.project_dependency_src import (
+    PROJECT_ARCHIVE_NAME,
+    create_packaged_dependency_src,
+)
+from emrflow.utils import upload_package, write_s3_pointer
 
 
-def build_package(
+def package_environment(
     output_dir: str,
-    package_project: bool,
     include_paths: List[str],
-    package_env: bool,
     env_type: str,
     env_exec_cmd: List[str],
     env_python_version: str,
     env_proxy: str,
+    env_cache: bool = True,
+    env_cache_uri: str = "",
+    docker_cache: str = "",
+    cancel_event: Optional[threading.Event] = None,
+    s3_client=None,
+    s3_uri: str = "",
+    keep_local: bool = True,
+    pack_threads: int = DEFAULT_PACK_THREADS,
+    pack_compress_level: int = DEFAULT_PACK_COMPRESS_LEVEL,
+    prune_patterns: Optional[List[str]] = None,
+    compile_pyc: bool = False,
 ) -> int:
     """
-    Build package for the project
+    Build and package the environment, or reuse a cached one
     output_dir: str : output directory
-    package_project: bool : package project
     include_paths: List[str] : project directory
-    package_env: bool : package environment
     env_type: str : environment type
     env_exec_cmd: List[str] : environment execution command
     env_python_version: str : python version
     env_proxy: str : environment proxy
+    env_cache: bool : reuse an environment packaged from the same lockfiles
+    env_cache_uri: str : s3 prefix of an environment cache shared across machines
+    docker_cache: str : BuildKit cache location of docker builds
+    cancel_event: threading.Event : stop the build once set
+    s3_client: boto3.client : s3 client of the remote cache, the shared client by default
+    s3_uri: str : stream docker builds to this s3 uri, or to the remote cache
+    keep_local: bool : also write streamed archives to the output directory
+    pack_threads: int : threads compressing the archive, -1 for every core
+    pack_compress_level: int : gzip level of the archive, from 0 to 9
+    prune_patterns: List[str] : files removed from the environment before packing,
+        None to keep everything
+    compile_pyc: bool : precompile the .pyc files of the environment
 
     return: return_code : int
     """
+    env_archive = os.path.join(output_dir, ENV_ARCHIVE_NAME)
+    cache = EnvCache()
+    remote_cache = (
+        RemoteEnvCache(env_cache_uri, s3_client)
+        if env_cache and env_cache_uri
+        else None
+    )
+    fingerprint = env_fingerprint(
+        env_type=env_type,
+        python_version=str(env_python_version),
+        exec_cmd=env_exec_cmd,
+        include_paths=include_paths,
+        # archives packed with the default level keep their previous fingerprint
+        compress_level=(
+            None
+            if pack_compress_level == DEFAULT_PACK_COMPRESS_LEVEL
+            else pack_compress_level
+        ),
+        prune_patterns=prune_patterns,
+        compile_pyc=compile_pyc,
+        skip_dirs=[output_dir],
+    )
+    # the pointer of a previous build may reference another environment
+    os.makedirs(output_dir, exist_ok=True)
+    write_s3_pointer(env_archive, None)
+    published = False
 
-    rich.print("Building code package and required dependencies")
+    if env_cache and cache.get(fingerprint, env_archive):
+        rich.print(f"Reusing cached {env_type} environment {fingerprint[:12]}")
+        return_code = 0
+    elif remote_cache and remote_cache.exists(fingerprint):
+        rich.print(f"Reusing {env_type} environment {remote_cache.uri(fingerprint)}")
+        # the archive stays in S3, a stale local one would be misleading
+        if os.path.lexists(env_archive):
+            os.remove(env_archive)
+        published = True
+        return_code = 0
+    else:
+        # the previous archive may be hardlinked to a cache entry, never
+        # overwrite it in place
+        if os.path.lexists(env_archive):
+            os.remove(env_archive)
 
-    # package project src dependencies
-    if package_project:
-        return_code = create_packaged_dependency_src(
-            include_paths=include_paths,
-            output_dir=output_dir,
-        )
-
-    if package_env:
         # compile conda environment
         rich.print(f"Building and packaging {env_type} environment...")
         if env_type == "conda":
@@ -51,14 +121,238 @@ def build_package(
                 output_dir=output_dir,
                 include_paths=include_paths,
                 exec_cmd=env_exec_cmd,
+                cancel_event=cancel_event,
+                pack_threads=pack_threads,
+                pack_compress_level=pack_compress_level,
+                prune_patterns=prune_patterns,
+                compile_pyc=compile_pyc,
             )
         if env_type == "docker":
+            stream_kwargs = {}
+            if s3_uri:
+                # a fresh build streamed to the remote cache is published at once
+                stream_kwargs = {
+                    "s3_uri": remote_cache.uri(fingerprint) if remote_cache else s3_uri,
+                    "s3_client": s3_client,
+                    "keep_local": keep_local,
+                }
+                published = remote_cache is not None
             return_code = create_docker_env(
                 python_version=str(env_python_version),
                 proxy=env_proxy,
                 output_dir=output_dir,
                 include_paths=include_paths,
                 exec_cmd=env_exec_cmd,
+                cache=docker_cache,
+                cancel_event=cancel_event,
+                pack_threads=pack_threads,
+                pack_compress_level=pack_compress_level,
+                prune_patterns=prune_patterns,
+                compile_pyc=compile_pyc,
+                **stream_kwargs,
             )
 
+        if env_cache and os.path.isfile(env_archive):
+            cache.put(fingerprint, env_archive)
+
+    if remote_cache:
+        if not published and not remote_cache.exists(fingerprint):
+            remote_cache.publish(fingerprint, env_archive)
+        write_s3_pointer(env_archive, remote_cache.uri(fingerprint))
+
     return return_code
+
+
+def run_stages(
+    stages: Dict[str, Tuple[Callable[[], int], str]],
+    cancel_event: threading.Event,
+    s3_code_uri: str = "",
+    s3_client=None,
+) -> int:
+    """
+    Run independent packaging stages concurrently. The first failure cancels the
+    other stages and is raised once they stopped. With `s3_code_uri`, the artifact
+    of each stage is uploaded as soon as the stage finishes, one upload at a time,
+    and not at all once the packaging is cancelled.
+    stages: Dict[str, Tuple[Callable, str]] : stage name to its function and artifact
+    cancel_event: threading.Event : set to cancel the running stages
+    s3_code_uri: str : s3 code uri where the artifacts are uploaded
+    s3_client: boto3.client : s3 client of the uploads, the shared client by default
+
+    return: return_code : int
+    """
+    if not stages:
+        return 0
+    start = time.monotonic()
+    if s3_code_uri and s3_client is None:
+        from emrflow.deployment.clients import get_client
+
+        s3_client = get_client("s3")
+
+    def run_stage(name: str, func: Callable[[], int]) -> int:
+        rich.print(f"Stage {name} started")
+        return_code = func()
+        rich.print(f"Stage {name} finished in {time.monotonic() - start:.1f}s")
+        return return_code
+
+    # each upload shows its own rich progress, only one can be live at a time
+    upload_lock = threading.Lock()
+
+    def upload(name: str, artifact: str):
+        with upload_lock:
+            if cancel_event.is_set():
+                rich.print(f"Stage {name} upload cancelled")
+                return
+            # keys relative to the working directory, as `run` uploads them
+            upload_package(s3_client, s3_code_uri, [os.path.relpath(artifact)])
+        rich.print(
+            f"Stage {name} uploaded to {s3_code_uri} in {time.monotonic() - start:.1f}s"
+        )
+
+    with ThreadPoolExecutor(max_workers=2 * len(stages)) as executor:
+        pending = {
+            executor.submit(run_stage, name, func): name
+            for name, (func, _) in stages.items()
+        }
+        return_codes = []
+        try:
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = pending.pop(future)
+                    if name in stages:
+                        return_codes.append(future.result())
+                        if s3_code_uri:
+                            pending[executor.submit(upload, name, stages[name][1])] = (
+                                f"{name} upload"
+                            )
+                    else:
+                        future.result()
+        except BaseException:
+            cancel_event.set()
+            raise
+
+    rich.print(f"Packaging finished in {time.monotonic() - start:.1f}s")
+    return max(return_codes, default=0)
+
+
+def build_package(
+    output_dir: str,
+    package_project: bool,
+    include_paths: List[str],
+    package_env: bool,
+    env_type: str,
+    env_exec_cmd: List[str],
+    env_python_version: str,
+    env_proxy: str,
+    env_cache: bool = True,
+    env_cache_uri: str = "",
+    docker_cache: str = "",
+    s3_code_uri: str = "",
+    s3_client=None,
+    stream_upload: bool = False,
+    keep_local: bool = True,
+    env_pack_threads: int = DEFAULT_PACK_THREADS,
+    env_compress_level: int = DEFAULT_PACK_COMPRESS_LEVEL,
+    env_prune_patterns: Optional[List[str]] = None,
+    env_compile_pyc: bool = False,
+) -> int:
+    """
+    Build package for the project. The project and environment packages are built
+    concurrently, the first failure cancels the other build.
+    output_dir: str : output directory
+    package_project: bool : package project
+    include_paths: List[str] : project directory
+    package_env: bool : package environment
+    env_type: str : environment type
+    env_exec_cmd: List[str] : environment execution command
+    env_python_version: str : python version
+    env_proxy: str : environment proxy
+    env_cache: bool : reuse an environment packaged from the same lockfiles
+    env_cache_uri: str : s3 prefix of an environment cache shared across machines,
+        `run` then uses the archive from S3 instead of uploading it. Requires
+        `env_cache`
+    docker_cache: str : BuildKit cache location of docker builds, a local
+        directory or a registry reference
+    s3_code_uri: str : upload each package to this s3 code uri as soon as it is
+        built, while the other one is still building
+    s3_client: boto3.client : s3 client of the uploads and remote cache
+    stream_upload: bool : stream the project archive and docker environments to
+        `s3_code_uri` while they are written, instead of uploading the files after.
+        conda-pack only writes to a file, conda environments are uploaded once built.
+    keep_local: bool : also write the streamed archives to the output directory
+    env_pack_threads: int : threads compressing the environment, -1 for every core
+    env_compress_level: int : gzip level of the environment, from 0 to 9
+    env_prune_patterns: List[str] : files removed from the environment before
+        packing, None to keep everything
+    env_compile_pyc: bool : precompile the .pyc files of the environment
+
+    return: return_code : int
+    """
+    if stream_upload and not s3_code_uri:
+        raise Exception("Streaming the packages requires an s3 code uri!!")
+    if env_cache_uri and not env_cache:
+        # a remote cache would reuse or publish the environment anyway
+        raise Exception("An env cache uri cannot be used with the env cache disabled!!")
+
+    rich.print("Building code package and required dependencies")
+    cancel_event = threading.Event()
+    stages = {}
+    project_archive = os.path.join(output_dir, PROJECT_ARCHIVE_NAME)
+    env_archive = os.path.join(output_dir, ENV_ARCHIVE_NAME)
+    project_stream_kwargs = {}
+    env_stream_kwargs = {}
+    if stream_upload:
+        if s3_client is None:
+            from emrflow.deployment.clients import get_client
+
+            s3_client = get_client("s3")
+        # same keys as the uploads of `run`
+        project_stream_kwargs = {
+            "s3_uri": os.path.join(s3_code_uri, os.path.relpath(project_archive)),
+            "s3_client": s3_client,
+            "keep_local": keep_local,
+        }
+        env_stream_kwargs = {
+            "s3_uri": os.path.join(s3_code_uri, os.path.relpath(env_archive)),
+            "keep_local": keep_local,
+        }
+
+    # package project src dependencies
+    if package_project:
+        stages["project"] = (
+            lambda: create_packaged_dependency_src(
+                include_paths=include_paths,
+                output_dir=output_dir,
+                cancel_event=cancel_event,
+                **project_stream_kwargs,
+            ),
+            project_archive,
+        )
+
+    if package_env:
+        stages["environment"] = (
+            lambda: package_environment(
+                output_dir=output_dir,
+                include_paths=include_paths,
+                env_type=env_type,
+                env_exec_cmd=env_exec_cmd,
+                env_python_version=env_python_version,
+                env_proxy=env_proxy,
+                env_cache=env_cache,
+                env_cache_uri=env_cache_uri,
+                docker_cache=docker_cache,
+                cancel_event=cancel_event,
+                s3_client=s3_client,
+                pack_threads=env_pack_threads,
+                pack_compress_level=env_compress_level,
+                prune_patterns=env_prune_patterns,
+                compile_pyc=env_compile_pyc,
+                **env_stream_kwargs,
+            ),
+            env_archive,
+        )
+
+    return run_stages(
+        stages, cancel_event, s3_code_uri=s3_code_uri, s3_client=s3_client
+    )
@@ -4,15 +4,98 @@ are packaged and saved in the output directory
 """
 
 import os
-from typing import List
+import shutil
+import tarfile
+import threading
+from typing import IO, List, Optional
 
 import rich
 
-from emrflow.utils import execute_bash_script
+from emrflow.package.env_cache import (
+    ENV_ARCHIVE_NAME,
+    find_lockfiles,
+    is_poetry_install,
+    needs_sources,
+)
+from emrflow.utils import MB, S3StreamWriter, execute_bash_script, write_s3_pointer
+
+# conda-pack defaults to a single thread, the archive is compressed in parallel on
+# every core instead. The gzip output stays readable by `spark.archives`.
+DEFAULT_PACK_THREADS = -1
+DEFAULT_PACK_COMPRESS_LEVEL = 4
+
+
+def prune_env_script(
+    prefix: str, patterns: List[str], compile_pyc: bool = False
+) -> str:
+    """
+    Shell command removing the files of an environment matching the patterns and
+    reporting its size before and after. conda-pack runs with --ignore-missing-files,
+    so removed files of installed packages do not fail the pack.
+    prefix: str : environment directory
+    patterns: List[str] : file or directory names, paths relative to the prefix
+        when they contain a /
+    compile_pyc: bool : precompile the .pyc files with the python of the
+        environment, so executors do not compile modules on every import
+
+    return: str : single line shell command, failing as soon as a step fails
+    """
+    matches = " -o ".join(
+        (
+            f"-path \"$PRUNE_PREFIX/{pattern.strip('/')}\""
+            if "/" in pattern
+            else f"-name '{pattern}'"
+        )
+        for pattern in patterns
+    )
+    commands = [
+        f"PRUNE_PREFIX={prefix}",
+        # no pipe, a failing du fails the command
+        'BEFORE=$(du -sb "$PRUNE_PREFIX")',
+        'BEFORE="${BEFORE%%[[:space:]]*}"',
+    ]
+    if matches:
+        commands.append(
+            f'find "$PRUNE_PREFIX" -mindepth 1 \\( {matches} \\) -prune -exec rm -rf {{}} +'
+        )
+    if compile_pyc:
+        # unpacked files get new paths and mtimes, hash-checked .pyc stay valid
+        commands.append(
+            '{ "$PRUNE_PREFIX/bin/python" -m compileall -q -j 0 '
+            '--invalidation-mode unchecked-hash "$PRUNE_PREFIX/lib" > /dev/null || true; }'
+        )
+    commands += [
+        'AFTER=$(du -sb "$PRUNE_PREFIX")',
+        'AFTER="${AFTER%%[[:space:]]*}"',
+        'echo "Pruned environment from $((BEFORE / 1048576)) MB to $((AFTER / 1048576)) MB"',
+    ]
+    return " && ".join(commands)
+
+
+def conda_pack_options(n_threads: int, compress_level: int) -> str:
+    """
+    Compression options of `conda pack`
+    n_threads: int : threads compressing the archive, -1 for every core
+    compress_level: int : gzip level from 0 (no compression, fastest) to 9
+
+    return: str : options
+    """
+    if not 0 <= compress_level <= 9:
+        raise ValueError(f"Compression level must be between 0 and 9: {compress_level}")
+    return f"--n-threads {n_threads} --compress-level {compress_level}"
 
 
 def create_conda_env(
-    python_version: str, proxy: str, exec_cmd: List, output_dir: str, include_paths: str
+    python_version: str,
+    proxy: str,
+    exec_cmd: List,
+    output_dir: str,
+    include_paths: str,
+    cancel_event: Optional[threading.Event] = None,
+    pack_threads: int = DEFAULT_PACK_THREADS,
+    pack_compress_level: int = DEFAULT_PACK_COMPRESS_LEVEL,
+    prune_patterns: Optional[List[str]] = None,
+    compile_pyc: bool = False,
 ) -> int:
     """
     Create conda environment
@@ -21,11 +104,21 @@ def create_conda_env(
     exec_cmd: List : execution command
     output_dir: str : output directory
     include_paths: List[str] : project directory
+    cancel_event: threading.Event : stop the build once set
+    pack_threads: int : threads compressing the archive, -1 for every core
+    pack_compress_level: int : gzip level of the archive, from 0 to 9
+    prune_patterns: List[str] : files removed from the environment before packing
+    compile_pyc: bool : precompile the .pyc files of the environment
 
     return: return_code: int
     """
 
     rich.print(f"Additional commands provided:- {exec_cmd}")
+    prune_cmd = ""
+    if prune_patterns or compile_pyc:
+        prefix = "$(conda run -n emr_runner python -c 'import sys; print(sys.prefix)')"
+        # set -e ignores failures inside an && list, stop the build explicitly
+        prune_cmd = f"\n    {prune_env_script(prefix, prune_patterns or [], compile_pyc)} || exit 1;"
     conda_runner = "conda run -n emr_runner"
     inject_cmd = ""
 
@@ -57,34 +150,147 @@ def create_conda_env(
 
     conda create -n emr_runner python={python_version} -y;
     {inject_cmd}
-    pip install conda-pack;
-    conda pack -n emr_runner --ignore-missing-files -f -o {output_dir}/pyspark_deps.tar.gz;"""
+    pip install conda-pack;{prune_cmd}
+    conda pack -n emr_runner --ignore-missing-files -f {conda_pack_options(pack_threads, pack_compress_level)} -o {output_dir}/pyspark_deps.tar.gz;"""
 
-    returncode = execute_bash_script(conda_commnd)
+    returncode = execute_bash_script(conda_commnd, cancel_event=cancel_event)
     if returncode != 0:
         raise Exception("Conda environment creation failed!!")
     return returncode
 
 
+# BuildKit cache mounts keeping downloaded packages between builds
+DOCKER_CACHE_MOUNTS = {
+    "yum": "--mount=type=cache,target=/var/cache/yum,sharing=locked",
+    "deps": " ".join(
+        [
+            "--mount=type=cache,target=/root/.cache/pip",
+            "--mount=type=cache,target=/root/.cache/pypoetry",
+            "--mount=type=cache,target=/opt/conda/pkgs",
+        ]
+    ),
+}
+
+
+def docker_cache_options(cache: str) -> str:
+    """
+    `--cache-from/--cache-to` options of `docker buildx build`
+    cache: str : local directory (starting with /, . or ~), registry reference, or
+        a raw buildx cache spec such as `type=gha`
+
+    return: str : build options
+    """
+    if not cache:
+        return ""
+    if "type=" in cache:
+        cache_from = cache_to = cache
+    elif cache.startswith(("/", ".", "~")):
+        cache_dir = os.path.expanduser(cache)
+        cache_from = f"type=local,src={cache_dir}"
+        cache_to = f"type=local,dest={cache_dir},mode=max"
+    else:
+        cache_from = f"type=registry,ref={cache}"
+        cache_to = f"type=registry,ref={cache},mode=max"
+    return f"--cache-from {cache_from} --cache-to {cache_to} "
+
+
+def docker_copy_lockfiles(lockfiles: List[str]) -> str:
+    """
+    Dockerfile instructions copying the lockfiles, keeping their relative paths
+    lockfiles: List[str] : lockfile paths
+
+    return: str : COPY instructions
+    """
+    copies = []
+    for path in lockfiles:
+        path = os.path.relpath(path)
+        # only files of the build context can be copied
+        if path.startswith(".."):
+            continue
+        directory = os.path.dirname(path)
+        copies.append(f"COPY {path} ./{directory + '/' if directory else ''}")
+    return "\n    ".join(copies)
+
+
+def stream_env_archive(writer: S3StreamWriter):
+    """
+    Handler of the `type=tar` output of the docker build, copying the environment
+    archive of the exported stage to `writer` as it is produced
+    writer: S3StreamWriter : destination of the environment archive
+
+    return: Callable : handler of the build output
+    """
+
+    def handler(output: IO[bytes]):
+        found = False
+        with tarfile.open(fileobj=output, mode="r|") as export:
+            for member in export:
+                if (
+                    member.isfile()
+                    and os.path.basename(member.name) == ENV_ARCHIVE_NAME
+                ):
+                    shutil.copyfileobj(export.extractfile(member), writer, MB)
+                    found = True
+        # drain the end of the output so the build is not blocked writing it
+        for _ in iter(lambda: output.read(MB), b""):
+            pass
+        if not found:
+            raise Exception(f"{ENV_ARCHIVE_NAME} is missing from the docker output")
+
+    return handler
+
+
 def create_docker_env(
     python_version: str,
     proxy: str,
     exec_cmd: List,
     output_dir: str,
     include_paths: List[str],
+    cache: str = "",
+    cancel_event: Optional[threading.Event] = None,
+    s3_uri: str = "",
+    s3_client=None,
+    keep_local: bool = True,
+    pack_threads: int = DEFAULT_PACK_THREADS,
+    pack_compress_level: int = DEFAULT_PACK_COMPRESS_LEVEL,
+    prune_patterns: Optional[List[str]] = None,
+    compile_pyc: bool = False,
 ):
     """
-    Create docker environment
+    Create docker environment. Only the lockfiles are copied for the commands up to
+    the first one needing the project sources, a `poetry install` installing the
+    project installs its dependencies with --no-root first. The sources are copied
+    for the remaining commands, so source changes keep the dependency layers
+    cached. With `s3_uri`, the
+    archive exported by the build is streamed to S3 as it is produced and a
+    `.s3uri` sidecar records its location for `run`.
     python_version: str : python version
     proxy: str : proxy endpoint
     exec_cmd: List : execution command
     output_dir: str : output directory
     include_paths: List[str] : project directory and paths to include
+    cache: str : BuildKit cache imported and exported by the build, a local
+        directory or a registry reference
+    cancel_event: threading.Event : stop the build once set
+    s3_uri: str : stream the environment archive to this s3 uri
+    s3_client: boto3.client : s3 client of the stream
+    keep_local: bool : also write the streamed archive to the output directory
+    pack_threads: int : threads compressing the archive, -1 for every core
+    pack_compress_level: int : gzip level of the archive, from 0 to 9
+    prune_patterns: List[str] : files removed from the environment before packing
+    compile_pyc: bool : precompile the .pyc files of the environment
 
     return: return_code: int
     """
 
     rich.print(f"Additional commands provided:- {exec_cmd}")
+    pack_options = conda_pack_options(pack_threads, pack_compress_level)
+    prune_cmd = ""
+    if prune_patterns or compile_pyc:
+        prune_cmd = f"""
+    # strip the payload executors never use
+    RUN {prune_env_script("/opt/conda/envs/runner-emr-env", prune_patterns or [], compile_pyc)}
+"""
 
     # Check if Docker is installed and running
     returncode = execute_bash_script("docker --version")
@@ -93,13 +299,36 @@ def create_docker_env(
         rich.print("Docker is not installed or not running!!")
         raise Exception("Docker is not installed or not running!!")
 
-    conda_runner = "RUN conda run -n runner-emr-env "
-    inject_cmd = ""
+    conda_runner = f"RUN {DOCKER_CACHE_MOUNTS['deps']} conda run -n runner-emr-env "
+    lockfiles = find_lockfiles(exec_cmd, include_paths)
+    # the commands up to the first one needing the sources install the dependencies
+    # from the lockfiles only, source changes keep their layers cached
+    split = next(
+        (
+            index
+            for index, each_cmd in enumerate(exec_cmd)
+            if needs_sources(each_cmd, lockfiles)
+        ),
+        len(exec_cmd),
+    )
+    deps_cmd = list(exec_cmd[:split])
+    has_pyproject = any(
+        os.path.basename(path) == "pyproject.toml" for path in lockfiles
+    )
+    if split < len(exec_cmd) and has_pyproject and is_poetry_install(exec_cmd[split]):
+        # the dependencies first, the same command then only installs the project
+        deps_cmd.append(f"{exec_cmd[split]} --no-root")
 
-    for each_cmd in exec_cmd:
+    inject_cmd = ""
+    for each_cmd in deps_cmd:
+        inject_cmd += f"{conda_runner} {each_cmd};\n"
+    inject_cmd += f"    COPY {' '.join(include_paths)} .\n"
+    for each_cmd in exec_cmd[split:]:
         inject_cmd += f"{conda_runner} {each_cmd};\n"
 
-    docker_commnd = f"""
+    copy_inputs = docker_copy_lockfiles(lockfiles)
+
+    docker_commnd = f"""# syntax=docker/dockerfile:1
     FROM public.ecr.aws/emr-serverless/spark/emr-6.14.0:latest AS builder
 
     ENV PATH="/opt/conda/bin:$PATH"
@@ -112,20 +341,20 @@ def create_docker_env(
 
     WORKDIR /build
 
-    COPY {' '.join(include_paths)} .
-
-    RUN yum install -y gcc openssl-devel bzip2-devel libffi-devel tar gzip wget make
+    RUN {DOCKER_CACHE_MOUNTS['yum']} yum install -y --setopt=keepcache=1 gcc openssl-devel bzip2-devel libffi-devel tar gzip wget make
 
     # Download and install Miniconda
     RUN wget -q https://repo.anaconda.com/miniconda/Miniconda3-latest-Linux-x86_64.sh -O ~/miniconda.sh --no-check-certificate && \
         /bin/bash ~/miniconda.sh -b -p /opt/conda
 
-    RUN conda create -n runner-emr-env python={python_version} -y --force
+    RUN {DOCKER_CACHE_MOUNTS['deps']} conda create -n runner-emr-env python={python_version} -y --force
     RUN echo "conda activate runner-emr-env" > ~/.bashrc
-    {inject_cmd}
 
+    # install the libraries from the lockfiles first, source changes keep this layer
+    {copy_inputs}
+    {inject_cmd}{prune_cmd}
     # export conda environment to zip
-    RUN mkdir -p dist && pip install conda-pack && conda pack -n runner-emr-env --ignore-missing-files -f -o /build/dist/pyspark_deps.tar.gz;
+    RUN mkdir -p dist && pip install conda-pack && conda pack -n runner-emr-env --ignore-missing-files -f {pack_options} -o /build/dist/pyspark_deps.tar.gz;
 
     #Stage 2: Copy files to scratch image
     FROM scratch AS export
@@ -134,10 +363,42 @@ def create_docker_env(
 
     with open(f"{output_dir}/Dockerfile", "w") as file:
         file.write(docker_commnd)
-    returncode = execute_bash_script(
-        f"docker buildx build -f {output_dir}/Dockerfile --output type=local,dest={output_dir} ."
+    build_command = (
+        f"docker buildx build -f {output_dir}/Dockerfile {docker_cache_options(cache)}"
     )
 
+    if not s3_uri:
+        returncode = execute_bash_script(
+            f"{build_command}--output type=local,dest={output_dir} .",
+            cancel_event=cancel_event,
+        )
+        if returncode != 0:
+            raise Exception("Docker build failed!!")
+        return returncode
+
+    # the exported stage is written as a tar stream on stdout
+    env_archive = os.path.join(output_dir, ENV_ARCHIVE_NAME)
+    tmp_path = f"{env_archive}.tmp"
+    writer = S3StreamWriter(
+        s3_client, s3_uri, local_path=tmp_path if keep_local else None
+    )
+    try:
+        returncode = execute_bash_script(
+            f"{build_command}--output type=tar,dest=- .",
+            cancel_event=cancel_event,
+            stdout_handler=stream_env_archive(writer),
+        )
+    except BaseException:
+        writer.abort()
+        raise
     if returncode != 0:
+        writer.abort()
         raise Exception("Docker build failed!!")
+    writer.close()
+
+    if keep_local:
+        os.replace(tmp_path, env_archive)
+    elif os.path.lexists(env_archive):
+        os.remove(env_archive)
+    write_s3_pointer(env_archive, s3_uri)
     return returncode
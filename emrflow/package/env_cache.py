@@ -0,0 +1,359 @@
+"""
+Local cache of packaged environments. Building an environment takes minutes, so the
+packed archive is kept under a fingerprint of everything that defines its content:
+the environment type, python version, install commands and lockfiles, and the
+project files when the commands install the project itself.
+"""
+
+import glob
+import hashlib
+import json
+import os
+import platform
+import shutil
+from typing import Dict, List, Optional
+
+import rich
+
+from emrflow.utils import (
+    DIGEST_METADATA_KEY,
+    PrettyUploader,
+    file_sha256,
+    get_emrflow_home,
+    parse_bucket_uri,
+    s3_object_digest,
+)
+
+ENV_ARCHIVE_NAME = "pyspark_deps.tar.gz"
+
+# files pinning the dependencies installed by the environment commands
+LOCKFILE_NAMES = [
+    "poetry.lock",
+    "pyproject.toml",
+    "Pipfile.lock",
+    "requirements.txt",
+    "environment.yml",
+    "environment.yaml",
+    "conda-lock.yml",
+]
+
+DEFAULT_MAX_ENTRIES = 10
+DEFAULT_MAX_SIZE_GB = 20
+GB = 1024**3
+
+
+def find_lockfiles(exec_cmd: List[str], include_paths: List[str]) -> List[str]:
+    """
+    Lockfiles defining the environment: known lockfiles of the current directory
+    and include paths, and files referenced by the install commands
+    exec_cmd: List[str] : commands installing the libraries
+    include_paths: List[str] : project paths
+
+    return: List[str] : sorted lockfile paths
+    """
+    directories = ["."] + [
+        path if os.path.isdir(path) else os.path.dirname(path) or "."
+        for path in include_paths
+    ]
+    lockfiles = {
+        os.path.normpath(os.path.join(directory, name))
+        for directory in directories
+        for name in LOCKFILE_NAMES
+        if os.path.isfile(os.path.join(directory, name))
+    }
+    # e.g. `pip install -r requirements-spark.txt`
+    lockfiles.update(
+        os.path.normpath(token)
+        for command in exec_cmd
+        for token in command.split()
+        if os.path.isfile(token)
+    )
+    return sorted(lockfiles)
+
+
+def is_poetry_install(command: str) -> bool:
+    """
+    Check if a command runs `poetry install`
+    command: str : environment command
+
+    return: bool : poetry install command
+    """
+    tokens = command.split()
+    return "poetry" in tokens and "install" in tokens
+
+
+def installs_project(command: str) -> bool:
+    """
+    Check if a command installs the project itself in the environment, e.g.
+    `poetry install` without --no-root or `pip install .`
+    command: str : environment command
+
+    return: bool : the project is installed
+    """
+    tokens = command.split()
+    if is_poetry_install(command):
+        return "--no-root" not in tokens
+    if "install" in tokens and any(token in ["pip", "pip3"] for token in tokens):
+        return any(
+            token in [".", "./"] or (not token.startswith("-") and os.path.isdir(token))
+            for token in tokens[tokens.index("install") + 1 :]
+        )
+    return False
+
+
+def needs_sources(command: str, lockfiles: List[str]) -> bool:
+    """
+    Check if a command needs the project sources, and not only the lockfiles
+    command: str : environment command
+    lockfiles: List[str] : lockfile paths
+
+    return: bool : the sources must be available to the command
+    """
+    return installs_project(command) or any(
+        os.path.exists(token) and os.path.normpath(token) not in lockfiles
+        for token in command.split()
+    )
+
+
+def project_digest(
+    include_paths: List[str], skip_dirs: Optional[List[str]] = None
+) -> str:
+    """
+    Digest of the project files, with the exclude rules of the project package
+    include_paths: List[str] : project paths, missing ones are ignored
+    skip_dirs: List[str] : directories never walked
+
+    return: str : hex digest of the file names and contents
+    """
+    from emrflow.package.project_dependency_src import (
+        collect_files,
+        load_exclude_rules,
+    )
+
+    files = collect_files(
+        [path for path in include_paths if glob.glob(path)],
+        load_exclude_rules(),
+        skip_dirs=skip_dirs or [],
+    )
+    digest = hashlib.sha256()
+    for name, path in files.items():
+        digest.update(f"{name}\0{file_sha256(path)}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def env_fingerprint(
+    env_type: str,
+    python_version: str,
+    exec_cmd: List[str],
+    include_paths: List[str],
+    compress_level: Optional[int] = None,
+    prune_patterns: Optional[List[str]] = None,
+    compile_pyc: bool = False,
+    skip_dirs: Optional[List[str]] = None,
+) -> str:
+    """
+    Fingerprint of a packaged environment, identical inputs give the same archive.
+    When a command installs the project itself, its files are part of the inputs
+    env_type: str : environment type
+    python_version: str : python version
+    exec_cmd: List[str] : commands installing the libraries
+    include_paths: List[str] : project paths
+    compress_level: int : gzip level of the archive, None for the default one
+    prune_patterns: List[str] : files removed before packing, None when not pruned
+    compile_pyc: bool : .pyc files are precompiled before packing
+    skip_dirs: List[str] : directories left out of the project files, e.g. the
+        output directory
+
+    return: str : hex digest
+    """
+    definition = {
+        "env_type": env_type,
+        "python_version": str(python_version),
+        "exec_cmd": list(exec_cmd),
+        "lockfiles": {
+            path: file_sha256(path) for path in find_lockfiles(exec_cmd, include_paths)
+        },
+    }
+    if any(installs_project(command) for command in exec_cmd):
+        definition["project"] = project_digest(include_paths, skip_dirs)
+    if compress_level is not None:
+        definition["compress_level"] = compress_level
+    if prune_patterns is not None or compile_pyc:
+        definition["prune"] = {
+            "patterns": sorted(prune_patterns or []),
+            "compile_pyc": compile_pyc,
+        }
+    # a conda environment is packed from the host, docker builds a fixed image
+    if env_type == "conda":
+        definition["platform"] = [platform.system(), platform.machine()]
+    return hashlib.sha256(
+        json.dumps(definition, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+def link_or_copy(src: str, dest: str):
+    """
+    Hardlink a file, or copy it when the paths are on different file systems
+    src: str : source path
+    dest: str : destination path, replaced if it exists
+    """
+    tmp_path = f"{dest}.tmp"
+    if os.path.lexists(tmp_path):
+        os.remove(tmp_path)
+    try:
+        os.link(src, tmp_path)
+    except OSError:
+        shutil.copyfile(src, tmp_path)
+    os.replace(tmp_path, dest)
+
+
+class EnvCache:
+    """
+    Packaged environments stored by fingerprint, evicting the least recently used
+    entries beyond `max_entries` or `max_size_gb`
+    """
+
+    def __init__(
+        self,
+        cache_dir: Optional[str] = None,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        max_size_gb: float = DEFAULT_MAX_SIZE_GB,
+    ):
+        """
+        cache_dir: str : cache directory, defaults to <emrflow home>/env_cache
+        max_entries: int : maximum number of cached environments
+        max_size_gb: float : maximum total size (in GB) of the cached environments
+        """
+        self._cache_dir = cache_dir or os.path.join(get_emrflow_home(), "env_cache")
+        self._max_entries = max_entries
+        self._max_size = max_size_gb * GB
+
+    def path(self, fingerprint: str) -> str:
+        """Path of the cached archive of a fingerprint"""
+        return os.path.join(self._cache_dir, fingerprint, ENV_ARCHIVE_NAME)
+
+    def get(self, fingerprint: str, dest: str) -> bool:
+        """
+        Place the cached archive of a fingerprint at `dest`
+        fingerprint: str : environment fingerprint
+        dest: str : destination path
+
+        return: bool : cache hit
+        """
+        cached_path = self.path(fingerprint)
+        if not os.path.isfile(cached_path):
+            return False
+        os.makedirs(os.path.dirname(os.path.abspath(dest)), exist_ok=True)
+        link_or_copy(cached_path, dest)
+        # the directory mtime records the last use
+        os.utime(os.path.dirname(cached_path))
+        return True
+
+    def put(self, fingerprint: str, src: str):
+        """
+        Store a freshly built archive, then evict old entries
+        fingerprint: str : environment fingerprint
+        src: str : built archive
+        """
+        cached_path = self.path(fingerprint)
+        os.makedirs(os.path.dirname(cached_path), exist_ok=True)
+        link_or_copy(src, cached_path)
+        os.utime(os.path.dirname(cached_path))
+        self.evict()
+
+    def entries(self) -> List[Dict]:
+        """
+        Cached environments, most recently used first
+
+        return: List[Dict] : fingerprint, size and last use of each entry
+        """
+        if not os.path.isdir(self._cache_dir):
+            return []
+        entries = []
+        for fingerprint in os.listdir(self._cache_dir):
+            cached_path = self.path(fingerprint)
+            if os.path.isfile(cached_path):
+                entries.append(
+                    {
+                        "fingerprint": fingerprint,
+                        "size": os.path.getsize(cached_path),
+                        "last_used": os.stat(os.path.dirname(cached_path)).st_mtime,
+                    }
+                )
+        return sorted(entries, key=lambda entry: entry["last_used"], reverse=True)
+
+    def evict(self) -> List[str]:
+        """
+        Remove the least recently used entries beyond the limits
+
+        return: List[str] : evicted fingerprints
+        """
+        kept = 0
+        kept_size = 0
+        evicted = []
+        for entry in self.entries():
+            # the most recent entry is always kept
+            if kept == 0 or (
+                kept < self._max_entries and kept_size + entry["size"] <= self._max_size
+            ):
+                kept += 1
+                kept_size += entry["size"]
+                continue
+            shutil.rmtree(os.path.join(self._cache_dir, entry["fingerprint"]))
+            evicted.append(entry["fingerprint"])
+        if evicted:
+            rich.print(f"Evicted cached environments: {evicted}")
+        return evicted
+
+
+class RemoteEnvCache:
+    """
+    Packaged environments shared across machines through an S3 prefix, stored as
+    <prefix>/<fingerprint>/pyspark_deps.tar.gz
+    """
+
+    def __init__(self, s3_uri: str, s3_client=None):
+        """
+        s3_uri: str : s3 prefix of the cache
+        s3_client: boto3.client : s3 client, the shared client by default
+        """
+        self._s3_uri = s3_uri.rstrip("/")
+        self._s3_client = s3_client
+
+    @property
+    def s3_client(self):
+        """S3 client, created on first use"""
+        if self._s3_client is None:
+            from emrflow.deployment.clients import get_client
+
+            self._s3_client = get_client("s3")
+        return self._s3_client
+
+    def uri(self, fingerprint: str) -> str:
+        """S3 uri of the archive of a fingerprint"""
+        return f"{self._s3_uri}/{fingerprint}/{ENV_ARCHIVE_NAME}"
+
+    def exists(self, fingerprint: str) -> bool:
+        """
+        Check if the archive of a fingerprint was published
+        fingerprint: str : environment fingerprint
+
+        return: bool : the archive is in S3
+        """
+        bucket, key = parse_bucket_uri(self.uri(fingerprint))
+        return s3_object_digest(self.s3_client, bucket, key) is not None
+
+    def publish(self, fingerprint: str, path: str):
+        """
+        Upload a freshly built archive, with its digest so uploads can be verified
+        fingerprint: str : environment fingerprint
+        path: str : built archive
+        """
+        bucket, key = parse_bucket_uri(self.uri(fingerprint))
+        rich.print(f"Publishing environment to {self.uri(fingerprint)}")
+        PrettyUploader(
+            self.s3_client,
+            bucket,
+            {path: key},
+            extra_args={path: {"Metadata": {DIGEST_METADATA_KEY: file_sha256(path)}}},
+        ).run()
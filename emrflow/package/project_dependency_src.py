@@ -1,44 +1,483 @@
 """Create packaged dependency src"""
 
-from typing import List
+import glob
+import hashlib
+import json
+import os
+import re
+import stat
+import threading
+import time
+import zipfile
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from typing import Dict, Iterator, List, Optional, Tuple
 
-from emrflow.utils import execute_bash_script
+import rich
 
+from emrflow.package.zip_members import (
+    read_raw_member,
+    write_raw_member,
+    write_streamed_member,
+)
+from emrflow.utils import MB, S3StreamWriter, file_sha256, write_s3_pointer
 
-def create_packaged_dependency_src(output_dir: str, include_paths=List) -> int:
+PROJECT_ARCHIVE_NAME = "project-dependency-src.zip"
+
+# gitignore-style rules, extended by the `.emrflowignore` file of the current directory
+DEFAULT_EXCLUDES = ["*.git/", "*.github/", "*.vscode/", "*__pycache__*"]
+IGNORE_FILE = ".emrflowignore"
+
+# timestamp of every member, so identical sources give byte-identical archives
+ZIP_EPOCH = (1980, 1, 1, 0, 0, 0)
+DEFAULT_COMPRESS_LEVEL = 6
+# larger files are streamed into the archive instead of compressed in memory
+STREAMED_FILE_SIZE = 64 * MB
+# members of the previous build, kept next to the archive
+MANIFEST_SUFFIX = ".manifest.json"
+# files modified this close to the previous build are hashed even if their mtime
+# did not change, mtime granularity may hide the modification
+RACY_WINDOW_NS = 2 * 10**9
+
+
+class PackagingCancelled(Exception):
+    """The archive was cancelled while being written"""
+
+
+class ExcludeRules:
+    """
+    Match paths against gitignore-style patterns: `*`, `?`, `[...]` and `**`
+    wildcards, `!` to re-include a path, a trailing `/` to match directories only
+    and a leading or inner `/` to anchor the pattern to the walked directory.
+    The last matching pattern wins.
     """
-    Create project package including .py/.json/yaml files
-    output_dir: str : output directory
-    paths: str : path to include in the package
 
-    return: return_code : int
+    def __init__(self, patterns: List[str]):
+        """
+        patterns: List[str] : gitignore-style patterns
+        """
+        self._rules = []
+        for pattern in patterns:
+            pattern = pattern.strip()
+            if not pattern or pattern.startswith("#"):
+                continue
+            negate = pattern.startswith("!")
+            pattern = pattern[1:] if negate else pattern
+            dir_only = pattern.endswith("/")
+            pattern = pattern.rstrip("/")
+            anchored = "/" in pattern
+            regex = self._translate(pattern.lstrip("/"))
+            regex = f"^{regex}$" if anchored else f"(?:^|/){regex}$"
+            self._rules.append((re.compile(regex), negate, dir_only))
+
+    @staticmethod
+    def _translate(pattern: str) -> str:
+        """Convert a gitignore pattern to a regular expression"""
+        regex = ""
+        i = 0
+        while i < len(pattern):
+            if pattern.startswith("**/", i):
+                regex += "(?:.*/)?"
+                i += 3
+            elif pattern.startswith("**", i):
+                regex += ".*"
+                i += 2
+            elif pattern[i] == "*":
+                regex += "[^/]*"
+                i += 1
+            elif pattern[i] == "?":
+                regex += "[^/]"
+                i += 1
+            elif pattern[i] == "[" and "]" in pattern[i + 1 :]:
+                end = pattern.index("]", i + 1)
+                chars = pattern[i + 1 : end].replace("\\", "\\\\")
+                if chars.startswith("!"):
+                    chars = "^" + chars[1:]
+                regex += f"[{chars}]"
+                i = end + 1
+            else:
+                regex += re.escape(pattern[i])
+                i += 1
+        return regex
+
+    def excluded(self, path: str, is_dir: bool) -> bool:
+        """
+        Check if a path is excluded
+        path: str : path relative to the walked directory, with `/` separators
+        is_dir: bool : the path is a directory
+
+        return: bool : excluded
+        """
+        excluded = False
+        for regex, negate, dir_only in self._rules:
+            if dir_only and not is_dir:
+                continue
+            if regex.search(path):
+                excluded = not negate
+        return excluded
+
+
+def load_exclude_rules(patterns: Optional[List[str]] = None) -> ExcludeRules:
     """
+    Default exclude rules, the given patterns and those of `.emrflowignore`
+    patterns: List[str] : additional gitignore-style patterns
 
-    packaged_src_command = f"""
+    return: ExcludeRules : exclude rules
+    """
+    patterns = DEFAULT_EXCLUDES + list(patterns or [])
+    if os.path.isfile(IGNORE_FILE):
+        with open(IGNORE_FILE, "r") as ignore_file:
+            patterns.extend(ignore_file.read().splitlines())
+    return ExcludeRules(patterns)
 
-    mkdir -p {output_dir};
 
-    rm -f {output_dir}/project-dependency-src.zip
+def archive_name(path: str) -> str:
+    """
+    Name of a file inside the archive, as `zip` would store it
+    path: str : local path
 
-    # Add directories and files to the zip
-    for path in {" ".join(include_paths)}; do
-        if [ -e "$path" ]; then
-            continue
-        else
-            echo "Path: '$path' does not exist. Please check the path and try again!"
-            exit 1
-        fi
-    done
+    return: str : archive member name
+    """
+    name = os.path.normpath(path).replace(os.sep, "/")
+    return name.lstrip("/")
 
-    zip -r  {output_dir}/project-dependency-src.zip {" ".join(include_paths)} \
-        -x "*.git/**"  \
-        -x "*.github/**"  \
-        -x "*.vscode/**" \
-        -x "*__pycache__*"
 
-    echo "{output_dir}/project-dependency-src.zip created successfully!!"
+def collect_files(
+    include_paths: List[str], rules: ExcludeRules, skip_dirs: List[str] = []
+) -> Dict[str, str]:
     """
-    returncode = execute_bash_script(packaged_src_command)
-    if returncode != 0:
-        raise Exception("Project dependency src creation failed!!")
-    return returncode
+    Walk the include paths, which may contain shell wildcards, skipping excluded files
+    include_paths: List[str] : files and directories to include
+    rules: ExcludeRules : exclude rules, applied relative to each include path
+    skip_dirs: List[str] : directories never walked, e.g. the output directory
+
+    return: Dict[str, str] : archive member name to local path, sorted by name
+    """
+    skip_dirs = {os.path.realpath(path) for path in skip_dirs}
+    files = {}
+    for include_path in include_paths:
+        matches = (
+            sorted(glob.glob(include_path))
+            if glob.has_magic(include_path)
+            else [include_path]
+        )
+        if not matches or not all(os.path.exists(path) for path in matches):
+            raise Exception(
+                f"Path: '{include_path}' does not exist. Please check the path and try again!"
+            )
+
+        for root_path in matches:
+            is_dir = os.path.isdir(root_path)
+            if rules.excluded(os.path.basename(os.path.normpath(root_path)), is_dir):
+                continue
+            if not is_dir:
+                files[archive_name(root_path)] = root_path
+                continue
+
+            for dirpath, dirnames, filenames in os.walk(root_path):
+                relative_dir = os.path.relpath(dirpath, root_path)
+                relative_dir = "" if relative_dir == "." else relative_dir + "/"
+                dirnames[:] = [
+                    dirname
+                    for dirname in dirnames
+                    if not rules.excluded(relative_dir + dirname, is_dir=True)
+                    and os.path.realpath(os.path.join(dirpath, dirname))
+                    not in skip_dirs
+                ]
+                for filename in filenames:
+                    if rules.excluded(relative_dir + filename, is_dir=False):
+                        continue
+                    path = os.path.join(dirpath, filename)
+                    files[archive_name(path)] = path
+
+    return dict(sorted(files.items()))
+
+
+def member_mode(path: str) -> int:
+    """
+    Permissions stored for a member, only the executable bit of the file is kept
+    path: str : local path
+
+    return: int : permissions
+    """
+    return 0o755 if os.stat(path).st_mode & stat.S_IXUSR else 0o644
+
+
+def new_zip_info(name: str, mode: int) -> zipfile.ZipInfo:
+    """
+    Member metadata independent of the build host and time
+    name: str : archive member name
+    mode: int : permissions of the member
+
+    return: zipfile.ZipInfo : member metadata
+    """
+    zinfo = zipfile.ZipInfo(name, date_time=ZIP_EPOCH)
+    zinfo.create_system = 3
+    zinfo.external_attr = (stat.S_IFREG | mode) << 16
+    zinfo.compress_type = zipfile.ZIP_DEFLATED
+    return zinfo
+
+
+def compress_file(path: str, level: int) -> Tuple[int, int, bytes, str]:
+    """
+    Deflate a file the way zip members are stored, zlib releases the GIL so files
+    are compressed in parallel by threads
+    path: str : local path
+    level: int : compression level
+
+    return: Tuple[int, int, bytes, str] : crc32, uncompressed size, compressed
+        bytes and sha256 of the file
+    """
+    with open(path, "rb") as file:
+        data = file.read()
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return (
+        zlib.crc32(data),
+        len(data),
+        compressor.compress(data) + compressor.flush(),
+        hashlib.sha256(data).hexdigest(),
+    )
+
+
+def compress_in_order(
+    executor: ThreadPoolExecutor, paths: List[str], level: int, window: int
+) -> Iterator[Tuple[int, int, bytes, str]]:
+    """
+    Compress files in parallel, in order, with at most `window` files compressed
+    ahead of the one being written so memory use stays bounded
+    executor: ThreadPoolExecutor : threads compressing the files
+    paths: List[str] : local paths
+    level: int : compression level
+    window: int : files compressed or being compressed ahead
+
+    return: Iterator[Tuple[int, int, bytes, str]] : results of `compress_file`
+    """
+    pending = deque()
+    for path in paths:
+        if len(pending) >= window:
+            yield pending.popleft().result()
+        pending.append(executor.submit(compress_file, path, level))
+    while pending:
+        yield pending.popleft().result()
+
+
+def load_manifest(archive_path: str, compress_level: int) -> Dict:
+    """
+    Manifest of the previous build, if it still describes the archive on disk
+    archive_path: str : archive path
+    compress_level: int : compression level of the new build
+
+    return: Dict : manifest, empty when the archive must be fully rebuilt
+    """
+    try:
+        with open(archive_path + MANIFEST_SUFFIX, "r") as manifest_file:
+            manifest = json.load(manifest_file)
+        archive_stat = os.stat(archive_path)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get("compress_level") != compress_level or manifest.get("archive") != [
+        archive_stat.st_size,
+        archive_stat.st_mtime_ns,
+    ]:
+        return {}
+    return manifest
+
+
+def save_manifest(
+    archive_path: str, compress_level: int, built_at_ns: int, files: Dict[str, Dict]
+):
+    """Record the members of the archive just built"""
+    archive_stat = os.stat(archive_path)
+    manifest = {
+        "compress_level": compress_level,
+        "built_at_ns": built_at_ns,
+        "archive": [archive_stat.st_size, archive_stat.st_mtime_ns],
+        "files": files,
+    }
+    tmp_path = f"{archive_path}{MANIFEST_SUFFIX}.tmp"
+    with open(tmp_path, "w") as manifest_file:
+        json.dump(manifest, manifest_file)
+    os.replace(tmp_path, archive_path + MANIFEST_SUFFIX)
+
+
+def find_unchanged(
+    files: Dict[str, str], manifest: Dict, built_at_ns: int
+) -> Dict[str, Dict]:
+    """
+    Compare the files with the manifest of the previous build. Files with the same
+    size and mtime are trusted, others with the same size are compared by hash.
+    files: Dict[str, str] : archive member name to local path
+    manifest: Dict : manifest of the previous build
+    built_at_ns: int : start time of the new build
+
+    return: Dict[str, Dict] : manifest entry of every file, with its sha256 when
+        the file did not change since the previous build
+    """
+    previous = manifest.get("files", {})
+    # a file modified right after the previous build may keep the same mtime
+    trusted_before = manifest.get("built_at_ns", 0) - RACY_WINDOW_NS
+    entries = {}
+    for name, path in files.items():
+        file_stat = os.stat(path)
+        entry = {
+            "size": file_stat.st_size,
+            "mtime_ns": file_stat.st_mtime_ns,
+            "mode": member_mode(path),
+        }
+        old = previous.get(name)
+        if old and old["size"] == entry["size"] and old["mode"] == entry["mode"]:
+            if (
+                old["mtime_ns"] == entry["mtime_ns"]
+                and entry["mtime_ns"] < trusted_before
+            ) or file_sha256(path) == old["sha256"]:
+                entry["sha256"] = old["sha256"]
+        entries[name] = entry
+    return entries
+
+
+def create_packaged_dependency_src(
+    output_dir: str,
+    include_paths=List,
+    exclude_patterns: Optional[List[str]] = None,
+    compress_level: int = DEFAULT_COMPRESS_LEVEL,
+    max_workers: Optional[int] = None,
+    incremental: bool = True,
+    s3_uri: str = "",
+    s3_client=None,
+    keep_local: bool = True,
+    cancel_event: Optional[threading.Event] = None,
+) -> int:
+    """
+    Create project package including .py/.json/yaml files. Members are sorted and
+    have fixed timestamps, so the same sources always give the same archive.
+    With `incremental`, a manifest of the members is kept next to the archive and
+    only the changed files are compressed again, the others are copied as is.
+    With `s3_uri`, the archive is streamed to S3 while it is written and a
+    `.s3uri` sidecar records its location for `run`.
+    output_dir: str : output directory
+    include_paths: List[str] : paths to include in the package, may contain wildcards
+    exclude_patterns: List[str] : gitignore-style patterns excluded in addition
+        to the defaults and `.emrflowignore`
+    compress_level: int : deflate compression level
+    max_workers: int : threads compressing files, defaults to the number of cores
+    incremental: bool : reuse the unchanged members of the previous archive
+    s3_uri: str : stream the archive to this s3 uri
+    s3_client: boto3.client : s3 client of the stream
+    keep_local: bool : also write the streamed archive to the output directory
+    cancel_event: threading.Event : stop writing the archive once set, a streamed
+        upload is aborted
+
+    return: return_code : int
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    archive_path = os.path.join(output_dir, PROJECT_ARCHIVE_NAME)
+    built_at_ns = time.time_ns()
+    files = collect_files(
+        include_paths, load_exclude_rules(exclude_patterns), skip_dirs=[output_dir]
+    )
+
+    manifest = load_manifest(archive_path, compress_level) if incremental else {}
+    entries = find_unchanged(files, manifest, built_at_ns)
+    old_members = {}
+    if manifest:
+        with zipfile.ZipFile(archive_path) as old_archive:
+            old_members = {zinfo.filename: zinfo for zinfo in old_archive.infolist()}
+    unchanged = {
+        name
+        for name, entry in entries.items()
+        if "sha256" in entry and name in old_members
+    }
+
+    if manifest and unchanged == set(files) == set(manifest["files"]):
+        save_manifest(archive_path, compress_level, built_at_ns, entries)
+        rich.print(f"{archive_path} is up to date with {len(files)} files!!")
+        return 0
+
+    # a previous streamed archive no longer matches the sources
+    write_s3_pointer(archive_path, None)
+    streamed = {
+        name
+        for name, entry in entries.items()
+        if name not in unchanged and entry["size"] >= STREAMED_FILE_SIZE
+    }
+    tmp_path = f"{archive_path}.tmp"
+    try:
+        workers = max_workers or os.cpu_count() or 1
+        with ThreadPoolExecutor(max_workers=workers) as executor, ExitStack() as stack:
+            output = tmp_path
+            if s3_uri:
+                output = stack.enter_context(
+                    S3StreamWriter(
+                        s3_client, s3_uri, local_path=tmp_path if keep_local else None
+                    )
+                )
+            # members are written in order while the next files are being compressed
+            compressed = compress_in_order(
+                executor,
+                [
+                    path
+                    for name, path in files.items()
+                    if name not in unchanged and name not in streamed
+                ],
+                compress_level,
+                window=2 * workers,
+            )
+            old_file = (
+                stack.enter_context(open(archive_path, "rb")) if unchanged else None
+            )
+            with zipfile.ZipFile(output, "w") as archive:
+                for name, path in files.items():
+                    if cancel_event is not None and cancel_event.is_set():
+                        # leaving through an exception aborts the streamed upload
+                        raise PackagingCancelled()
+                    zinfo = new_zip_info(name, entries[name]["mode"])
+                    if name in unchanged:
+                        old_zinfo = old_members[name]
+                        data = read_raw_member(old_file, old_zinfo)
+                        write_raw_member(
+                            archive,
+                            zinfo,
+                            old_zinfo.CRC,
+                            old_zinfo.file_size,
+                            data,
+                            zip64=old_zinfo.file_size >= STREAMED_FILE_SIZE,
+                        )
+                    elif name in streamed:
+                        write_streamed_member(archive, zinfo, path, compress_level)
+                        entries[name]["sha256"] = file_sha256(path)
+                    else:
+                        crc, file_size, data, digest = next(compressed)
+                        # same header as a streamed member, so copied members
+                        # keep identical bytes
+                        write_raw_member(
+                            archive,
+                            zinfo,
+                            crc,
+                            file_size,
+                            data,
+                            zip64=file_size >= STREAMED_FILE_SIZE,
+                        )
+                        entries[name]["sha256"] = digest
+    except PackagingCancelled:
+        if os.path.lexists(tmp_path):
+            os.remove(tmp_path)
+        rich.print(f"{archive_path} cancelled!!")
+        return 1
+    if s3_uri:
+        write_s3_pointer(archive_path, s3_uri)
+    if keep_local or not s3_uri:
+        os.replace(tmp_path, archive_path)
+        save_manifest(archive_path, compress_level, built_at_ns, entries)
+    else:
+        # only the streamed archive is left, the next build starts from scratch
+        for path in [archive_path, archive_path + MANIFEST_SUFFIX]:
+            if os.path.lexists(path):
+                os.remove(path)
+
+    rich.print(
+        f"{archive_path if keep_local or not s3_uri else s3_uri} created successfully with {len(files)} files, "
+        f"{len(files) - len(unchanged)} compressed!!"
+    )
+    return 0
@@ -0,0 +1,88 @@
+"""
+Write zip members zipfile has no public API for: members already compressed,
+copied as is from a previous archive, and streamed members with their own
+compression level. Every access to the private state of zipfile is kept in this
+module, it only depends on the standard library so that its tests run on the
+oldest and newest supported python.
+"""
+
+import os
+import shutil
+import struct
+import zipfile
+from typing import BinaryIO
+
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def read_raw_member(archive_file: BinaryIO, zinfo: zipfile.ZipInfo) -> bytes:
+    """
+    Read the compressed bytes of a member without decompressing them
+    archive_file: BinaryIO : archive opened in binary mode
+    zinfo: zipfile.ZipInfo : member metadata from the central directory
+
+    return: bytes : compressed data
+    """
+    archive_file.seek(zinfo.header_offset)
+    header = archive_file.read(zipfile.sizeFileHeader)
+    name_length, extra_length = struct.unpack("<HH", header[26:30])
+    archive_file.seek(name_length + extra_length, os.SEEK_CUR)
+    return archive_file.read(zinfo.compress_size)
+
+
+def write_raw_member(
+    archive: zipfile.ZipFile,
+    zinfo: zipfile.ZipInfo,
+    crc: int,
+    file_size: int,
+    data: bytes,
+    zip64: bool = False,
+):
+    """
+    Append an already compressed member. The member is registered the same way
+    `ZipFile.writestr` does so that `close` writes it in the central directory.
+    archive: zipfile.ZipFile : archive opened for writing
+    zinfo: zipfile.ZipInfo : member metadata
+    crc: int : crc32 of the uncompressed data
+    file_size: int : uncompressed size
+    data: bytes : compressed data
+    zip64: bool : write a zip64 header, as streamed members have
+    """
+    zinfo.CRC = crc
+    zinfo.file_size = file_size
+    zinfo.compress_size = len(data)
+    zinfo.header_offset = archive.fp.tell()
+    archive.fp.write(zinfo.FileHeader(zip64=True if zip64 else None))
+    archive.fp.write(data)
+    archive.start_dir = archive.fp.tell()
+    archive.filelist.append(zinfo)
+    archive.NameToInfo[zinfo.filename] = zinfo
+    archive._didModify = True
+
+
+def set_compress_level(zinfo: zipfile.ZipInfo, level: int):
+    """
+    Compression level of a member written with `ZipFile.open`, public since
+    python 3.13
+    zinfo: zipfile.ZipInfo : member metadata
+    level: int : compression level
+    """
+    if hasattr(zipfile.ZipInfo, "compress_level"):
+        zinfo.compress_level = level
+    else:
+        zinfo._compresslevel = level
+
+
+def write_streamed_member(
+    archive: zipfile.ZipFile, zinfo: zipfile.ZipInfo, path: str, level: int
+):
+    """
+    Compress a large file into the archive without loading it in memory
+    archive: zipfile.ZipFile : archive opened for writing
+    zinfo: zipfile.ZipInfo : member metadata
+    path: str : local path
+    level: int : compression level
+    """
+    set_compress_level(zinfo, level)
+    with open(path, "rb") as src, archive.open(zinfo, "w", force_zip64=True) as dest:
+        shutil.copyfileobj(src, dest, COPY_CHUNK_SIZE)
@@ -1,18 +1,65 @@
 """Utility functions for EMRFLOW"""
 
-import gzip
+import codecs
+import hashlib
+import json
 import os
+import random
 import re
+import signal
 import subprocess
 import sys
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
 from pathlib import Path
 from shutil import copyfile, copytree, ignore_patterns
-from typing import Dict, List
+from typing import IO, TYPE_CHECKING, Callable, Dict, List, Optional
 from urllib.parse import urlparse
 
-import boto3
 import rich
-from rich.progress import Progress, TotalFileSizeColumn
+
+# boto3 and rich.progress are slow to import, they are only loaded by the commands
+# talking to AWS so that the other commands start quickly
+if TYPE_CHECKING:
+    import boto3
+
+MB = 1024 * 1024
+DEFAULT_UPLOAD_CONCURRENCY = 4
+DEFAULT_MULTIPART_CHUNK_SIZE = 8
+# smallest part (in MB) accepted by S3, except for the last one
+MIN_MULTIPART_CHUNK_SIZE = 5
+DIGEST_METADATA_KEY = "emrflow-sha256"
+CONTENT_ADDRESSED_DIR = "cas"
+CONTENT_ADDRESSED_PATTERN = re.compile(rf"/{CONTENT_ADDRESSED_DIR}/([0-9a-f]{{64}})/")
+# sidecar of an artifact already in S3, e.g. dist/pyspark_deps.tar.gz.s3uri
+S3_POINTER_SUFFIX = ".s3uri"
+
+
+def get_emrflow_home() -> str:
+    """
+    Directory where emrflow keeps its local caches, `EMRFLOW_HOME` overrides it
+
+    return: str : emrflow home directory
+    """
+    return os.environ.get("EMRFLOW_HOME", os.path.join(str(Path.home()), ".emrflow"))
+
+
+def parse_duration(duration: str) -> float:
+    """
+    Parse a duration such as 90s, 30m, 12h, 7d or 2w
+    duration: str : number followed by a unit
+
+    return: float : duration in seconds
+    """
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([smhdw])\s*", duration)
+    if not match:
+        raise ValueError(
+            f"Invalid duration {duration!r}, expected a number followed by one of {list(units)}"
+        )
+    return float(match.group(1)) * units[match.group(2)]
 
 
 def parse_bucket_uri(uri: str) -> List[str]:
@@ -63,39 +110,349 @@ def convert_to_dict(list_params: List) -> Dict:
     return dict_items
 
 
-def print_s3_gz(client: boto3.session.Session.client, s3_uri: str, last_position: int):
+class S3GzipLogTailer:
+    """
+    Tail a gzip log object on S3 by fetching only the newly appended compressed bytes.
+
+    The decompressor state and the compressed byte offset are kept between polls, so
+    the cost of each poll depends on how much the log grew rather than its full size.
+    The last few consumed compressed bytes are re-requested on every poll; if they no
+    longer match, the object was rewritten or rotated and it is re-read from the start
+    without printing again what was already shown.
+    """
+
+    _OVERLAP_BYTES = 64
+    _GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+    def __init__(
+        self,
+        client: "boto3.session.Session.client",
+        s3_uri: str,
+        skip_bytes: int = 0,
+    ):
+        """
+        client: boto3.client : s3 client
+        s3_uri: str : s3 uri of the gzip log
+        skip_bytes: int : decompressed bytes already shown, which are not returned again
+        """
+        self._client = client
+        self._bucket, self._key = parse_bucket_uri(s3_uri)
+        self._skip_bytes = skip_bytes
+        self._reset()
+
+    def _reset(self):
+        """Forget the decompression state and start again from byte 0"""
+        self._decompressor = zlib.decompressobj(self._GZIP_WBITS)
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._offset = 0
+        self._tail = b""
+        self._position = 0
+
+    @property
+    def position(self) -> int:
+        """Number of decompressed bytes read so far"""
+        return self._position
+
+    def _fetch(self, start: int) -> Optional[bytes]:
+        """
+        Fetch the object from the compressed byte `start`
+
+        return: Optional[bytes] : bytes from `start`, None if the object is now shorter
+        """
+        from botocore.exceptions import ClientError
+
+        kwargs = {"Bucket": self._bucket, "Key": self._key}
+        if start > 0:
+            kwargs["Range"] = f"bytes={start}-"
+        try:
+            response = self._client.get_object(**kwargs)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") == "InvalidRange":
+                return None
+            raise
+        return response["Body"].read()
+
+    def _decompress(self, chunk: bytes) -> bytes:
+        """Feed compressed bytes, handling logs made of concatenated gzip members"""
+        output = []
+        data = chunk
+        while data:
+            output.append(self._decompressor.decompress(data))
+            if not self._decompressor.eof:
+                break
+            data = self._decompressor.unused_data
+            self._decompressor = zlib.decompressobj(self._GZIP_WBITS)
+
+        self._offset += len(chunk)
+        self._tail = (self._tail + chunk)[-self._OVERLAP_BYTES :]
+        return b"".join(output)
+
+    def read(self) -> str:
+        """
+        Read the logs appended since the previous call
+
+        return: str : new logs
+        """
+        overlap = len(self._tail)
+        chunk = self._fetch(self._offset - overlap)
+        if chunk is None or chunk[:overlap] != self._tail:
+            # object was rewritten or rotated, replay it without repeating output
+            self._skip_bytes = max(self._skip_bytes, self._position)
+            self._reset()
+            chunk = self._fetch(0) or b""
+        else:
+            chunk = chunk[overlap:]
+
+        new_data = self._decompress(chunk)
+        start = max(self._skip_bytes - self._position, 0)
+        self._position += len(new_data)
+        return self._decoder.decode(new_data[start:])
+
+
+def file_sha256(path: str) -> str:
+    """
+    Compute the sha256 digest of a local file
+    path: str : local file path
+
+    return: str : hex digest
+    """
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(MB), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+class FileDigestCache:
+    """
+    Cache of local file digests keyed by path, mtime and size, so large
+    artifacts are only hashed again when they change
+    """
+
+    def __init__(self, cache_path: Optional[str] = None):
+        """
+        cache_path: str : json file holding the cached digests
+        """
+        self._cache_path = cache_path or os.path.join(
+            get_emrflow_home(), "file_digests.json"
+        )
+        self._lock = threading.Lock()
+        self._modified = False
+        try:
+            with open(self._cache_path, "r") as cache_file:
+                self._entries = json.load(cache_file)
+        except (OSError, ValueError):
+            self._entries = {}
+
+    def digest(self, path: str) -> str:
+        """
+        Get the sha256 digest of a local file
+        path: str : local file path
+
+        return: str : hex digest
+        """
+        stat = os.stat(path)
+        key = os.path.abspath(path)
+        entry = self._entries.get(key)
+        if (
+            entry
+            and entry["mtime_ns"] == stat.st_mtime_ns
+            and entry["size"] == stat.st_size
+        ):
+            return entry["sha256"]
+
+        digest = file_sha256(path)
+        with self._lock:
+            self._entries[key] = {
+                "mtime_ns": stat.st_mtime_ns,
+                "size": stat.st_size,
+                "sha256": digest,
+            }
+            self._modified = True
+        return digest
+
+    def save(self):
+        """
+        Persist the cache if digests were computed or entries pruned. The cache is
+        shared by every project, entries of files that no longer exist are dropped
+        so it does not grow forever.
+        """
+        with self._lock:
+            missing = [path for path in self._entries if not os.path.isfile(path)]
+            for path in missing:
+                del self._entries[path]
+        if not self._modified and not missing:
+            return
+        os.makedirs(os.path.dirname(self._cache_path), exist_ok=True)
+        tmp_path = f"{self._cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as cache_file:
+            json.dump(self._entries, cache_file)
+        os.replace(tmp_path, self._cache_path)
+        self._modified = False
+
+
+def content_addressed_path(digest: str, path: str) -> str:
     """
-    Only print the new logs appended to the gzip file from S3.
+    Relative location of an artifact in the content-addressed store. The file name
+    is kept so spark can still infer the type of the archive or file.
+    digest: str : sha256 digest of the artifact
+    path: str : local path of the artifact
+
+    return: str : path relative to the s3 code uri
     """
+    return os.path.join(CONTENT_ADDRESSED_DIR, digest, os.path.basename(path))
 
-    bucket, key = parse_bucket_uri(s3_uri)
+
+def s3_object_digest(
+    s3_client: "boto3.session.Session.client", bucket: str, key: str
+) -> Optional[str]:
+    """
+    Get the sha256 digest recorded by emrflow on an S3 object
+    bucket: str : s3 bucket
+    key: str : s3 key
+
+    return: Optional[str] : hex digest, None if the object or digest is missing
+    """
+    from botocore.exceptions import ClientError
 
     try:
-        gz_file = client.get_object(Bucket=bucket, Key=key)
-        with gzip.open(gz_file["Body"]) as data:
-            # Move to the last known position in the file
-            data.seek(last_position)
+        response = s3_client.head_object(Bucket=bucket, Key=key)
+    except ClientError:
+        return None
+    return response.get("Metadata", {}).get(DIGEST_METADATA_KEY)
 
-            # Read the new info appended to the file
-            new_info = data.read().decode()
-            if new_info != "":
-                rich.print(new_info)
 
-            # Update the last known position
-            last_position = data.tell()
+THROTTLING_ERROR_CODES = [
+    "Throttling",
+    "ThrottlingException",
+    "TooManyRequestsException",
+    "RequestLimitExceeded",
+    "SlowDown",
+]
 
-            return last_position
-    except Exception as e:
-        return 0
+
+def is_throttling_error(error: Exception) -> bool:
+    """
+    Check if an exception is a throttling error returned by an AWS API
+    error: Exception : raised exception
+
+    return: bool : is a throttling error
+    """
+    from botocore.exceptions import ClientError
+
+    return (
+        isinstance(error, ClientError)
+        and error.response.get("Error", {}).get("Code") in THROTTLING_ERROR_CODES
+    )
+
+
+class AdaptivePoller:
+    """
+    Compute the delay before the next status check. Polls quickly after submission
+    and state transitions, then backs off exponentially with jitter while the state
+    does not change, up to `max_interval`. Throttling errors back off further.
+    """
+
+    def __init__(
+        self,
+        max_interval: float,
+        min_interval: float = 2,
+        backoff: float = 2,
+        jitter: float = 0.5,
+    ):
+        """
+        max_interval: float : longest delay (in sec) while the state does not change
+        min_interval: float : delay (in sec) right after a state transition
+        backoff: float : multiplier applied to the delay on every unchanged poll
+        jitter: float : fraction of the delay that is randomized
+        """
+        self._max_interval = max(max_interval, 0)
+        self._min_interval = min(min_interval, self._max_interval)
+        self._backoff = backoff
+        self._jitter = jitter
+        self._delay = self._min_interval
+
+    def _with_jitter(self, delay: float) -> float:
+        """Spread out the polls of trackers started at the same time"""
+        return random.uniform(delay * (1 - self._jitter), delay)
+
+    def next_delay(self, state_changed: bool) -> float:
+        """
+        Delay before the next poll
+        state_changed: bool : the state changed since the previous poll
+
+        return: float : delay in seconds
+        """
+        if state_changed:
+            self._delay = self._min_interval
+        else:
+            self._delay = min(self._delay * self._backoff, self._max_interval)
+        return self._with_jitter(self._delay)
+
+    def throttled(self) -> float:
+        """
+        Delay before retrying a throttled call, allowed to exceed `max_interval`
+
+        return: float : delay in seconds
+        """
+        self._delay = min(
+            max(self._delay, self._min_interval, 1) * self._backoff,
+            max(self._max_interval, 1) * 4,
+        )
+        return self._with_jitter(self._delay)
+
+
+def read_s3_pointer(path: str) -> Optional[str]:
+    """
+    S3 location of an artifact published elsewhere, recorded in its `.s3uri` sidecar
+    path: str : local artifact path
+
+    return: Optional[str] : s3 uri, None without sidecar
+    """
+    pointer_path = path + S3_POINTER_SUFFIX
+    if not os.path.isfile(pointer_path):
+        return None
+    with open(pointer_path, "r") as pointer_file:
+        return pointer_file.read().strip() or None
+
+
+def write_s3_pointer(path: str, s3_uri: Optional[str]):
+    """
+    Record or, when `s3_uri` is None, forget the S3 location of an artifact
+    path: str : local artifact path
+    s3_uri: str : s3 uri of the artifact
+    """
+    pointer_path = path + S3_POINTER_SUFFIX
+    if s3_uri is None:
+        if os.path.lexists(pointer_path):
+            os.remove(pointer_path)
+        return
+    with open(pointer_path, "w") as pointer_file:
+        pointer_file.write(s3_uri + "\n")
 
 
 def upload_package(
-    s3_client, s3_code_uri: str, local_uri: List[str], excludes_uri: List[str] = []
+    s3_client,
+    s3_code_uri: str,
+    local_uri: List[str],
+    excludes_uri: List[str] = [],
+    concurrency: int = DEFAULT_UPLOAD_CONCURRENCY,
+    multipart_chunk_size: int = DEFAULT_MULTIPART_CHUNK_SIZE,
+    skip_unchanged: bool = True,
+    content_addressed: bool = False,
+    stats: Optional[Dict] = None,
 ) -> Dict:
     """
     Upload local artifacts to S3 bucket
     s3_code_uri: str : s3 code uri
     local_uri: str : local directory
+    excludes_uri: List[str] : local paths already available in S3
+    concurrency: int : number of parallel uploads
+    multipart_chunk_size: int : size (in MB) of each part of a multipart upload
+    skip_unchanged: bool : skip artifacts whose content is already in S3
+    content_addressed: bool : store artifacts under `cas/<sha256>/` so identical
+        artifacts are shared across job runs
+    stats: Dict : filled with the uploaded artifacts and their total size in bytes
 
     return: str : s3_code_uri
     """
@@ -104,34 +461,316 @@ def upload_package(
     abs_src_target = {}
 
     for uri in local_uri:
-        if uri not in excludes_uri:
+        pointer = read_s3_pointer(uri)
+        if pointer:
+            # already published, e.g. by the remote environment cache
+            abs_src_target[uri] = pointer
+        elif uri not in excludes_uri:
             src_target[uri] = os.path.join(prefix, uri)
             abs_src_target[uri] = os.path.join(s3_code_uri, uri)
         else:
             abs_src_target[uri] = os.path.join(s3_code_uri, uri)
 
-    rich.print(f"Uploading dependencies: {src_target}")
-
-    uploader = PrettyUploader(
-        s3_client,
-        bucket,
-        src_target,
-    )
-    uploader.run()
+    extra_args = {}
+    if (skip_unchanged or content_addressed) and src_target:
+        digest_cache = FileDigestCache()
+        with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as executor:
+            digests = dict(
+                zip(src_target, executor.map(digest_cache.digest, list(src_target)))
+            )
+        digest_cache.save()
+
+        for src, digest in digests.items():
+            extra_args[src] = {"Metadata": {DIGEST_METADATA_KEY: digest}}
+            if content_addressed:
+                src_target[src] = os.path.join(
+                    prefix, content_addressed_path(digest, src)
+                )
+                abs_src_target[src] = os.path.join(
+                    s3_code_uri, content_addressed_path(digest, src)
+                )
+
+        with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as executor:
+            remote_digests = executor.map(
+                lambda src: s3_object_digest(s3_client, bucket, src_target[src]),
+                list(src_target),
+            )
+            unchanged = [
+                src
+                for src, remote_digest in zip(list(src_target), remote_digests)
+                if remote_digest == digests[src]
+            ]
+
+        if unchanged:
+            rich.print(f"Skipping unchanged dependencies: {unchanged}")
+            for src in unchanged:
+                del src_target[src]
+
+    if stats is not None:
+        stats["uploaded"] = list(src_target)
+        stats["uploaded_bytes"] = sum(os.path.getsize(src) for src in src_target)
+
+    if src_target:
+        rich.print(f"Uploading dependencies: {src_target}")
+        uploader = PrettyUploader(
+            s3_client,
+            bucket,
+            src_target,
+            concurrency=concurrency,
+            multipart_chunk_size=multipart_chunk_size,
+            extra_args=extra_args,
+        )
+        uploader.run()
 
     return abs_src_target
 
 
-def execute_bash_script(command):
+def execute_bash_script(
+    command,
+    cancel_event: Optional[threading.Event] = None,
+    stdout_handler: Optional[Callable[[IO[bytes]], None]] = None,
+):
     """
     Run the Bash script and capture the output
+    command: str : bash script
+    cancel_event: threading.Event : terminate the script and its children once set
+    stdout_handler: Callable : consume the standard output of the script while it
+        runs, e.g. to stream it to S3. The script is terminated if it raises.
+
+    return: int : 0 on success, 1 otherwise
     """
+    if cancel_event is None and stdout_handler is None:
+        try:
+            proc = subprocess.run(["bash", "-c", command], check=True)
+            return proc.returncode
+        except subprocess.CalledProcessError as e:
+            rich.print("subprocess.CalledProcessError", str(e))
+            return 1
+
+    cancel_event = cancel_event or threading.Event()
+    # own process group, so the whole script can be terminated
+    proc = subprocess.Popen(
+        ["bash", "-c", command],
+        start_new_session=True,
+        stdout=subprocess.PIPE if stdout_handler else None,
+    )
+    executor = ThreadPoolExecutor(max_workers=1)
+    handled = executor.submit(stdout_handler, proc.stdout) if stdout_handler else None
     try:
-        proc = subprocess.run(["bash", "-c", command], check=True)
-        return proc.returncode
-    except subprocess.CalledProcessError as e:
-        rich.print("subprocess.CalledProcessError", str(e))
+        while True:
+            try:
+                returncode = proc.wait(timeout=0.5)
+                break
+            except subprocess.TimeoutExpired:
+                if cancel_event.is_set():
+                    rich.print("Cancelling the script")
+                    _terminate_process_group(proc)
+                    return 1
+                if handled is not None and handled.done():
+                    # raises the error of the handler, e.g. a failed upload
+                    handled.result()
+        if handled is not None:
+            handled.result()
+    except BaseException:
+        _terminate_process_group(proc)
+        raise
+    finally:
+        if handled is not None:
+            # the handler reaches the end of the output once the script stopped
+            wait([handled], timeout=10)
+            proc.stdout.close()
+        executor.shutdown(wait=False)
+
+    if returncode != 0:
+        rich.print(f"Script exited with return code {returncode}")
         return 1
+    return 0
+
+
+def _terminate_process_group(proc: subprocess.Popen, timeout: float = 10):
+    """Terminate a process group, killing it if it does not stop in time"""
+    try:
+        os.killpg(proc.pid, signal.SIGTERM)
+        proc.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        os.killpg(proc.pid, signal.SIGKILL)
+        proc.wait()
+    except ProcessLookupError:
+        pass
+
+
+class S3StreamWriter:
+    """
+    Write a stream straight to S3, without an intermediate file. Parts of a
+    multipart upload are sent in the background while the stream is produced, and
+    the sha256 digest is computed on the fly. A local copy can be written at the
+    same time. The writer has no `seek`, so `zipfile` writes to it as a stream.
+    """
+
+    def __init__(
+        self,
+        s3_client: "boto3.session.Session.client",
+        s3_uri: str,
+        local_path: Optional[str] = None,
+        concurrency: int = DEFAULT_UPLOAD_CONCURRENCY,
+        multipart_chunk_size: int = DEFAULT_MULTIPART_CHUNK_SIZE,
+    ):
+        """
+        s3_client: boto3.client : s3 client
+        s3_uri: str : destination of the stream
+        local_path: str : also write the stream to this file
+        concurrency: int : parts uploaded in parallel
+        multipart_chunk_size: int : size (in MB) of each part of the multipart upload
+        """
+        self._s3_client = s3_client
+        self.s3_uri = s3_uri
+        self._bucket, self._key = parse_bucket_uri(s3_uri)
+        self._part_size = max(multipart_chunk_size, MIN_MULTIPART_CHUNK_SIZE) * MB
+        self._local_path = local_path
+        self._local_file = open(local_path, "wb") if local_path else None
+        self._sha256 = hashlib.sha256()
+        self._buffer = bytearray()
+        self._size = 0
+        self._upload_id = None
+        self._parts = []
+        concurrency = max(concurrency, 1)
+        self._executor = ThreadPoolExecutor(max_workers=concurrency)
+        # bounds the memory held by parts waiting to be sent
+        self._slots = threading.Semaphore(2 * concurrency)
+        self._start = time.monotonic()
+        self.digest = None
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def writable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        """Number of bytes written so far"""
+        return self._size
+
+    def flush(self):
+        if self._local_file is not None:
+            self._local_file.flush()
+
+    def write(self, data: bytes) -> int:
+        """
+        Append data to the stream, a part is sent every `multipart_chunk_size` MB
+        data: bytes : data
+
+        return: int : number of bytes written
+        """
+        if self.closed:
+            raise ValueError(f"Stream to {self.s3_uri} is closed")
+        self._sha256.update(data)
+        if self._local_file is not None:
+            self._local_file.write(data)
+        self._size += len(data)
+        self._buffer += data
+        while len(self._buffer) >= self._part_size:
+            self._send_part(bytes(self._buffer[: self._part_size]))
+            del self._buffer[: self._part_size]
+        return len(data)
+
+    def _send_part(self, body: bytes):
+        """Upload a part in the background, surfacing the failure of previous parts"""
+        for future in self._parts:
+            if future.done() and future.exception() is not None:
+                raise future.exception()
+        if self._upload_id is None:
+            self._upload_id = self._s3_client.create_multipart_upload(
+                Bucket=self._bucket, Key=self._key
+            )["UploadId"]
+        self._slots.acquire()
+        self._parts.append(
+            self._executor.submit(self._upload_part, len(self._parts) + 1, body)
+        )
+
+    def _upload_part(self, part_number: int, body: bytes) -> Dict:
+        try:
+            response = self._s3_client.upload_part(
+                Bucket=self._bucket,
+                Key=self._key,
+                UploadId=self._upload_id,
+                PartNumber=part_number,
+                Body=body,
+            )
+            return {"ETag": response["ETag"], "PartNumber": part_number}
+        finally:
+            self._slots.release()
+
+    def close(self):
+        """Send the remaining data and complete the upload"""
+        if self.closed:
+            return
+        try:
+            if self._local_file is not None:
+                self._local_file.close()
+            self.digest = self._sha256.hexdigest()
+            metadata = {DIGEST_METADATA_KEY: self.digest}
+            if self._upload_id is None:
+                self._s3_client.put_object(
+                    Bucket=self._bucket,
+                    Key=self._key,
+                    Body=bytes(self._buffer),
+                    Metadata=metadata,
+                )
+            else:
+                if self._buffer:
+                    self._send_part(bytes(self._buffer))
+                parts = [future.result() for future in self._parts]
+                self._s3_client.complete_multipart_upload(
+                    Bucket=self._bucket,
+                    Key=self._key,
+                    UploadId=self._upload_id,
+                    MultipartUpload={"Parts": parts},
+                )
+                # the digest is only known at the end, record it with a server-side
+                # copy, split in parts by boto3 above 5GB
+                self._s3_client.copy(
+                    {"Bucket": self._bucket, "Key": self._key},
+                    self._bucket,
+                    self._key,
+                    ExtraArgs={"Metadata": metadata, "MetadataDirective": "REPLACE"},
+                )
+        except BaseException:
+            self.abort()
+            raise
+        self.closed = True
+        self._buffer = bytearray()
+        self._executor.shutdown()
+        rich.print(
+            f"Streamed {self._size / MB:.1f} MB to {self.s3_uri} in {time.monotonic() - self._start:.1f}s"
+        )
+
+    def abort(self):
+        """Cancel the upload and remove the partial local copy"""
+        from botocore.exceptions import ClientError
+
+        self.closed = True
+        self._buffer = bytearray()
+        for future in self._parts:
+            future.cancel()
+        self._executor.shutdown()
+        if self._local_file is not None:
+            self._local_file.close()
+            if os.path.lexists(self._local_path):
+                os.remove(self._local_path)
+        if self._upload_id is not None:
+            try:
+                self._s3_client.abort_multipart_upload(
+                    Bucket=self._bucket, Key=self._key, UploadId=self._upload_id
+                )
+            except ClientError as e:
+                rich.print(f"Could not abort the upload to {self.s3_uri}: {e}")
 
 
 class PrettyUploader:
@@ -141,28 +780,70 @@ class PrettyUploader:
 
     def __init__(
         self,
-        s3_client: boto3.session.Session.client,
+        s3_client: "boto3.session.Session.client",
         bucket: str,
         src_target: Dict[str, str],
+        concurrency: int = DEFAULT_UPLOAD_CONCURRENCY,
+        multipart_chunk_size: int = DEFAULT_MULTIPART_CHUNK_SIZE,
+        extra_args: Optional[Dict[str, Dict]] = None,
     ):
+        """
+        s3_client: boto3.client : s3 client
+        bucket: str : destination bucket
+        src_target: Dict[str, str] : local path to destination key
+        concurrency: int : files uploaded in parallel and parts per multipart upload
+        multipart_chunk_size: int : size (in MB) of each part of a multipart upload
+        extra_args: Dict[str, Dict] : local path to extra arguments of the upload
+        """
+        from boto3.s3.transfer import TransferConfig
+        from rich.progress import Progress, TotalFileSizeColumn
+
         self._s3_client = s3_client
         self._bucket = bucket
         self._src_target = src_target
+        self._extra_args = extra_args or {}
+        self._concurrency = max(concurrency, 1)
+        self._transfer_config = TransferConfig(
+            multipart_threshold=multipart_chunk_size * MB,
+            multipart_chunksize=multipart_chunk_size * MB,
+            max_concurrency=self._concurrency,
+        )
         self._totalsize = sum(
             [float(os.path.getsize(filename)) for filename in self._src_target.keys()]
         )
         self._seensize = 0
+        self._lock = threading.Lock()
         self._progress = Progress(
             *Progress.get_default_columns(), TotalFileSizeColumn()
         )
         self._task = self._progress.add_task("Uploading...", total=self._totalsize)
 
+    def _upload(self, src: str, target: str):
+        """Upload a single file, large files are split into concurrent parts"""
+        self._s3_client.upload_file(
+            src,
+            self._bucket,
+            target,
+            ExtraArgs=self._extra_args.get(src),
+            Callback=self,
+            Config=self._transfer_config,
+        )
+
     def run(self):
         """Upload files to s3"""
         with self._progress:
-            for src, target in self._src_target.items():
-                self._s3_client.upload_file(src, self._bucket, target, Callback=self)
+            with ThreadPoolExecutor(max_workers=self._concurrency) as executor:
+                futures = [
+                    executor.submit(self._upload, src, target)
+                    for src, target in self._src_target.items()
+                ]
+                # surface the first failed upload
+                for future in as_completed(futures):
+                    future.result()
 
     def __call__(self, bytes_amount):
         """Check the progress of the upload"""
-        self._progress.update(self._task, advance=bytes_amount)
+        # callbacks are invoked from the transfer threads of every upload
+        with self._lock:
+            self._seensize += bytes_amount
+            self._progress.update(self._task, completed=self._seensize)
@@ -0,0 +1,80 @@
+"""
+Benchmark the compression settings of the environment archive.
+
+For each combination of threads and gzip level, an existing conda environment is
+packed with conda-pack and unpacked the way executors do it. spark.archives only
+unpacks .zip, .tar, .tar.gz and .tgz files, so zstd or xz archives are not an
+option. Only the gzip level and the number of compression threads can be tuned.
+
+    python tests/benchmarks/env_archive_compression.py --env-name emr_runner \
+        --threads 1 --threads -1 --levels 1 --levels 4 --levels 9
+"""
+
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from typing import List
+
+import rich
+import typer
+from rich.table import Table
+from typing_extensions import Annotated
+
+from emrflow.package.create_env import conda_pack_options
+
+MB = 1024 * 1024
+
+
+def timed(command: str) -> float:
+    """
+    Run a shell command
+    command: str : command
+
+    return: float : elapsed time in seconds
+    """
+    start = time.monotonic()
+    subprocess.run(["bash", "-c", command], check=True, stdout=subprocess.DEVNULL)
+    return time.monotonic() - start
+
+
+def main(
+    env_name: Annotated[str, typer.Option(help="conda environment to pack")],
+    threads: Annotated[
+        List[int], typer.Option(help="Compression threads, -1 for every core")
+    ] = [1, -1],
+    levels: Annotated[List[int], typer.Option(help="gzip levels")] = [1, 4, 9],
+):
+    """Compare pack time, archive size and unpack time"""
+    table = Table(title=f"conda pack of {env_name} ({os.cpu_count()} cores)")
+    for column in ["threads", "level", "pack (s)", "size (MB)", "unpack (s)"]:
+        table.add_column(column, justify="right")
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        archive = os.path.join(work_dir, "pyspark_deps.tar.gz")
+        unpack_dir = os.path.join(work_dir, "environment")
+        for n_threads in threads:
+            for level in levels:
+                pack_time = timed(
+                    f"conda pack -n {env_name} --ignore-missing-files -f -q "
+                    f"{conda_pack_options(n_threads, level)} -o {archive}"
+                )
+                os.makedirs(unpack_dir)
+                # how Hadoop FileUtil.unTar unpacks spark.archives on executors
+                unpack_time = timed(f"gzip -dc {archive} | tar -xf - -C {unpack_dir}")
+                table.add_row(
+                    str(n_threads),
+                    str(level),
+                    f"{pack_time:.1f}",
+                    f"{os.path.getsize(archive) / MB:.1f}",
+                    f"{unpack_time:.1f}",
+                )
+                shutil.rmtree(unpack_dir)
+                os.remove(archive)
+
+    rich.print(table)
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,131 @@
+"""Test cases for submitting a batch of jobs"""
+
+import json
+from unittest.mock import patch
+
+import pytest
+from unit_tests.fixtures import mock_emr_client
+
+from emrflow.deployment.batch import SUBMIT_FAILED, BatchRunner, load_job_specs
+from emrflow.deployment.emr_sls import EMRServerless
+
+SPEC = {
+    "defaults": {
+        "s3_code_uri": "s3://bucket/code",
+        "spark_submit_parameters": "--conf spark.submit.pyFiles=dist/deps.zip",
+    },
+    "jobs": [
+        {"job_name": "ingest", "entry_point": "ingest.py"},
+        {"job_name": "transform", "entry_point": "transform.py", "tags": ["a:b"]},
+    ],
+}
+
+
+def test_load_job_specs(tmp_path):
+    """Jobs are merged with the defaults of the spec"""
+    spec_path = tmp_path / "jobs.json"
+    spec_path.write_text(json.dumps(SPEC))
+
+    jobs = load_job_specs(str(spec_path))
+
+    assert [job["job_name"] for job in jobs] == ["ingest", "transform"]
+    assert jobs[0]["s3_code_uri"] == "s3://bucket/code"
+    assert jobs[0]["tags"] is None
+    assert jobs[1]["tags"] == ["a:b"]
+
+
+def test_load_job_specs_yaml(tmp_path):
+    """YAML specs are supported"""
+    yaml = pytest.importorskip("yaml")
+    spec_path = tmp_path / "jobs.yaml"
+    spec_path.write_text(yaml.safe_dump(SPEC))
+
+    assert len(load_job_specs(str(spec_path))) == 2
+
+
+def test_load_job_specs_duplicate_names(tmp_path):
+    """Job names must be unique"""
+    spec_path = tmp_path / "jobs.json"
+    spec_path.write_text(
+        json.dumps({"defaults": SPEC["defaults"], "jobs": SPEC["jobs"] * 2})
+    )
+
+    with pytest.raises(ValueError):
+        load_job_specs(str(spec_path))
+
+
+def test_batch_runner(mock_emr_client, tmp_path):
+    """Artifacts are uploaded once and every job is submitted and tracked"""
+    spec_path = tmp_path / "jobs.json"
+    spec_path.write_text(json.dumps(SPEC))
+    jobs = load_job_specs(str(spec_path))
+
+    client = mock_emr_client.return_value
+    client.get_application.return_value = {
+        "application": {"schedulerConfiguration": {"maxConcurrentRuns": 1}}
+    }
+    client.start_job_run.side_effect = [{"jobRunId": "1"}, {"jobRunId": "2"}]
+    client.get_job_run.side_effect = lambda applicationId, jobRunId: {
+        "jobRun": {"jobRunId": jobRunId, "state": "SUCCESS"}
+    }
+
+    emr_serverless = EMRServerless("application_id", "job_role")
+    runner = BatchRunner(emr_serverless, max_concurrency=5, ping_duration=0)
+    with patch("emrflow.deployment.emr.upload_package") as mock_upload_package:
+        mock_upload_package.return_value = {
+            "dist/deps.zip": "s3://bucket/code/dist/deps.zip",
+            "ingest.py": "s3://bucket/code/ingest.py",
+            "transform.py": "s3://bucket/code/transform.py",
+        }
+        responses = runner.run(jobs)
+
+    mock_upload_package.assert_called_once()
+    assert mock_upload_package.call_args.args[2] == [
+        "dist/deps.zip",
+        "ingest.py",
+        "transform.py",
+    ]
+    assert runner.get_concurrency() == 1
+    assert runner.job_run_ids == {"ingest": "1", "transform": "2"}
+    assert responses["transform"]["state"] == "SUCCESS"
+    assert (
+        client.start_job_run.call_args.kwargs["jobDriver"]["sparkSubmit"][
+            "sparkSubmitParameters"
+        ]
+        == "--conf spark.submit.pyFiles=s3://bucket/code/dist/deps.zip"
+    )
+
+
+def test_batch_runner_submit_failure(mock_emr_client, tmp_path):
+    """A job that cannot be submitted does not stop the other jobs"""
+    spec = {
+        **SPEC,
+        "jobs": SPEC["jobs"] + [{"job_name": "report", "entry_point": "report.py"}],
+    }
+    spec_path = tmp_path / "jobs.json"
+    spec_path.write_text(json.dumps(spec))
+    jobs = load_job_specs(str(spec_path))
+
+    client = mock_emr_client.return_value
+    client.get_application.return_value = {"application": {}}
+
+    def start_job_run(**kwargs):
+        if kwargs["name"] == "transform":
+            raise ValueError("invalid spark submit parameters")
+        return {"jobRunId": kwargs["name"]}
+
+    client.start_job_run.side_effect = start_job_run
+    client.get_job_run.side_effect = lambda applicationId, jobRunId: {
+        "jobRun": {"jobRunId": jobRunId, "state": "SUCCESS"}
+    }
+
+    emr_serverless = EMRServerless("application_id", "job_role")
+    runner = BatchRunner(emr_serverless, ping_duration=0)
+    with patch("emrflow.deployment.emr.upload_package") as mock_upload_package:
+        mock_upload_package.return_value = {}
+        responses = runner.run(jobs)
+
+    assert responses["ingest"]["state"] == "SUCCESS"
+    assert responses["report"]["state"] == "SUCCESS"
+    assert responses["transform"]["state"] == SUBMIT_FAILED
+    assert "invalid spark submit" in responses["transform"]["stateDetails"]
@@ -0,0 +1,42 @@
+"""Test cases for the shared boto3 clients"""
+
+from unittest.mock import patch
+
+import pytest
+
+from emrflow.deployment import clients
+
+
+@pytest.fixture
+def mock_session():
+    clients.reset_clients()
+    with patch("boto3.session.Session") as mock_session:
+        yield mock_session
+    clients.reset_clients()
+
+
+def test_clients_are_shared(mock_session):
+    """One client is created per service, region and profile"""
+    mock_session.return_value.client.side_effect = lambda *args, **kwargs: object()
+
+    s3_client = clients.get_client("s3")
+    assert clients.get_client("s3") is s3_client
+    assert clients.get_client("s3", region="eu-west-1") is not s3_client
+    assert clients.get_client("s3", profile="other") is not s3_client
+    assert mock_session.return_value.client.call_count == 3
+    mock_session.assert_any_call(profile_name="other")
+
+
+def test_configure_clients(mock_session):
+    """Settings apply to the clients created afterwards"""
+    clients.get_client("emr-serverless", region="us-east-1")
+    clients.configure_clients(max_pool_connections=100, retry_mode="adaptive")
+    clients.get_client("emr-serverless", region="us-east-1")
+
+    assert mock_session.return_value.client.call_count == 2
+    config = mock_session.return_value.client.call_args.kwargs["config"]
+    assert config.max_pool_connections == 100
+    assert config.retries == {"mode": "adaptive", "max_attempts": 5}
+
+    with pytest.raises(ValueError):
+        clients.configure_clients(pool_size=10)
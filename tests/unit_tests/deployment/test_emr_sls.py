@@ -1,6 +1,18 @@
 """Test cases for the EMRServerless class"""
 
-from unit_tests.fixtures import mock_emr_client, mock_print_s3_gz
+import gzip
+import io
+from datetime import datetime, timedelta, timezone
+from unittest.mock import Mock, patch
+
+from botocore.exceptions import ClientError
+
+from unit_tests.fixtures import (
+    FakeS3Bucket,
+    UnlistableS3Bucket,
+    emrflow_home,
+    mock_emr_client,
+)
 
 from emrflow.deployment.emr_sls import EMRServerless
 
@@ -154,22 +166,228 @@ def test_job_tracking(mock_emr_client):
     assert status == "COMPLETED"
 
 
-def test_show_logs(mock_emr_client, mock_print_s3_gz):
+def test_job_tracking_retries_throttling(mock_emr_client):
+    """Throttled status checks are retried after backing off"""
+    mock_emr_client.return_value.get_job_run.side_effect = [
+        ClientError({"Error": {"Code": "ThrottlingException"}}, "GetJobRun"),
+        {"jobRun": {"jobId": "123", "state": "RUNNING"}},
+        {"jobRun": {"jobId": "123", "state": "SUCCESS"}},
+    ]
+    emr_serverless = EMRServerless("application_id", "job_role")
+
+    with patch("emrflow.deployment.emr.sleep") as mock_sleep:
+        job_done, status, response = emr_serverless.job_tracking(
+            "job_run_id", show_logs=False, ping_duration=30
+        )
+
+    assert status == "SUCCESS"
+    # one sleep after throttling, one while running, none after the terminal state
+    assert mock_sleep.call_count == 2
+
+
+def running_job(state: str = "RUNNING") -> dict:
+    return {
+        "jobRunId": "123",
+        "state": state,
+        "configurationOverrides": {
+            "monitoringConfiguration": {
+                "s3MonitoringConfiguration": {"logUri": "s3://bucket/logs"}
+            }
+        },
+    }
+
+
+def test_show_logs(mock_emr_client, capsys):
+    """New driver logs are printed, unchanged logs are not fetched again"""
+    stdout_key = "logs/applications/application_id/jobs/123/SPARK_DRIVER/stdout.gz"
+    bucket = FakeS3Bucket({stdout_key: gzip.compress(b"first\n")})
+    emr_serverless = EMRServerless("application_id", "job_role")
+    emr_serverless.s3_client = bucket
+
+    position = emr_serverless.show_logs("123", 0, jr_response=running_job())
+    assert position == 6
+    assert capsys.readouterr().out == "driver stdout | first\n"
+
+    bucket.fetched = []
+    assert emr_serverless.show_logs("123", position, jr_response=running_job()) == 6
+    assert bucket.fetched == []
+
+    bucket.objects[stdout_key] += gzip.compress(b"second\n")
+    assert emr_serverless.show_logs("123", 6, jr_response=running_job()) == 13
+    assert capsys.readouterr().out == "driver stdout | second\n"
+    assert bucket.fetched == [stdout_key]
+
+    # the streamer of a finished job run is released after the final flush
+    bucket.objects[stdout_key] += gzip.compress(b"last")
+    emr_serverless.show_logs("123", 13, jr_response=running_job("SUCCESS"))
+    assert capsys.readouterr().out == "driver stdout | last\n"
+    assert emr_serverless._log_streamers == {}
+
+
+def test_show_logs_without_list_permission(mock_emr_client, capsys):
+    """Without s3:ListBucket the driver logs are still printed"""
+    bucket = UnlistableS3Bucket(
+        {
+            "logs/applications/application_id/jobs/123/SPARK_DRIVER/stderr.gz": (
+                gzip.compress(b"error\n")
+            )
+        }
+    )
+    mock_emr_client.return_value.get_job_run.return_value = {
+        "jobRun": running_job("FAILED")
+    }
+    emr_serverless = EMRServerless("application_id", "job_role")
+    emr_serverless.s3_client = bucket
+
+    emr_serverless.show_logs("123", 0)
+
+    assert capsys.readouterr().out.splitlines()[-1] == "driver stderr | error"
+
+
+def test_run_job_content_addressed(mock_emr_client):
+    """Entry point and spark parameters point at the uploaded locations"""
+
+    mock_emr_client.return_value.start_job_run.return_value = {"jobRunId": "456"}
+    emr_serverless = EMRServerless("application_id", "job_role")
+
+    emr_serverless.run_job(
+        job_name="test_job",
+        entry_point_uri="main.py",
+        spark_submit_opts="--conf spark.submit.pyFiles=dist/deps.zip,deps.zip",
+        wait=False,
+        s3_code_uri="s3://code_uri",
+        src_dest_uri={
+            "main.py": "s3://code_uri/cas/abc/main.py",
+            "dist/deps.zip": "s3://code_uri/cas/def/deps.zip",
+            "deps.zip": "s3://code_uri/cas/ghi/deps.zip",
+        },
+    )
+
+    job_driver = mock_emr_client.return_value.start_job_run.call_args.kwargs[
+        "jobDriver"
+    ]
+    assert job_driver["sparkSubmit"] == {
+        "entryPoint": "s3://code_uri/cas/abc/main.py",
+        "sparkSubmitParameters": "--conf spark.submit.pyFiles=s3://code_uri/cas/def/deps.zip,s3://code_uri/cas/ghi/deps.zip",
+    }
+
+
+def test_gc_artifacts(mock_emr_client):
+    """Only old artifacts no recent job run references are removed"""
+    referenced = "a" * 64
+    unreferenced = "b" * 64
+    recent = "c" * 64
+    old_date = datetime.now(timezone.utc) - timedelta(days=60)
+
+    job_runs_paginator = Mock()
+    job_runs_paginator.paginate.return_value = [{"jobRuns": [{"id": "job1"}]}]
+    objects_paginator = Mock()
+    objects_paginator.paginate.return_value = [
+        {
+            "Contents": [
+                {"Key": f"code/cas/{referenced}/main.py", "LastModified": old_date},
+                {"Key": f"code/cas/{unreferenced}/deps.zip", "LastModified": old_date},
+                {
+                    "Key": f"code/cas/{recent}/deps.zip",
+                    "LastModified": datetime.now(timezone.utc),
+                },
+            ]
+        }
+    ]
+    mock_emr_client.return_value.get_paginator.side_effect = lambda name: {
+        "list_job_runs": job_runs_paginator,
+        "list_objects_v2": objects_paginator,
+    }[name]
     mock_emr_client.return_value.get_job_run.return_value = {
         "jobRun": {
-            "jobId": "123",
-            "state": "COMPLETED",
+            "jobDriver": {
+                "sparkSubmit": {
+                    "entryPoint": f"s3://bucket/code/cas/{referenced}/main.py"
+                }
+            }
+        }
+    }
+
+    emr_serverless = EMRServerless("application_id", "job_role")
+    removed = emr_serverless.gc_artifacts("s3://bucket/code", retention_days=30)
+
+    assert removed == [f"code/cas/{unreferenced}/deps.zip"]
+    objects_paginator.paginate.assert_called_once_with(
+        Bucket="bucket", Prefix="code/cas/"
+    )
+    mock_emr_client.return_value.delete_objects.assert_called_once_with(
+        Bucket="bucket",
+        Delete={
+            "Objects": [{"Key": f"code/cas/{unreferenced}/deps.zip"}],
+            "Quiet": True,
+        },
+    )
+
+
+def test_download_logs_served_from_cache(mock_emr_client, emrflow_home, tmp_path):
+    """Logs of a finished job run are only listed and downloaded once"""
+    client = mock_emr_client.return_value
+    client.get_job_run.return_value = {
+        "jobRun": {
+            "state": "SUCCESS",
             "configurationOverrides": {
                 "monitoringConfiguration": {
-                    "s3MonitoringConfiguration": {"logUri": "s3://logs_uri"}
+                    "s3MonitoringConfiguration": {"logUri": "s3://bucket/logs"}
                 }
             },
         }
     }
+    key = "logs/applications/application_id/jobs/123/SPARK_DRIVER/stdout.gz"
+    client.get_paginator.return_value.paginate.return_value = [
+        {"Contents": [{"Key": key, "ETag": "etag"}]}
+    ]
+    client.download_file.side_effect = lambda bucket, key, path: open(
+        path, "wb"
+    ).close()
+    emr_serverless = EMRServerless("application_id", "job_role")
+
+    files = emr_serverless.download_logs("123")
+    assert list(files) == ["SPARK_DRIVER/stdout.gz"]
+
+    client.reset_mock()
+    files = emr_serverless.download_logs("123", dest=str(tmp_path / "dest"))
+    assert files == {
+        "SPARK_DRIVER/stdout.gz": str(tmp_path / "dest" / "SPARK_DRIVER/stdout.gz")
+    }
+    assert (tmp_path / "dest" / "SPARK_DRIVER" / "stdout.gz").is_file()
+    client.get_job_run.assert_not_called()
+    client.get_paginator.assert_not_called()
+    client.download_file.assert_not_called()
 
-    mock_print_s3_gz.return_value = 0
 
+def test_search_logs(mock_emr_client, emrflow_home, capsys):
+    """Every log object under the job log prefix is streamed and searched"""
+    client = mock_emr_client.return_value
+    client.get_job_run.return_value = {
+        "jobRun": {
+            "state": "FAILED",
+            "configurationOverrides": {
+                "monitoringConfiguration": {
+                    "s3MonitoringConfiguration": {"logUri": "s3://bucket/logs"}
+                }
+            },
+        }
+    }
+    prefix = "logs/applications/application_id/jobs/123"
+    client.get_paginator.return_value.paginate.return_value = [
+        {
+            "Contents": [
+                {"Key": f"{prefix}/SPARK_DRIVER/stdout.gz", "ETag": "a"},
+                {"Key": f"{prefix}/SPARK_EXECUTOR/1/stderr.gz", "ETag": "b"},
+            ]
+        }
+    ]
+    client.get_object.side_effect = lambda Bucket, Key: {
+        "Body": io.BytesIO(
+            gzip.compress(b"ok\nOutOfMemoryError\n" if "EXECUTOR" in Key else b"ok\n")
+        )
+    }
     emr_serverless = EMRServerless("application_id", "job_role")
-    return_val = emr_serverless.show_logs("123", 0)
 
-    assert return_val == 0
+    assert emr_serverless.search_logs("123", "OutOfMemory", context=0) == 1
+    assert capsys.readouterr().out == "executor 1 stderr:2: OutOfMemoryError\n"
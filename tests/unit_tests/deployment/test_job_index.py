@@ -0,0 +1,104 @@
+"""Test cases for the local index of job runs"""
+
+from datetime import datetime, timedelta, timezone
+from unittest.mock import Mock
+
+from unit_tests.fixtures import mock_emr_client
+
+from emrflow.deployment.emr_sls import EMRServerless
+from emrflow.deployment.job_index import SYNC_OVERLAP, JobRunIndex
+
+NOW = datetime(2024, 5, 1, 12, tzinfo=timezone.utc)
+
+
+def job_run(job_run_id, name, state, created_at):
+    return {
+        "id": job_run_id,
+        "name": name,
+        "state": state,
+        "createdAt": created_at,
+        "updatedAt": created_at,
+        "arn": f"arn:{job_run_id}",
+    }
+
+
+def test_list_job_runs_follows_next_token(mock_emr_client):
+    """list_job_runs pages through nextToken until max_results"""
+    mock_emr_client.return_value.list_job_runs.side_effect = [
+        {"jobRuns": [{"id": str(i)} for i in range(50)], "nextToken": "token"},
+        {"jobRuns": [{"id": str(i)} for i in range(50, 100)], "nextToken": "token2"},
+    ]
+
+    emr_serverless = EMRServerless("application_id", "job_role")
+    result = emr_serverless.list_job_runs(70, ["SUCCESS"])
+
+    assert len(result) == 70
+    second_call = mock_emr_client.return_value.list_job_runs.call_args_list[1]
+    assert second_call.kwargs == {
+        "applicationId": "application_id",
+        "maxResults": 20,
+        "states": ["SUCCESS"],
+        "nextToken": "token",
+    }
+
+
+def test_index_refresh_and_search(mock_emr_client, tmp_path):
+    """Job runs are indexed with their tags and can be filtered"""
+    paginator = Mock()
+    paginator.paginate.return_value = [
+        {
+            "jobRuns": [
+                job_run("1", "ingest-daily", "SUCCESS", NOW - timedelta(hours=3)),
+                job_run("2", "transform-daily", "RUNNING", NOW - timedelta(hours=1)),
+            ]
+        }
+    ]
+    client = mock_emr_client.return_value
+    client.get_paginator.return_value = paginator
+    client.get_job_run.side_effect = lambda applicationId, jobRunId: {
+        "jobRun": {
+            "jobRunId": jobRunId,
+            "state": "SUCCESS" if jobRunId == "1" else "RUNNING",
+            "tags": {"team": "data" if jobRunId == "1" else "ml"},
+        }
+    }
+
+    index = JobRunIndex(
+        EMRServerless("application_id", "job_role"), db_path=str(tmp_path / "idx.db")
+    )
+    assert index.refresh() == 2
+    paginator.paginate.assert_called_once_with(applicationId="application_id")
+
+    assert [run["id"] for run in index.search()] == ["2", "1"]
+    assert [run["id"] for run in index.search(name="ingest")] == ["1"]
+    assert [run["id"] for run in index.search(states=["RUNNING"])] == ["2"]
+    assert [run["id"] for run in index.search(tags={"team": "data"})] == ["1"]
+    assert index.get_details("1")["tags"] == {"team": "data"}
+    assert index.get_details("2") is None
+
+
+def test_index_refresh_is_incremental(mock_emr_client, tmp_path):
+    """Refreshes list job runs from the oldest unfinished job run"""
+    paginator = Mock()
+    paginator.paginate.return_value = [
+        {"jobRuns": [job_run("1", "ingest", "RUNNING", NOW - timedelta(days=2))]}
+    ]
+    client = mock_emr_client.return_value
+    client.get_paginator.return_value = paginator
+    client.get_job_run.return_value = {"jobRun": {"state": "RUNNING", "tags": {}}}
+
+    index = JobRunIndex(
+        EMRServerless("application_id", "job_role"), db_path=str(tmp_path / "idx.db")
+    )
+    index.refresh()
+    paginator.paginate.return_value = [
+        {"jobRuns": [job_run("1", "ingest", "SUCCESS", NOW - timedelta(days=2))]}
+    ]
+    index.refresh()
+
+    assert paginator.paginate.call_args.kwargs["createdAtAfter"] == (
+        NOW - timedelta(days=2) - SYNC_OVERLAP
+    )
+    assert index.search()[0]["state"] == "SUCCESS"
+    # tags were already fetched, details are fetched once the run is finished
+    assert client.get_job_run.call_count == 2
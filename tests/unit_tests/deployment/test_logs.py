@@ -0,0 +1,218 @@
+"""Test cases for streaming the driver and executor logs of a job run"""
+
+import gzip
+import io
+
+from unit_tests.fixtures import FakeS3Bucket, UnlistableS3Bucket
+
+from emrflow.deployment.logs import (
+    LogCache,
+    LogSearcher,
+    LogStreamer,
+    log_source,
+    print_local_logs,
+)
+
+PREFIX = "logs/applications/app/jobs/job"
+
+
+def test_log_source():
+    """Log objects are named after their process and stream"""
+    assert log_source("SPARK_DRIVER/stdout.gz") == "driver stdout"
+    assert log_source("SPARK_EXECUTOR/3/stderr.gz") == "executor 3 stderr"
+    assert log_source("SPARK_DRIVER/gc.log.gz") is None
+    assert log_source("SPARK_EXECUTOR/stdout.gz") is None
+
+
+def test_poll_reads_every_stream():
+    """Driver stdout and stderr are both streamed, executors only when asked"""
+    bucket = FakeS3Bucket(
+        {
+            f"{PREFIX}/SPARK_DRIVER/stdout.gz": gzip.compress(b"out\n"),
+            f"{PREFIX}/SPARK_DRIVER/stderr.gz": gzip.compress(b"err\n"),
+            f"{PREFIX}/SPARK_EXECUTOR/1/stderr.gz": gzip.compress(b"task\n"),
+        }
+    )
+
+    streamer = LogStreamer(bucket, f"s3://bucket/{PREFIX}/")
+    assert streamer.poll() == {"driver stderr": "err\n", "driver stdout": "out\n"}
+    assert streamer.position == 8
+
+    streamer = LogStreamer(bucket, f"s3://bucket/{PREFIX}", executor_logs=True)
+    assert streamer.poll()["executor 1 stderr"] == "task\n"
+
+
+def test_poll_skips_unchanged_logs():
+    """Only logs whose ETag changed since the previous poll are fetched again"""
+    stdout_key = f"{PREFIX}/SPARK_DRIVER/stdout.gz"
+    stderr_key = f"{PREFIX}/SPARK_DRIVER/stderr.gz"
+    bucket = FakeS3Bucket(
+        {stdout_key: gzip.compress(b"a\n"), stderr_key: gzip.compress(b"b\n")}
+    )
+    streamer = LogStreamer(bucket, f"s3://bucket/{PREFIX}")
+    streamer.poll()
+
+    bucket.fetched = []
+    assert streamer.poll() == {}
+    assert bucket.fetched == []
+
+    bucket.objects[stderr_key] += gzip.compress(b"c\n")
+    assert streamer.poll() == {"driver stderr": "c\n"}
+    assert bucket.fetched == [stderr_key]
+
+
+def test_poll_without_list_permission():
+    """Without s3:ListBucket, the driver logs are fetched from their known keys"""
+    stdout_key = f"{PREFIX}/SPARK_DRIVER/stdout.gz"
+    bucket = UnlistableS3Bucket(
+        {
+            f"{PREFIX}/SPARK_DRIVER/stderr.gz": gzip.compress(b"err\n"),
+            f"{PREFIX}/SPARK_EXECUTOR/1/stderr.gz": gzip.compress(b"task\n"),
+        }
+    )
+    streamer = LogStreamer(bucket, f"s3://bucket/{PREFIX}", executor_logs=True)
+
+    assert streamer.poll() == {"driver stderr": "err\n"}
+    assert streamer.poll() == {}
+
+    bucket.objects[stdout_key] = gzip.compress(b"out\n")
+    assert streamer.poll() == {"driver stdout": "out\n"}
+
+
+def test_print_new_prefixes_complete_lines(capsys):
+    """Lines are printed with their source, incomplete lines wait for their end"""
+    key = f"{PREFIX}/SPARK_DRIVER/stderr.gz"
+    bucket = FakeS3Bucket({key: gzip.compress(b"first\nsec")})
+    streamer = LogStreamer(bucket, f"s3://bucket/{PREFIX}")
+
+    assert streamer.print_new() == 1
+    assert capsys.readouterr().out == "driver stderr | first\n"
+
+    bucket.objects[key] += gzip.compress(b"ond\nthi")
+    assert streamer.print_new() == 1
+    assert capsys.readouterr().out == "driver stderr | second\n"
+
+    assert streamer.print_new(final=True) == 1
+    assert capsys.readouterr().out == "driver stderr | thi\n"
+
+
+def test_log_cache_downloads_changed_objects(tmp_path):
+    """Only objects missing from the cache or with a new ETag are downloaded"""
+    stdout_key = f"{PREFIX}/SPARK_DRIVER/stdout.gz"
+    executor_key = f"{PREFIX}/SPARK_EXECUTOR/1/stderr.gz"
+    bucket = FakeS3Bucket(
+        {stdout_key: gzip.compress(b"a\n"), executor_key: gzip.compress(b"b\n")}
+    )
+    cache = LogCache(str(tmp_path))
+
+    files = cache.sync(bucket, "job", f"s3://bucket/{PREFIX}")
+    assert sorted(files) == ["SPARK_DRIVER/stdout.gz", "SPARK_EXECUTOR/1/stderr.gz"]
+    assert gzip.open(files["SPARK_DRIVER/stdout.gz"]).read() == b"a\n"
+    assert not cache.is_complete("job", [""])
+
+    bucket.fetched = []
+    bucket.objects[stdout_key] += gzip.compress(b"c\n")
+    cache.sync(bucket, "job", f"s3://bucket/{PREFIX}", complete=True)
+    assert bucket.fetched == [stdout_key]
+    assert gzip.open(files["SPARK_DRIVER/stdout.gz"]).read() == b"a\nc\n"
+    assert cache.is_complete("job", ["SPARK_DRIVER"])
+
+
+def test_log_cache_only_syncs_directories(tmp_path):
+    """A sync restricted to some directories only marks those as complete"""
+    bucket = FakeS3Bucket(
+        {
+            f"{PREFIX}/SPARK_DRIVER/stdout.gz": gzip.compress(b"a\n"),
+            f"{PREFIX}/SPARK_EXECUTOR/1/stderr.gz": gzip.compress(b"b\n"),
+        }
+    )
+    cache = LogCache(str(tmp_path))
+    files = cache.sync(
+        bucket,
+        "job",
+        f"s3://bucket/{PREFIX}",
+        directories=["SPARK_DRIVER"],
+        complete=True,
+    )
+
+    assert list(files) == ["SPARK_DRIVER/stdout.gz"]
+    assert cache.is_complete("job", ["SPARK_DRIVER"])
+    assert not cache.is_complete("job", ["SPARK_DRIVER", "SPARK_EXECUTOR"])
+
+
+def test_print_local_logs(tmp_path, capsys):
+    """Downloaded logs are printed with their source, other files are skipped"""
+    stderr_path = tmp_path / "stderr.gz"
+    stderr_path.write_bytes(gzip.compress(b"one\n") + gzip.compress(b"two"))
+    files = {
+        "SPARK_DRIVER/stderr.gz": str(stderr_path),
+        "SPARK_DRIVER/gc.log.gz": str(tmp_path / "missing.gz"),
+    }
+
+    assert print_local_logs(files) == 2
+    assert capsys.readouterr().out == "driver stderr | one\ndriver stderr | two\n"
+
+
+def test_print_local_logs_of_running_job(tmp_path, capsys):
+    """A log still being written ends with a truncated member, read up to there"""
+    stdout_path = tmp_path / "stdout.gz"
+    stdout_path.write_bytes(
+        gzip.compress(b"one\n") + gzip.compress(b"two\nthree\n" * 1000)[:-12]
+    )
+
+    assert print_local_logs({"SPARK_DRIVER/stdout.gz": str(stdout_path)}) > 1
+    out = capsys.readouterr().out.splitlines()
+    assert out[:3] == [
+        "driver stdout | one",
+        "driver stdout | two",
+        "driver stdout | three",
+    ]
+
+
+def opener(data: bytes):
+    return lambda: io.BytesIO(data)
+
+
+def test_search_prints_matches_with_context(capsys):
+    """Matches are printed with their source, line number and context lines"""
+    logs = "".join(f"line {i}\n" for i in range(1, 8)).replace("line 4", "ERROR 4")
+    searcher = LogSearcher("error", context=1, ignore_case=True)
+
+    matches = searcher.search(
+        {"SPARK_EXECUTOR/2/stderr.gz": opener(gzip.compress(logs.encode()))}
+    )
+
+    assert matches == 1
+    assert capsys.readouterr().out == (
+        "executor 2 stderr-3- line 3\n"
+        "executor 2 stderr:4: ERROR 4\n"
+        "executor 2 stderr-5- line 5\n"
+    )
+
+
+def test_search_overlapping_context_and_plain_objects(capsys):
+    """A match within the context of another one is printed as well"""
+    searcher = LogSearcher("^m", context=2)
+
+    assert searcher.search({"SPARK_DRIVER/gc.log": opener(b"a\nm1\nm2\nb")}) == 2
+    out = capsys.readouterr().out.splitlines()
+    assert out[:4] == [
+        "SPARK_DRIVER/gc.log-1- a",
+        "SPARK_DRIVER/gc.log:2: m1",
+        "SPARK_DRIVER/gc.log-3- m2",
+        "SPARK_DRIVER/gc.log-4- b",
+    ]
+    assert out[4] == "--"
+
+
+def test_search_stops_at_max_matches(capsys):
+    """The search stops once enough matches were printed"""
+    logs = gzip.compress(b"match\n" * 1000)
+    searcher = LogSearcher("match", context=0, max_matches=3)
+
+    matches = searcher.search(
+        {f"SPARK_EXECUTOR/{i}/stdout.gz": opener(logs) for i in range(10)}
+    )
+
+    assert matches == 3
+    assert len(capsys.readouterr().out.splitlines()) == 3
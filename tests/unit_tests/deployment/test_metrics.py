@@ -0,0 +1,178 @@
+"""Test cases for the job run metrics"""
+
+import pytest
+
+from unit_tests.fixtures import mock_emr_client
+
+from emrflow.deployment.emr_sls import EMRServerless
+from emrflow.deployment.metrics import (
+    JsonlMetricsStore,
+    MetricsRecorder,
+    SqliteMetricsStore,
+    open_metrics_store,
+    prometheus_text,
+)
+from emrflow.utils import parse_duration
+
+UTILIZATION = {"vCPUHour": 2.5, "memoryGBHour": 10.0, "storageGBHour": 20.0}
+
+
+def finished_run(state: str = "SUCCESS") -> dict:
+    return {
+        "name": "ingest",
+        "state": state,
+        "tags": {"team": "data"},
+        "totalExecutionDurationSeconds": 120,
+        "totalResourceUtilization": UTILIZATION,
+        "billedResourceUtilization": UTILIZATION,
+    }
+
+
+def test_recorder_measures_every_phase(tmp_path):
+    """Upload, submit and the time in each state are recorded with the usage"""
+    recorder = MetricsRecorder(JsonlMetricsStore(str(tmp_path / "metrics.jsonl")))
+    recorder.record_upload(100, 103, uploaded_bytes=2048)
+    recorder.record_submit("run", "ingest", 103, 104)
+
+    assert recorder.record_state("run", {"state": "SUBMITTED"}, at=105) is None
+    recorder.record_state("run", {"state": "SCHEDULED"}, at=110)
+    recorder.record_state("run", {"state": "RUNNING"}, at=130)
+    record = recorder.record_state("run", finished_run(), at=230)
+
+    assert record["durations"] == {
+        "upload": 3,
+        "submit": 1,
+        "SUBMITTED": 6,
+        "SCHEDULED": 20,
+        "RUNNING": 100,
+    }
+    assert record["end_to_end_seconds"] == 130
+    assert record["upload_bytes"] == 2048
+    assert record["total_resource_utilization"] == UTILIZATION
+    assert recorder.store.records() == [record]
+    assert recorder.store.records(since=231) == []
+
+
+def test_recorder_tracks_runs_it_did_not_submit(tmp_path):
+    """A job run only tracked is recorded from the first state observed"""
+    exported = []
+    recorder = MetricsRecorder(
+        open_metrics_store(str(tmp_path / "metrics.db")), exporters=[exported.append]
+    )
+    assert isinstance(recorder.store, SqliteMetricsStore)
+
+    recorder.record_state("run", {"name": "ingest", "state": "RUNNING"}, at=10)
+    recorder.record_state("run", finished_run("FAILED"), at=15)
+
+    record = recorder.store.records()[0]
+    assert record["durations"] == {"RUNNING": 5}
+    assert record["job_name"] == "ingest"
+    assert record["final_state"] == "FAILED"
+    assert exported == [record]
+
+
+def test_prometheus_text():
+    """Every duration and resource is exposed as a labelled gauge"""
+    record = {
+        "job_run_id": "run",
+        "job_name": 'in"gest',
+        "final_state": "SUCCESS",
+        "durations": {"upload": 3, "RUNNING": 100},
+        "end_to_end_seconds": 103,
+        "upload_bytes": None,
+        "total_resource_utilization": UTILIZATION,
+        "billed_resource_utilization": {},
+    }
+
+    text = prometheus_text([record])
+
+    labels = 'job_name="in\\"gest",job_run_id="run",state="SUCCESS"'
+    assert "# TYPE emrflow_job_phase_seconds gauge" in text
+    assert f'emrflow_job_phase_seconds{{{labels},phase="RUNNING"}} 100' in text
+    assert f"emrflow_job_end_to_end_seconds{{{labels}}} 103" in text
+    assert "emrflow_job_upload_bytes{" not in text
+    assert (
+        f'emrflow_job_resource_utilization{{{labels},kind="total",resource="vCPUHour"}} 2.5'
+        in text
+    )
+
+
+def test_run_job_records_metrics(mock_emr_client, tmp_path):
+    """Submitting and tracking a job run through EMRServerless writes its record"""
+    client = mock_emr_client.return_value
+    client.start_job_run.return_value = {"jobRunId": "456"}
+    client.get_job_run.side_effect = [
+        {"jobRun": {"state": "RUNNING"}},
+        {"jobRun": finished_run()},
+    ]
+    emr_serverless = EMRServerless("application_id", "job_role")
+    emr_serverless.metrics = MetricsRecorder(
+        JsonlMetricsStore(str(tmp_path / "metrics.jsonl")),
+        application_id="application_id",
+    )
+
+    emr_serverless.run_job(
+        job_name="ingest",
+        entry_point_uri="main.py",
+        wait=True,
+        s3_code_uri="s3://code_uri",
+        ping_duration=0,
+    )
+
+    record = emr_serverless.metrics.store.records()[0]
+    assert record["job_run_id"] == "456"
+    assert record["application_id"] == "application_id"
+    assert list(record["durations"]) == ["submit", "SUBMITTED", "RUNNING"]
+    assert record["billed_resource_utilization"] == UTILIZATION
+
+
+def test_parse_duration():
+    """Durations are a number followed by a unit"""
+    assert parse_duration("90s") == 90
+    assert parse_duration("7d") == 7 * 86400
+    assert parse_duration("1.5h") == 5400
+    with pytest.raises(ValueError):
+        parse_duration("7 days")
+
+
+def test_uploads_are_credited_to_their_batch(tmp_path):
+    """Uploads before a batch are added up, later batches are not credited with them"""
+    recorder = MetricsRecorder(JsonlMetricsStore(str(tmp_path / "metrics.jsonl")))
+    recorder.record_upload(100, 102, uploaded_bytes=1000)
+    recorder.record_upload(102, 105, uploaded_bytes=24)
+    recorder.record_submit("first", "ingest", 106, 107)
+    recorder.record_submit("second", "ingest", 130, 131)
+    recorder.record_submit("late", "report", 5100, 5101)
+
+    first = recorder.record_state("first", finished_run(), at=200)
+    second = recorder.record_state("second", finished_run(), at=200)
+    late = recorder.record_state("late", finished_run(), at=5200)
+
+    assert first["upload_bytes"] == second["upload_bytes"] == 1024
+    assert first["durations"]["upload"] == 5
+    assert first["end_to_end_seconds"] == 100
+    assert late["upload_bytes"] is None
+    assert "upload" not in late["durations"]
+    assert late["end_to_end_seconds"] == 100
+
+
+def test_job_run_finished_before_tracking_is_not_recorded(tmp_path):
+    """Tracking a job run already over does not overwrite its record"""
+    recorder = MetricsRecorder(open_metrics_store(str(tmp_path / "metrics.db")))
+    recorder.record_submit("run", "ingest", 0, 1)
+    recorder.record_state("run", finished_run(), at=10)
+
+    other = MetricsRecorder(recorder.store)
+    assert other.record_state("run", finished_run(), at=20) is None
+    assert recorder.store.records()[0]["durations"] == {"submit": 1, "SUBMITTED": 9}
+
+
+def test_jsonl_store_rotation(tmp_path):
+    """The JSONL file is rotated once full, records of both files are read"""
+    store = JsonlMetricsStore(str(tmp_path / "metrics.jsonl"), max_bytes=60)
+    for index in range(4):
+        store.append({"job_run_id": str(index), "recorded_at": index, "pad": "x" * 20})
+
+    assert (tmp_path / "metrics.jsonl.1").exists()
+    # a single rotated file is kept
+    assert [record["job_run_id"] for record in store.records()] == ["2", "3"]
@@ -0,0 +1,151 @@
+"""Test cases for the resource utilization report"""
+
+from datetime import datetime, timedelta, timezone
+from unittest.mock import Mock
+
+import pytest
+
+from unit_tests.fixtures import emrflow_home, mock_emr_client
+
+from emrflow.deployment.emr_sls import EMRServerless
+from emrflow.deployment.job_index import JobRunIndex
+from emrflow.deployment.report import (
+    aggregate_usage,
+    collect_usage,
+    job_name_trends,
+    relative_change,
+    spark_line,
+    validate_group_by,
+)
+
+NOW = datetime.now(timezone.utc)
+
+
+def usage(name, vcpu_hours, runtime_hours, state="SUCCESS", team=None):
+    return {
+        "id": f"{name}-{vcpu_hours}",
+        "name": name,
+        "state": state,
+        "created_at": NOW.isoformat(),
+        "tags": {"team": team} if team else {},
+        "runtime_hours": runtime_hours,
+        "vCPUHour": vcpu_hours,
+        "memoryGBHour": vcpu_hours * 4,
+        "storageGBHour": 20,
+        "billed_vCPUHour": vcpu_hours,
+        "billed_memoryGBHour": vcpu_hours * 4,
+        "billed_storageGBHour": 0,
+    }
+
+
+def test_collect_usage_caches_details(mock_emr_client, tmp_path):
+    """Details are fetched once for finished job runs, running ones are refetched"""
+    client = mock_emr_client.return_value
+    client.get_paginator.return_value = Mock(
+        paginate=Mock(
+            return_value=[
+                {
+                    "jobRuns": [
+                        {
+                            "id": job_run_id,
+                            "name": "ingest",
+                            "state": state,
+                            "createdAt": NOW - timedelta(hours=hours),
+                        }
+                        for job_run_id, state, hours in [
+                            ("1", "SUCCESS", 3),
+                            ("2", "RUNNING", 1),
+                            ("3", "SUCCESS", 24 * 30),
+                        ]
+                    ]
+                }
+            ]
+        )
+    )
+    client.get_job_run.side_effect = lambda applicationId, jobRunId: {
+        "jobRun": {
+            "jobRunId": jobRunId,
+            "state": "RUNNING" if jobRunId == "2" else "SUCCESS",
+            "totalExecutionDurationSeconds": 1800,
+            "totalResourceUtilization": {"vCPUHour": 2.0, "memoryGBHour": 8.0},
+        }
+    }
+    emr_serverless = EMRServerless("application_id", "job_role")
+    index = JobRunIndex(emr_serverless, db_path=str(tmp_path / "idx.db"))
+
+    usages = collect_usage(emr_serverless, index, NOW - timedelta(days=7))
+
+    assert [run["id"] for run in usages] == ["1", "2"]
+    assert usages[0]["vCPUHour"] == 2.0
+    assert usages[0]["runtime_hours"] == 0.5
+    assert usages[0]["storageGBHour"] == 0
+
+    client.get_job_run.reset_mock()
+    collect_usage(emr_serverless, index, NOW - timedelta(days=7), refresh=False)
+    client.get_job_run.assert_called_once_with(
+        applicationId="application_id", jobRunId="2"
+    )
+
+
+def test_aggregate_usage_by_tag():
+    """Usage is summed per tag value, job runs without the tag are grouped apart"""
+    usages = [
+        usage("ingest", 2, 1, team="data"),
+        usage("transform", 6, 1, state="FAILED", team="data"),
+        usage("train", 1, 1),
+    ]
+
+    rows = aggregate_usage(usages, "tag:team")
+
+    assert [row["group"] for row in rows] == ["data", "(none)"]
+    assert rows[0]["runs"] == 2
+    assert rows[0]["failed"] == 1
+    assert rows[0]["vCPUHour"] == 8
+    assert rows[0]["avg_vcpu"] == 4
+    assert rows[0]["avg_memory_gb"] == 16
+    with pytest.raises(ValueError):
+        aggregate_usage(usages, "team")
+
+
+def test_validate_group_by():
+    """Only name, state and tag:<key> groupings are accepted"""
+    validate_group_by("tag:team")
+    for group_by in ["team", "tag:", "id"]:
+        with pytest.raises(ValueError):
+            validate_group_by(group_by)
+
+
+def test_job_name_trends():
+    """Trends compare the newer runs of a job name with the older ones"""
+    trends = job_name_trends(
+        [usage("ingest", 1, 0.5), usage("ingest", 2, 0.5), usage("train", 3, 1)]
+    )
+
+    assert [trend["name"] for trend in trends] == ["ingest", "train"]
+    assert trends[0]["runs"] == 2
+    assert trends[0]["avg_runtime_minutes"] == 30
+    assert trends[0]["vCPUHour_change"] == 1
+    assert trends[0]["runtime_change"] == 0
+    assert trends[0]["vCPUHour_spark_line"] == "▅█"
+    assert trends[1]["vCPUHour_change"] is None
+
+
+def test_spark_line_and_relative_change():
+    """Sparklines scale to the highest value of the series"""
+    assert spark_line([0, 4, 8]) == "▁▅█"
+    assert spark_line([0, 0]) == "▁▁"
+    assert relative_change([1, 1, 2, 2]) == 1
+    assert relative_change([0, 1]) is None
+
+
+def test_report_rejects_grouping_before_fetching(mock_emr_client, emrflow_home):
+    """An unknown grouping fails before any job run is listed"""
+    import typer
+
+    from emrflow import emr_serverless as cli
+
+    cli.global_obj_dict["emr_serverless"] = EMRServerless("application_id", "job_role")
+    with pytest.raises(typer.BadParameter):
+        cli.report(since="7d", group_by="team", refresh=True, max_workers=1)
+
+    mock_emr_client.assert_not_called()
@@ -0,0 +1,77 @@
+"""Test cases for the MultiJobTracker class"""
+
+from botocore.exceptions import ClientError
+from unit_tests.fixtures import mock_emr_client
+
+from emrflow.deployment.emr_sls import EMRServerless
+from emrflow.deployment.tracker import TRACKING_FAILED, MultiJobTracker
+
+
+def job_run_states(states):
+    """Return a get_job_run side effect walking through the states of each job"""
+    remaining = {job_run_id: list(values) for job_run_id, values in states.items()}
+
+    def get_job_run(applicationId, jobRunId):
+        values = remaining[jobRunId]
+        state = values.pop(0) if len(values) > 1 else values[0]
+        return {"jobRun": {"jobRunId": jobRunId, "state": state}}
+
+    return get_job_run
+
+
+def test_track_all_jobs(mock_emr_client):
+    """Every job is followed until it reaches a terminal state"""
+    mock_emr_client.return_value.get_job_run.side_effect = job_run_states(
+        {
+            "job1": ["PENDING", "RUNNING", "SUCCESS"],
+            "job2": ["RUNNING", "FAILED"],
+        }
+    )
+
+    emr_serverless = EMRServerless("application_id", "job_role")
+    tracker = MultiJobTracker(
+        emr_serverless, ping_duration=0, max_calls_per_second=1000
+    )
+    responses = tracker.run(["job1", "job2"])
+
+    assert responses["job1"]["state"] == "SUCCESS"
+    assert responses["job2"]["state"] == "FAILED"
+    assert mock_emr_client.return_value.get_job_run.call_count == 5
+
+
+def test_track_fail_fast(mock_emr_client):
+    """Tracking stops at the first job that does not succeed"""
+    mock_emr_client.return_value.get_job_run.side_effect = job_run_states(
+        {"job1": ["RUNNING"], "job2": ["FAILED"]}
+    )
+
+    emr_serverless = EMRServerless("application_id", "job_role")
+    tracker = MultiJobTracker(
+        emr_serverless, ping_duration=0.01, max_calls_per_second=1000, fail_fast=True
+    )
+    responses = tracker.run(["job1", "job2"])
+
+    assert responses["job1"]["state"] == "RUNNING"
+    assert responses["job2"]["state"] == "FAILED"
+
+
+def test_track_error_only_stops_that_job(mock_emr_client):
+    """A job whose status cannot be fetched does not stop tracking the others"""
+    get_job_run = job_run_states({"job1": ["RUNNING", "RUNNING", "SUCCESS"]})
+
+    def get_job_run_or_fail(applicationId, jobRunId):
+        if jobRunId == "job2":
+            raise ClientError({"Error": {"Code": "AccessDeniedException"}}, "GetJobRun")
+        return get_job_run(applicationId, jobRunId)
+
+    mock_emr_client.return_value.get_job_run.side_effect = get_job_run_or_fail
+
+    emr_serverless = EMRServerless("application_id", "job_role")
+    tracker = MultiJobTracker(
+        emr_serverless, ping_duration=0, max_calls_per_second=1000
+    )
+    responses = tracker.run(["job1", "job2"])
+
+    assert responses["job1"]["state"] == "SUCCESS"
+    assert responses["job2"]["state"] == TRACKING_FAILED
+    assert "AccessDeniedException" in responses["job2"]["stateDetails"]
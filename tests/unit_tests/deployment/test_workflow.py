@@ -0,0 +1,189 @@
+"""Test cases for running a DAG of jobs"""
+
+import json
+from unittest.mock import patch
+
+import pytest
+from unit_tests.fixtures import mock_emr_client
+
+from emrflow.deployment.emr_sls import EMRServerless
+from emrflow.deployment.workflow import (
+    UPSTREAM_FAILED,
+    WorkflowRunner,
+    critical_path_lengths,
+    sort_jobs,
+    spec_hash,
+)
+
+
+def make_jobs():
+    defaults = {
+        "s3_code_uri": "s3://bucket/code",
+        "spark_submit_parameters": "",
+        "entry_point_arguments": None,
+        "s3_logs_uri": "",
+        "execution_timeout": 0,
+        "tags": None,
+    }
+    return [
+        {
+            **defaults,
+            "job_name": "aggregate",
+            "entry_point": "aggregate.py",
+            "depends_on": ["transform"],
+        },
+        {
+            **defaults,
+            "job_name": "transform",
+            "entry_point": "transform.py",
+            "depends_on": ["ingest"],
+        },
+        {
+            **defaults,
+            "job_name": "report",
+            "entry_point": "report.py",
+            "depends_on": ["ingest"],
+        },
+        {**defaults, "job_name": "ingest", "entry_point": "ingest.py"},
+    ]
+
+
+def setup_client(mock_emr_client, final_states):
+    """Each submitted job gets the job run id of its name and ends in its final state"""
+    client = mock_emr_client.return_value
+    client.get_application.return_value = {"application": {}}
+    client.start_job_run.side_effect = lambda **kwargs: {"jobRunId": kwargs["name"]}
+    client.get_job_run.side_effect = lambda applicationId, jobRunId: {
+        "jobRun": {"jobRunId": jobRunId, "state": final_states.get(jobRunId, "SUCCESS")}
+    }
+    return client
+
+
+def test_sort_jobs():
+    """Jobs come after their upstream jobs and chains are measured"""
+    jobs = sort_jobs(make_jobs())
+
+    assert [job["job_name"] for job in jobs] == [
+        "ingest",
+        "transform",
+        "aggregate",
+        "report",
+    ]
+    assert critical_path_lengths(jobs) == {
+        "ingest": 3,
+        "transform": 2,
+        "aggregate": 1,
+        "report": 1,
+    }
+
+
+def test_sort_jobs_cycle():
+    """Circular dependencies are rejected"""
+    jobs = make_jobs()
+    jobs[3]["depends_on"] = ["aggregate"]
+
+    with pytest.raises(ValueError):
+        sort_jobs(jobs)
+
+
+def test_workflow_runs_in_dependency_order(mock_emr_client, tmp_path):
+    """Jobs are submitted once their upstream jobs succeed"""
+    client = setup_client(mock_emr_client, {})
+    state_file = tmp_path / "state.json"
+
+    runner = WorkflowRunner(
+        EMRServerless("application_id", "job_role"),
+        state_file=str(state_file),
+        max_concurrency=1,
+        ping_duration=0,
+        max_calls_per_second=1000,
+    )
+    with patch("emrflow.deployment.emr.upload_package", return_value={}):
+        state = runner.run(make_jobs())
+
+    submitted = [call.kwargs["name"] for call in client.start_job_run.call_args_list]
+    # transform is on the longest chain so it gets the only slot before report
+    assert submitted == ["ingest", "transform", "report", "aggregate"]
+    assert all(job["state"] == "SUCCESS" for job in state.values())
+    # the workflow is over, running it again starts from scratch
+    assert not state_file.exists()
+
+
+def test_workflow_skips_downstream_of_failure(mock_emr_client, tmp_path):
+    """Downstream jobs of a failed job are not submitted"""
+    client = setup_client(mock_emr_client, {"transform": "FAILED"})
+
+    runner = WorkflowRunner(
+        EMRServerless("application_id", "job_role"),
+        state_file=str(tmp_path / "state.json"),
+        ping_duration=0,
+        max_calls_per_second=1000,
+    )
+    with patch("emrflow.deployment.emr.upload_package", return_value={}):
+        state = runner.run(make_jobs())
+
+    assert state["transform"]["state"] == "FAILED"
+    assert state["aggregate"]["state"] == UPSTREAM_FAILED
+    assert state["report"]["state"] == "SUCCESS"
+    assert client.start_job_run.call_count == 3
+    saved = json.loads((tmp_path / "state.json").read_text())
+    assert saved["jobs"] == state
+    assert saved["spec_hash"] == spec_hash(sort_jobs(make_jobs()))
+
+
+def test_workflow_resumes_from_state_file(mock_emr_client, tmp_path):
+    """Succeeded jobs are skipped and running jobs are tracked, not resubmitted"""
+    client = setup_client(mock_emr_client, {})
+    state_file = tmp_path / "state.json"
+    state_file.write_text(
+        json.dumps(
+            {
+                "spec_hash": spec_hash(sort_jobs(make_jobs())),
+                "jobs": {
+                    "ingest": {"job_run_id": "ingest", "state": "SUCCESS"},
+                    "transform": {"job_run_id": "transform-1", "state": "SUBMITTED"},
+                    "report": {"job_run_id": "report", "state": "FAILED"},
+                },
+            }
+        )
+    )
+
+    runner = WorkflowRunner(
+        EMRServerless("application_id", "job_role"),
+        state_file=str(state_file),
+        ping_duration=0,
+        max_calls_per_second=1000,
+    )
+    with patch("emrflow.deployment.emr.upload_package", return_value={}):
+        state = runner.run(make_jobs())
+
+    submitted = sorted(
+        call.kwargs["name"] for call in client.start_job_run.call_args_list
+    )
+    assert submitted == ["aggregate", "report"]
+    assert state["transform"] == {"job_run_id": "transform-1", "state": "SUCCESS"}
+
+
+def test_workflow_ignores_state_of_another_spec(mock_emr_client, tmp_path):
+    """A state file saved for different job definitions does not skip any job"""
+    client = setup_client(mock_emr_client, {})
+    state_file = tmp_path / "state.json"
+    state_file.write_text(
+        json.dumps(
+            {
+                "spec_hash": "other",
+                "jobs": {"ingest": {"job_run_id": "ingest", "state": "SUCCESS"}},
+            }
+        )
+    )
+
+    runner = WorkflowRunner(
+        EMRServerless("application_id", "job_role"),
+        state_file=str(state_file),
+        ping_duration=0,
+        max_calls_per_second=1000,
+    )
+    with patch("emrflow.deployment.emr.upload_package", return_value={}):
+        runner.run(make_jobs())
+
+    assert client.start_job_run.call_count == 4
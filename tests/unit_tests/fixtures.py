@@ -1,11 +1,14 @@
+import hashlib
+import io
 from unittest.mock import Mock, mock_open, patch
 
 import pytest
+from botocore.exceptions import ClientError
 
 
 @pytest.fixture(scope="function")
 def mock_emr_client():
-    with patch("emrflow.deployment.emr.boto3.client") as mock_client:
+    with patch("emrflow.deployment.emr.get_client") as mock_client:
         yield mock_client
 
 
@@ -22,6 +25,78 @@ def mock_open():
 
 
 @pytest.fixture
-def mock_print_s3_gz():
-    with patch("emrflow.utils.print_s3_gz") as mock_print_s3_gz:
-        yield mock_print_s3_gz
+def emrflow_home(tmp_path, monkeypatch):
+    monkeypatch.setenv("EMRFLOW_HOME", str(tmp_path / ".emrflow"))
+    yield tmp_path / ".emrflow"
+
+
+@pytest.fixture
+def mock_s3_stream_client():
+    """s3 client keeping streamed objects in `objects`, keyed by (bucket, key)"""
+    client = Mock()
+    client.objects = {}
+    parts = {}
+
+    def upload_part(Bucket, Key, UploadId, PartNumber, Body):
+        parts[PartNumber] = Body
+        return {"ETag": f"etag-{PartNumber}"}
+
+    def complete_multipart_upload(Bucket, Key, UploadId, MultipartUpload):
+        client.objects[(Bucket, Key)] = b"".join(
+            parts[part["PartNumber"]] for part in MultipartUpload["Parts"]
+        )
+
+    def put_object(Bucket, Key, Body, **kwargs):
+        client.objects[(Bucket, Key)] = Body
+
+    client.create_multipart_upload.return_value = {"UploadId": "upload"}
+    client.upload_part.side_effect = upload_part
+    client.complete_multipart_upload.side_effect = complete_multipart_upload
+    client.put_object.side_effect = put_object
+    yield client
+
+
+class FakeS3Bucket:
+    """Serve several objects, listed with their ETag, honouring Range requests"""
+
+    def __init__(self, objects: dict = None):
+        self.objects = objects or {}
+        self.fetched = []
+
+    def get_paginator(self, name):
+        assert name == "list_objects_v2"
+        return self
+
+    def paginate(self, Bucket, Prefix):
+        yield {
+            "Contents": [
+                {"Key": key, "ETag": hashlib.md5(data).hexdigest()}
+                for key, data in sorted(self.objects.items())
+                if key.startswith(Prefix)
+            ]
+        }
+
+    def head_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise ClientError({"Error": {"Code": "403"}}, "HeadObject")
+        return {"ETag": hashlib.md5(self.objects[Key]).hexdigest()}
+
+    def get_object(self, Bucket, Key, Range=None):
+        self.fetched.append(Key)
+        data = self.objects[Key]
+        start = int(Range[len("bytes=") : -1]) if Range else 0
+        if Range and start >= len(data):
+            raise ClientError({"Error": {"Code": "InvalidRange"}}, "GetObject")
+        return {"Body": io.BytesIO(data[start:])}
+
+    def download_file(self, Bucket, Key, Filename):
+        self.fetched.append(Key)
+        with open(Filename, "wb") as f:
+            f.write(self.objects[Key])
+
+
+class UnlistableS3Bucket(FakeS3Bucket):
+    """Bucket without s3:ListBucket"""
+
+    def paginate(self, Bucket, Prefix):
+        raise ClientError({"Error": {"Code": "AccessDenied"}}, "ListObjectsV2")
@@ -1,4 +1,5 @@
-from unittest.mock import Mock, patch
+import time
+from unittest.mock import ANY, Mock, patch
 
 import pytest
 from unit_tests.fixtures import mock_subprocess_run
@@ -46,7 +47,7 @@ def test_build_package_with_python_package(
 
     # assert the create_packaged_dependency_src is called with the correct command
     mock_create_packaged_dependency_src.assert_called_once_with(
-        include_paths=["project_dir/**"], output_dir="output_dir"
+        include_paths=["project_dir/**"], output_dir="output_dir", cancel_event=ANY
     )
 
 
@@ -110,3 +111,144 @@ def test_build_package_with_python_package(
 #         project_dir="project_dir",
 #         exec_cmd=["exec_cmd"],
 #     )
+
+
+def test_run_stages_runs_stages_concurrently():
+    """Both stages run at the same time and the highest return code is returned"""
+    import threading
+
+    from emrflow.package.build_package import run_stages
+
+    barrier = threading.Barrier(2, timeout=5)
+
+    def stage(return_code):
+        # both stages must be running to pass the barrier
+        barrier.wait()
+        return return_code
+
+    return_code = run_stages(
+        {
+            "project": (lambda: stage(0), "dist/project.zip"),
+            "environment": (lambda: stage(1), "dist/pyspark_deps.tar.gz"),
+        },
+        threading.Event(),
+    )
+
+    assert return_code == 1
+
+
+def test_run_stages_failure_cancels_other_stages():
+    """The first failure sets the cancel event and is raised"""
+    import threading
+
+    from emrflow.package.build_package import run_stages
+
+    cancel_event = threading.Event()
+
+    def failing_stage():
+        raise RuntimeError("zip failed")
+
+    def cancellable_stage():
+        assert cancel_event.wait(timeout=5)
+        return 1
+
+    with pytest.raises(RuntimeError, match="zip failed"):
+        run_stages(
+            {
+                "project": (failing_stage, "dist/project.zip"),
+                "environment": (cancellable_stage, "dist/pyspark_deps.tar.gz"),
+            },
+            cancel_event,
+        )
+
+    assert cancel_event.is_set()
+
+
+def test_run_stages_uploads_artifacts_when_built():
+    """With a code uri, each artifact is uploaded once its stage finished"""
+    import threading
+
+    from emrflow.package.build_package import run_stages
+
+    s3_client = Mock()
+    with patch("emrflow.package.build_package.upload_package") as mock_upload:
+        return_code = run_stages(
+            {
+                "project": (lambda: 0, "dist/project.zip"),
+                "environment": (lambda: 0, "dist/pyspark_deps.tar.gz"),
+            },
+            threading.Event(),
+            s3_code_uri="s3://bucket/code",
+            s3_client=s3_client,
+        )
+
+    assert return_code == 0
+    assert sorted(call.args[2][0] for call in mock_upload.call_args_list) == [
+        "dist/project.zip",
+        "dist/pyspark_deps.tar.gz",
+    ]
+    for call in mock_upload.call_args_list:
+        assert call.args[:2] == (s3_client, "s3://bucket/code")
+
+
+def test_run_stages_serialises_uploads_and_skips_them_once_cancelled():
+    """Only one upload runs at a time, none starts once a stage failed"""
+    import threading
+
+    from emrflow.package.build_package import run_stages
+
+    cancel_event = threading.Event()
+    uploaded = []
+
+    def upload(s3_client, s3_code_uri, local_uri):
+        uploaded.extend(local_uri)
+        # the other upload waits for this one, until the environment failed
+        assert cancel_event.wait(timeout=5)
+
+    def failing_stage():
+        time.sleep(0.2)
+        raise RuntimeError("environment failed")
+
+    with patch(
+        "emrflow.package.build_package.upload_package", side_effect=upload
+    ), pytest.raises(RuntimeError, match="environment failed"):
+        run_stages(
+            {
+                "project": (lambda: 0, "dist/project.zip"),
+                "jars": (lambda: 0, "dist/jars.zip"),
+                "environment": (failing_stage, "dist/pyspark_deps.tar.gz"),
+            },
+            cancel_event,
+            s3_code_uri="s3://bucket/code",
+            s3_client=Mock(),
+        )
+
+    assert len(uploaded) == 1
+
+
+def test_build_package_rejects_env_cache_uri_without_env_cache():
+    """A remote env cache cannot be used once the env cache is disabled"""
+    from emrflow.package.build_package import build_package
+
+    with pytest.raises(Exception, match="env cache disabled"):
+        build_package(
+            "output_dir",
+            False,
+            ["project_dir"],
+            True,
+            "conda",
+            ["exec_cmd"],
+            "3.9",
+            "proxy",
+            env_cache=False,
+            env_cache_uri="s3://bucket/env-cache",
+        )
+
+
+def test_build_package_without_packages():
+    """Nothing to package is a no-op"""
+    from emrflow.package.build_package import build_package
+
+    assert (
+        build_package("output_dir", False, [], False, "conda", [], "3.9", "proxy") == 0
+    )
@@ -1,6 +1,6 @@
 from unittest.mock import Mock, call
 
-from unit_tests.fixtures import mock_open, mock_subprocess_run
+from unit_tests.fixtures import mock_open, mock_s3_stream_client, mock_subprocess_run
 
 
 def test_create_docker_env(mock_subprocess_run, mock_open):
@@ -64,9 +64,266 @@ def test_create_conda_env(mock_subprocess_run):
     conda create -n emr_runner python=3.8 -y;
     conda run -n emr_runner exec_cmd;\n
     pip install conda-pack;
-    conda pack -n emr_runner --ignore-missing-files -f -o output_dir/pyspark_deps.tar.gz;"""
+    conda pack -n emr_runner --ignore-missing-files -f --n-threads -1 --compress-level 4 -o output_dir/pyspark_deps.tar.gz;"""
 
     mock_subprocess_run.assert_called_once_with(
         ["bash", "-c", expected_conda_commnd], check=True
     )
     assert return_code == 0
+
+
+def test_create_docker_env_with_cache(mock_subprocess_run, tmp_path, monkeypatch):
+    from emrflow.package.create_env import create_docker_env
+
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "src").mkdir()
+    (tmp_path / "dist").mkdir()
+    (tmp_path / "src" / "main.py").write_text("print('main')")
+    (tmp_path / "requirements.txt").write_text("pandas==2.0.0")
+    mock_process = Mock()
+    mock_process.returncode = 0
+    mock_subprocess_run.return_value = mock_process
+
+    create_docker_env(
+        "3.9",
+        "proxy",
+        ["pip install -r requirements.txt", "pip install ."],
+        "dist",
+        ["src", "requirements.txt"],
+        cache="./.buildx-cache",
+    )
+
+    mock_subprocess_run.assert_called_with(
+        [
+            "bash",
+            "-c",
+            "docker buildx build -f dist/Dockerfile --cache-from type=local,src=./.buildx-cache --cache-to type=local,dest=./.buildx-cache,mode=max --output type=local,dest=dist .",
+        ],
+        check=True,
+    )
+    dockerfile = (tmp_path / "dist" / "Dockerfile").read_text()
+    # only the lockfile is copied before installing the libraries
+    assert dockerfile.index("COPY requirements.txt ./") < dockerfile.index(
+        "pip install -r requirements.txt"
+    )
+    assert dockerfile.index("pip install -r requirements.txt") < dockerfile.index(
+        "COPY src requirements.txt ."
+    )
+    # the project is installed once its sources are copied
+    assert dockerfile.index("COPY src requirements.txt .") < dockerfile.index(
+        "pip install .;"
+    )
+
+
+def test_create_docker_env_default_poetry_commands(
+    mock_subprocess_run, tmp_path, monkeypatch
+):
+    """The dependencies of the default commands are installed before the sources"""
+    from emrflow.package.create_env import create_docker_env
+
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "src").mkdir()
+    (tmp_path / "dist").mkdir()
+    (tmp_path / "pyproject.toml").write_text("[tool.poetry]")
+    (tmp_path / "poetry.lock").write_text("")
+    mock_process = Mock()
+    mock_process.returncode = 0
+    mock_subprocess_run.return_value = mock_process
+
+    create_docker_env(
+        "3.9",
+        "proxy",
+        ["pip install poetry==1.7.1", "poetry install"],
+        "dist",
+        ["src", "pyproject.toml", "poetry.lock"],
+    )
+
+    dockerfile = (tmp_path / "dist" / "Dockerfile").read_text()
+    copy_sources = dockerfile.index("COPY src pyproject.toml poetry.lock .")
+    assert dockerfile.index("COPY poetry.lock ./") < dockerfile.index(
+        "pip install poetry==1.7.1"
+    )
+    assert dockerfile.index("pip install poetry==1.7.1") < dockerfile.index(
+        "poetry install --no-root"
+    )
+    assert dockerfile.index("poetry install --no-root") < copy_sources
+    # the project itself is installed once its sources are copied
+    assert copy_sources < dockerfile.index("poetry install;")
+
+
+def test_docker_cache_options():
+    from emrflow.package.create_env import docker_cache_options
+
+    assert docker_cache_options("") == ""
+    assert docker_cache_options("registry.example.com/emrflow/cache") == (
+        "--cache-from type=registry,ref=registry.example.com/emrflow/cache "
+        "--cache-to type=registry,ref=registry.example.com/emrflow/cache,mode=max "
+    )
+    assert docker_cache_options("type=gha") == (
+        "--cache-from type=gha --cache-to type=gha "
+    )
+
+
+def test_create_docker_env_streamed(mock_s3_stream_client, tmp_path, monkeypatch):
+    """The archive exported by the build is streamed to S3 from the tar output"""
+    import io
+    import tarfile
+    from unittest.mock import patch
+
+    from emrflow.package.create_env import create_docker_env
+    from emrflow.utils import read_s3_pointer
+
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "dist").mkdir()
+    (tmp_path / "requirements.txt").write_text("pandas==2.0.0")
+    env_data = b"packed environment"
+    export = io.BytesIO()
+    with tarfile.open(fileobj=export, mode="w") as tar:
+        member = tarfile.TarInfo("pyspark_deps.tar.gz")
+        member.size = len(env_data)
+        tar.addfile(member, io.BytesIO(env_data))
+
+    def execute_bash_script(command, cancel_event=None, stdout_handler=None):
+        if stdout_handler:
+            assert "--output type=tar,dest=- ." in command
+            stdout_handler(io.BytesIO(export.getvalue()))
+        return 0
+
+    with patch(
+        "emrflow.package.create_env.execute_bash_script",
+        side_effect=execute_bash_script,
+    ):
+        create_docker_env(
+            "3.9",
+            "proxy",
+            ["pip install -r requirements.txt"],
+            "dist",
+            ["requirements.txt"],
+            s3_uri="s3://bucket/code/dist/pyspark_deps.tar.gz",
+            s3_client=mock_s3_stream_client,
+            keep_local=False,
+        )
+
+    assert (
+        mock_s3_stream_client.objects[("bucket", "code/dist/pyspark_deps.tar.gz")]
+        == env_data
+    )
+    assert not (tmp_path / "dist" / "pyspark_deps.tar.gz").exists()
+    assert read_s3_pointer("dist/pyspark_deps.tar.gz") == (
+        "s3://bucket/code/dist/pyspark_deps.tar.gz"
+    )
+
+
+def test_conda_pack_options():
+    import pytest
+
+    from emrflow.package.create_env import conda_pack_options
+
+    assert conda_pack_options(8, 1) == "--n-threads 8 --compress-level 1"
+    with pytest.raises(ValueError):
+        conda_pack_options(-1, 10)
+
+
+def test_prune_env_script(tmp_path):
+    """Matching files are removed and the sizes reported"""
+    import subprocess
+
+    from emrflow.package import DEFAULT_PRUNE_PATTERNS
+    from emrflow.package.create_env import prune_env_script
+
+    package_dir = tmp_path / "lib" / "python3.9" / "site-packages" / "pkg"
+    for path in [
+        package_dir / "__init__.py",
+        package_dir / "tests" / "test_pkg.py",
+        package_dir / "__pycache__" / "__init__.cpython-39.pyc",
+        tmp_path / "lib" / "libpkg.a",
+        tmp_path / "share" / "doc" / "pkg" / "README",
+        tmp_path / "share" / "pkg" / "data.json",
+    ]:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text("content")
+
+    result = subprocess.run(
+        ["bash", "-c", prune_env_script(str(tmp_path), DEFAULT_PRUNE_PATTERNS)],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+
+    assert "Pruned environment from" in result.stdout
+    assert sorted(
+        str(path.relative_to(tmp_path))
+        for path in tmp_path.rglob("*")
+        if path.is_file()
+    ) == [
+        "lib/python3.9/site-packages/pkg/__init__.py",
+        # packages named tests may be imported at runtime
+        "lib/python3.9/site-packages/pkg/tests/test_pkg.py",
+        "share/pkg/data.json",
+    ]
+
+
+def test_create_docker_env_with_prune(mock_subprocess_run, tmp_path, monkeypatch):
+    from emrflow.package.create_env import create_docker_env
+
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "dist").mkdir()
+    (tmp_path / "requirements.txt").write_text("pandas==2.0.0")
+    mock_process = Mock()
+    mock_process.returncode = 0
+    mock_subprocess_run.return_value = mock_process
+
+    create_docker_env(
+        "3.9",
+        "proxy",
+        ["pip install -r requirements.txt"],
+        "dist",
+        ["requirements.txt"],
+        prune_patterns=["tests"],
+        compile_pyc=True,
+    )
+
+    dockerfile = (tmp_path / "dist" / "Dockerfile").read_text()
+    prune = dockerfile.index("RUN PRUNE_PREFIX=/opt/conda/envs/runner-emr-env")
+    assert "-name 'tests'" in dockerfile
+    assert "compileall" in dockerfile
+    assert dockerfile.index("pip install -r requirements.txt") < prune
+    assert prune < dockerfile.index("conda pack")
+
+
+def test_prune_env_script_failure_stops_the_build(tmp_path):
+    """A failing prune step fails the conda build script despite the && list"""
+    import subprocess
+
+    from emrflow.package.create_env import prune_env_script
+
+    script = prune_env_script(str(tmp_path / "missing"), ["tests"])
+    result = subprocess.run(
+        ["bash", "-c", f"set -e\n{script} || exit 1;\necho packed"],
+        capture_output=True,
+        text=True,
+    )
+
+    assert result.returncode != 0
+    assert "packed" not in result.stdout
+
+
+def test_create_conda_env_with_prune(mock_subprocess_run):
+    from emrflow.package.create_env import create_conda_env
+
+    mock_process = Mock()
+    mock_process.returncode = 0
+    mock_subprocess_run.return_value = mock_process
+
+    create_conda_env(
+        "3.9",
+        "proxy",
+        ["exec_cmd"],
+        "output_dir",
+        ["project_dir"],
+        prune_patterns=["tests"],
+    )
+
+    script = mock_subprocess_run.call_args.args[0][2]
+    assert "-name 'tests'" in script
+    assert "|| exit 1;\n    conda pack" in script
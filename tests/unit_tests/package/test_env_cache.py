@@ -0,0 +1,217 @@
+import os
+from unittest.mock import Mock, patch
+
+import pytest
+from unit_tests.fixtures import emrflow_home
+
+from emrflow.package.env_cache import (
+    EnvCache,
+    env_fingerprint,
+    installs_project,
+    needs_sources,
+)
+from emrflow.utils import read_s3_pointer, upload_package
+
+
+@pytest.fixture
+def project_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with open("poetry.lock", "w") as lockfile:
+        lockfile.write("pandas==2.0.0")
+    with open("requirements-spark.txt", "w") as lockfile:
+        lockfile.write("pyarrow==14.0.0")
+    yield tmp_path
+
+
+def write_file(path, size):
+    with open(path, "wb") as file:
+        file.write(b"0" * size)
+
+
+def test_env_fingerprint(project_dir):
+    """The fingerprint changes with the python version, commands and lockfiles"""
+    exec_cmd = ["poetry install", "pip install -r requirements-spark.txt"]
+    fingerprint = env_fingerprint("conda", "3.9", exec_cmd, ["src"])
+
+    assert fingerprint == env_fingerprint("conda", "3.9", exec_cmd, ["src"])
+    assert fingerprint != env_fingerprint("conda", "3.10", exec_cmd, ["src"])
+    assert fingerprint != env_fingerprint("docker", "3.9", exec_cmd, ["src"])
+    assert fingerprint != env_fingerprint(
+        "conda", "3.9", exec_cmd, ["src"], compress_level=1
+    )
+    assert fingerprint != env_fingerprint(
+        "conda", "3.9", exec_cmd, ["src"], prune_patterns=["tests"]
+    )
+
+    with open("requirements-spark.txt", "w") as lockfile:
+        lockfile.write("pyarrow==15.0.0")
+    assert fingerprint != env_fingerprint("conda", "3.9", exec_cmd, ["src"])
+
+
+def test_installs_project(project_dir):
+    """Commands installing the project itself need its sources"""
+    os.makedirs("libs/shared")
+    assert installs_project("poetry install")
+    assert not installs_project("poetry install --no-root")
+    assert installs_project("pip install -e .")
+    assert installs_project("pip install libs/shared")
+    assert not installs_project("pip install poetry==1.7.1")
+    assert not needs_sources(
+        "pip install -r requirements-spark.txt", ["requirements-spark.txt"]
+    )
+    assert needs_sources("pip install -r requirements-spark.txt", [])
+
+
+def test_env_fingerprint_follows_installed_project(project_dir):
+    """Sources installed in the environment are part of the fingerprint"""
+    os.makedirs("src/__pycache__")
+    os.makedirs("dist")
+    with open("src/main.py", "w") as source:
+        source.write("print('main')")
+    fingerprint = env_fingerprint(
+        "conda", "3.9", ["poetry install"], ["."], skip_dirs=["dist"]
+    )
+    no_root = env_fingerprint("conda", "3.9", ["poetry install --no-root"], ["."])
+
+    # build outputs and excluded files do not change it
+    write_file("dist/pyspark_deps.tar.gz", 10)
+    write_file("src/__pycache__/main.cpython-39.pyc", 10)
+    assert fingerprint == env_fingerprint(
+        "conda", "3.9", ["poetry install"], ["."], skip_dirs=["dist"]
+    )
+
+    with open("src/main.py", "w") as source:
+        source.write("print('changed')")
+    assert fingerprint != env_fingerprint(
+        "conda", "3.9", ["poetry install"], ["."], skip_dirs=["dist"]
+    )
+    assert no_root == env_fingerprint(
+        "conda", "3.9", ["poetry install --no-root"], ["."]
+    )
+
+
+def test_env_cache_get_put(tmp_path):
+    """A cached archive is hardlinked to the destination"""
+    cache = EnvCache(str(tmp_path / "cache"))
+    write_file(tmp_path / "built.tar.gz", 10)
+
+    assert not cache.get("abc", str(tmp_path / "dist" / "pyspark_deps.tar.gz"))
+    cache.put("abc", str(tmp_path / "built.tar.gz"))
+    assert cache.get("abc", str(tmp_path / "dist" / "pyspark_deps.tar.gz"))
+
+    assert os.path.samefile(
+        tmp_path / "dist" / "pyspark_deps.tar.gz", cache.path("abc")
+    )
+
+
+def test_env_cache_eviction(tmp_path):
+    """Least recently used entries are evicted beyond the count and size limits"""
+    cache = EnvCache(str(tmp_path / "cache"), max_entries=2, max_size_gb=25 / 1024**3)
+    for index, fingerprint in enumerate(["a", "b", "c"]):
+        write_file(tmp_path / "built.tar.gz", 10)
+        cache.put(fingerprint, str(tmp_path / "built.tar.gz"))
+        os.utime(os.path.dirname(cache.path(fingerprint)), (index, index))
+    assert [entry["fingerprint"] for entry in cache.entries()] == ["c", "b"]
+
+    # using "b" makes "c" the least recently used entry
+    cache.get("b", str(tmp_path / "pyspark_deps.tar.gz"))
+    write_file(tmp_path / "built.tar.gz", 10)
+    cache.put("d", str(tmp_path / "built.tar.gz"))
+
+    assert [entry["fingerprint"] for entry in cache.entries()] == ["d", "b"]
+
+
+def test_build_package_uses_env_cache(project_dir, emrflow_home):
+    """A second build with the same lockfiles skips building the environment"""
+    from emrflow.package.build_package import build_package
+
+    def create_conda_env(output_dir, **kwargs):
+        os.makedirs(output_dir, exist_ok=True)
+        write_file(os.path.join(output_dir, "pyspark_deps.tar.gz"), 10)
+        return 0
+
+    with patch(
+        "emrflow.package.build_package.create_conda_env", side_effect=create_conda_env
+    ) as mock_create_conda_env:
+        for _ in range(2):
+            build_package(
+                "dist", False, ["src"], True, "conda", ["poetry install"], 3.9, ""
+            )
+
+    mock_create_conda_env.assert_called_once()
+    assert os.path.isfile("dist/pyspark_deps.tar.gz")
+
+
+def test_build_package_uses_remote_env_cache(project_dir, emrflow_home):
+    """An environment published in S3 is referenced without building or downloading it"""
+    from emrflow.package.build_package import build_package
+
+    with patch(
+        "emrflow.package.build_package.create_conda_env"
+    ) as mock_create_conda_env, patch(
+        "emrflow.package.env_cache.s3_object_digest", return_value="digest"
+    ):
+        build_package(
+            "dist",
+            False,
+            ["src"],
+            True,
+            "conda",
+            ["poetry install"],
+            3.9,
+            "",
+            env_cache_uri="s3://bucket/env-cache/",
+        )
+
+    mock_create_conda_env.assert_not_called()
+    assert not os.path.exists("dist/pyspark_deps.tar.gz")
+    fingerprint = env_fingerprint("conda", "3.9", ["poetry install"], ["src"])
+    assert read_s3_pointer("dist/pyspark_deps.tar.gz") == (
+        f"s3://bucket/env-cache/{fingerprint}/pyspark_deps.tar.gz"
+    )
+
+    # run references the published archive instead of uploading it
+    with patch("emrflow.utils.PrettyUploader") as mock_uploader:
+        src_dest_uri = upload_package(
+            Mock(), "s3://bucket/code", ["dist/pyspark_deps.tar.gz"]
+        )
+    assert src_dest_uri == {
+        "dist/pyspark_deps.tar.gz": read_s3_pointer("dist/pyspark_deps.tar.gz")
+    }
+    mock_uploader.assert_not_called()
+
+
+def test_build_package_publishes_to_remote_env_cache(project_dir, emrflow_home):
+    """A fresh build is published to the remote cache"""
+    from emrflow.package.build_package import build_package
+
+    def create_conda_env(output_dir, **kwargs):
+        os.makedirs(output_dir, exist_ok=True)
+        write_file(os.path.join(output_dir, "pyspark_deps.tar.gz"), 10)
+        return 0
+
+    with patch(
+        "emrflow.package.build_package.create_conda_env", side_effect=create_conda_env
+    ), patch("emrflow.package.env_cache.s3_object_digest", return_value=None), patch(
+        "emrflow.package.env_cache.PrettyUploader"
+    ) as mock_uploader:
+        build_package(
+            "dist",
+            False,
+            ["src"],
+            True,
+            "conda",
+            ["poetry install"],
+            3.9,
+            "",
+            env_cache_uri="s3://bucket/env-cache",
+        )
+
+    fingerprint = env_fingerprint("conda", "3.9", ["poetry install"], ["src"])
+    assert mock_uploader.call_args.args[1:3] == (
+        "bucket",
+        {"dist/pyspark_deps.tar.gz": f"env-cache/{fingerprint}/pyspark_deps.tar.gz"},
+    )
+    assert read_s3_pointer("dist/pyspark_deps.tar.gz").endswith(
+        f"{fingerprint}/pyspark_deps.tar.gz"
+    )
@@ -1,49 +1,215 @@
-import unittest
-from unittest.mock import Mock
+import hashlib
+import os
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
 
-from unit_tests.fixtures import mock_subprocess_run
+import pytest
+from unit_tests.fixtures import mock_s3_stream_client
 
+from emrflow.package.project_dependency_src import (
+    ExcludeRules,
+    compress_in_order,
+    create_packaged_dependency_src,
+)
 
-def test_create_packaged_dependency_src(mock_subprocess_run):
-    from emrflow.package.project_dependency_src import create_packaged_dependency_src
 
-    mock_process = Mock()
-    mock_process.returncode = 0
-    mock_subprocess_run.return_value = mock_process
+@pytest.fixture
+def project_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for path, content in {
+        "data_pipeline/__init__.py": "",
+        "data_pipeline/jobs/ingest.py": "print('ingest')",
+        "data_pipeline/conf/logging.yaml": "version: 1",
+        "data_pipeline/__pycache__/ingest.cpython-39.pyc": "",
+        "data_pipeline/.git/HEAD": "ref",
+        "data_pipeline/notes.tmp": "tmp",
+    }.items():
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as file:
+            file.write(content)
+    yield tmp_path
 
-    # call the create_packaged_dependency_src function with the correct arguments
+
+def archive_sha256(path):
+    with open(path, "rb") as archive:
+        return hashlib.sha256(archive.read()).hexdigest()
+
+
+def test_create_packaged_dependency_src(project_dir):
+    """Wildcards are expanded and default excludes applied"""
     return_code = create_packaged_dependency_src(
+        "output_dir", ["data_pipeline/**"], exclude_patterns=["*.tmp"]
+    )
+
+    assert return_code == 0
+    with zipfile.ZipFile("output_dir/project-dependency-src.zip") as archive:
+        assert archive.testzip() is None
+        assert archive.namelist() == [
+            "data_pipeline/__init__.py",
+            "data_pipeline/conf/logging.yaml",
+            "data_pipeline/jobs/ingest.py",
+        ]
+        assert archive.read("data_pipeline/jobs/ingest.py") == b"print('ingest')"
+
+
+def test_create_packaged_dependency_src_is_deterministic(project_dir):
+    """The same sources give the same archive, whatever their mtime"""
+    create_packaged_dependency_src("output_dir", ["data_pipeline"], max_workers=1)
+    first = archive_sha256("output_dir/project-dependency-src.zip")
+
+    os.utime("data_pipeline/jobs/ingest.py", (0, 0))
+    create_packaged_dependency_src("output_dir", ["data_pipeline"], max_workers=4)
+
+    assert archive_sha256("output_dir/project-dependency-src.zip") == first
+
+
+def test_create_packaged_dependency_src_missing_path(project_dir):
+    """Missing include paths fail the packaging"""
+    with pytest.raises(Exception, match="does not exist"):
+        create_packaged_dependency_src("output_dir", ["src/**"])
+
+
+def test_exclude_rules():
+    """Patterns follow gitignore semantics"""
+    rules = ExcludeRules(["build/", "/docs", "**/tests/*.py", "*.log", "!keep.log"])
+
+    assert rules.excluded("build", is_dir=True)
+    assert not rules.excluded("build", is_dir=False)
+    assert rules.excluded("docs", is_dir=True)
+    assert not rules.excluded("src/docs", is_dir=True)
+    assert rules.excluded("src/tests/test_a.py", is_dir=False)
+    assert rules.excluded("tests/test_a.py", is_dir=False)
+    assert rules.excluded("src/debug.log", is_dir=False)
+    assert not rules.excluded("src/keep.log", is_dir=False)
+
+
+def test_create_packaged_dependency_src_incremental(project_dir):
+    """Only changed files are compressed again, giving the same archive as a full build"""
+    from emrflow.package import project_dependency_src
+
+    create_packaged_dependency_src("output_dir", ["data_pipeline"])
+    with open("data_pipeline/jobs/ingest.py", "w") as file:
+        file.write("print('ingest v2')")
+
+    with patch.object(
+        project_dependency_src,
+        "compress_file",
+        wraps=project_dependency_src.compress_file,
+    ) as mock_compress_file:
+        create_packaged_dependency_src("output_dir", ["data_pipeline"])
+        assert [call.args[0] for call in mock_compress_file.call_args_list] == [
+            "data_pipeline/jobs/ingest.py"
+        ]
+        incremental = archive_sha256("output_dir/project-dependency-src.zip")
+
+        # nothing changed, the archive is left as is
+        mock_compress_file.reset_mock()
+        create_packaged_dependency_src("output_dir", ["data_pipeline"])
+        mock_compress_file.assert_not_called()
+
+    with zipfile.ZipFile("output_dir/project-dependency-src.zip") as archive:
+        assert archive.testzip() is None
+        assert archive.read("data_pipeline/jobs/ingest.py") == b"print('ingest v2')"
+
+    create_packaged_dependency_src("output_dir", ["data_pipeline"], incremental=False)
+    assert archive_sha256("output_dir/project-dependency-src.zip") == incremental
+
+
+def test_create_packaged_dependency_src_rebuilds_modified_archive(project_dir):
+    """An archive modified outside of emrflow is fully rebuilt"""
+    create_packaged_dependency_src("output_dir", ["data_pipeline"])
+    expected = archive_sha256("output_dir/project-dependency-src.zip")
+    with open("output_dir/project-dependency-src.zip", "wb") as archive:
+        archive.write(b"corrupted")
+
+    create_packaged_dependency_src("output_dir", ["data_pipeline"])
+
+    assert archive_sha256("output_dir/project-dependency-src.zip") == expected
+
+
+def test_create_packaged_dependency_src_streamed(project_dir, mock_s3_stream_client):
+    """The streamed archive is a valid zip, matching the local copy"""
+    from emrflow.utils import read_s3_pointer
+
+    create_packaged_dependency_src(
         "output_dir",
-        ["data_pipeline/**"],
+        ["data_pipeline"],
+        s3_uri="s3://bucket/code/output_dir/project-dependency-src.zip",
+        s3_client=mock_s3_stream_client,
     )
-    # assert the execute_bash_script is called with the correct command
 
-    expected_packaged_src_command = f"""
+    data = mock_s3_stream_client.objects[
+        ("bucket", "code/output_dir/project-dependency-src.zip")
+    ]
+    with open("output_dir/project-dependency-src.zip", "rb") as archive:
+        assert archive.read() == data
+    with zipfile.ZipFile("output_dir/project-dependency-src.zip") as archive:
+        assert archive.testzip() is None
+        assert archive.read("data_pipeline/jobs/ingest.py") == b"print('ingest')"
+    assert read_s3_pointer("output_dir/project-dependency-src.zip") == (
+        "s3://bucket/code/output_dir/project-dependency-src.zip"
+    )
 
-    mkdir -p output_dir;
+    # a regular build no longer points to the streamed archive
+    with open("data_pipeline/jobs/ingest.py", "w") as file:
+        file.write("print('changed')")
+    create_packaged_dependency_src("output_dir", ["data_pipeline"])
+    assert read_s3_pointer("output_dir/project-dependency-src.zip") is None
 
-    rm -f output_dir/project-dependency-src.zip
 
-    # Add directories and files to the zip
-    for path in data_pipeline/**; do
-        if [ -e "$path" ]; then
-            continue
-        else
-            echo "Path: '$path' does not exist. Please check the path and try again!"
-            exit 1
-        fi
-    done
+def test_create_packaged_dependency_src_streamed_without_local_copy(
+    project_dir, mock_s3_stream_client
+):
+    """Without a local copy, only the pointer to S3 is left"""
+    create_packaged_dependency_src(
+        "output_dir",
+        ["data_pipeline"],
+        s3_uri="s3://bucket/project-dependency-src.zip",
+        s3_client=mock_s3_stream_client,
+        keep_local=False,
+    )
 
-    zip -r  output_dir/project-dependency-src.zip data_pipeline/** \
-        -x "*.git/**"  \
-        -x "*.github/**"  \
-        -x "*.vscode/**" \
-        -x "*__pycache__*"
+    assert sorted(os.listdir("output_dir")) == ["project-dependency-src.zip.s3uri"]
+    assert ("bucket", "project-dependency-src.zip") in mock_s3_stream_client.objects
 
-    echo "output_dir/project-dependency-src.zip created successfully!!"
-    """
 
-    assert return_code == 0
-    mock_subprocess_run.assert_called_once_with(
-        ["bash", "-c", expected_packaged_src_command], check=True
+def test_create_packaged_dependency_src_cancelled(project_dir, mock_s3_stream_client):
+    """A cancelled archive aborts its streamed upload and leaves no archive"""
+    import threading
+
+    cancel_event = threading.Event()
+    cancel_event.set()
+
+    return_code = create_packaged_dependency_src(
+        "output_dir",
+        ["data_pipeline"],
+        s3_uri="s3://bucket/project-dependency-src.zip",
+        s3_client=mock_s3_stream_client,
+        cancel_event=cancel_event,
     )
+
+    assert return_code == 1
+    assert mock_s3_stream_client.objects == {}
+    assert os.listdir("output_dir") == []
+
+
+def test_compress_in_order_bounds_pending_files(project_dir):
+    """Files are compressed at most `window` ahead of the one being written"""
+    paths = [f"data_pipeline/file_{i}.py" for i in range(10)]
+    for i, path in enumerate(paths):
+        with open(path, "w") as f:
+            f.write(f"print({i})")
+
+    with ThreadPoolExecutor(max_workers=2) as executor, patch.object(
+        executor, "submit", wraps=executor.submit
+    ) as submit:
+        compressed = compress_in_order(executor, paths, 6, window=3)
+        results = []
+        for written in range(len(paths)):
+            results.append(next(compressed))
+            assert submit.call_count <= written + 1 + 3
+
+    assert [digest for _, _, _, digest in results] == [
+        hashlib.sha256(f"print({i})".encode()).hexdigest() for i in range(10)
+    ]
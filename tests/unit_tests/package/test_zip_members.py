@@ -0,0 +1,78 @@
+"""zip_members touches private zipfile state, check it on every supported python"""
+
+import glob
+import os
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+# oldest and newest python supported by the package
+SUPPORTED_PYTHONS = ["3.8", "3.13"]
+
+CHECK_SCRIPT = """
+import sys, zipfile, zlib
+from emrflow.package.zip_members import (
+    read_raw_member, write_raw_member, write_streamed_member,
+)
+
+raw, streamed, archive_path = sys.argv[1:]
+content = b"emrflow " * 4096
+
+
+def deflate(data, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush()
+
+
+with open(streamed, "wb") as f:
+    f.write(content)
+with zipfile.ZipFile(archive_path, "w", zipfile.ZIP_DEFLATED) as archive:
+    zinfo = zipfile.ZipInfo(raw, (1980, 1, 1, 0, 0, 0))
+    zinfo.compress_type = zipfile.ZIP_DEFLATED
+    write_raw_member(
+        archive, zinfo, zlib.crc32(content), len(content), deflate(content, 9)
+    )
+    zinfo = zipfile.ZipInfo(streamed, (1980, 1, 1, 0, 0, 0))
+    zinfo.compress_type = zipfile.ZIP_DEFLATED
+    write_streamed_member(archive, zinfo, streamed, 1)
+    archive.writestr("after.txt", b"written after the raw members")
+
+with zipfile.ZipFile(archive_path) as archive, open(archive_path, "rb") as f:
+    assert archive.testzip() is None
+    assert archive.namelist() == [raw, streamed, "after.txt"]
+    assert archive.read(raw) == content
+    assert archive.read(streamed) == content
+    assert read_raw_member(f, archive.getinfo(raw)) == deflate(content, 9)
+    assert read_raw_member(f, archive.getinfo(streamed)) == deflate(content, 1)
+"""
+
+
+def find_python(version: str):
+    """Interpreter of the given version that actually runs, None if missing"""
+    candidates = [shutil.which(f"python{version}")] + sorted(
+        glob.glob(os.path.expanduser(f"~/.pyenv/versions/{version}.*/bin/python"))
+    )
+    for candidate in filter(None, candidates):
+        result = subprocess.run([candidate, "-c", "pass"], capture_output=True)
+        if result.returncode == 0:
+            return candidate
+    return None
+
+
+@pytest.mark.parametrize("version", ["current"] + SUPPORTED_PYTHONS)
+def test_zip_members(version, tmp_path):
+    python = sys.executable if version == "current" else find_python(version)
+    if python is None:
+        pytest.skip(f"python {version} is not installed")
+
+    result = subprocess.run(
+        [python, "-c", CHECK_SCRIPT, "raw.txt", "streamed.txt", "archive.zip"],
+        cwd=tmp_path,
+        env={**os.environ, "PYTHONPATH": str(Path(__file__).parents[3])},
+        capture_output=True,
+        text=True,
+    )
+    assert result.returncode == 0, result.stderr
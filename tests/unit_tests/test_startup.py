@@ -0,0 +1,101 @@
+"""Guard the startup time of the CLI"""
+
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+from unit_tests.fixtures import mock_emr_client
+
+from emrflow.deployment.emr_sls import EMRServerless
+
+# modules only needed by the commands calling AWS or building packages
+LAZY_MODULES = [
+    "boto3",
+    "botocore",
+    "s3transfer",
+    "rich.progress",
+    "emrflow.deployment.batch",
+    "emrflow.deployment.workflow",
+    "emrflow.package.build_package",
+    "emrflow.package.create_env",
+    "emrflow.package.env_cache",
+]
+
+
+def imported_modules(statement: str):
+    """Modules imported by a fresh interpreter, with their cumulative time in us"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        cwd=Path(__file__).parents[2],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit():
+            modules[name.strip()] = int(cumulative)
+    return modules
+
+
+def test_cli_import_is_lazy():
+    """Importing the CLI does not load AWS or packaging modules"""
+    modules = imported_modules("import emrflow.main")
+
+    assert "emrflow.main" in modules
+    loaded = [name for name in LAZY_MODULES if name in modules]
+    assert loaded == []
+
+
+def test_cli_command_help_is_lazy(tmp_path):
+    """The connection callback and the help of a command do not load them either"""
+    config_path = tmp_path / "config.json"
+    config_path.write_text(
+        json.dumps({"application_id": "app", "job_role": "role", "region": "us-east-1"})
+    )
+    args = [
+        "serverless",
+        "--config-path",
+        str(config_path),
+        "package-dependencies",
+        "--help",
+    ]
+    script = f"""
+import sys
+from typer.testing import CliRunner
+from emrflow.main import app
+result = CliRunner().invoke(app, {args!r})
+assert result.exit_code == 0, result.output
+assert "Connection established" in result.output
+print("\\n".join(sys.modules))
+"""
+    result = subprocess.run(
+        [sys.executable, "-c", script],
+        cwd=Path(__file__).parents[2],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    modules = set(result.stdout.splitlines())
+    loaded = [
+        name
+        for name in LAZY_MODULES + ["emrflow.deployment.metrics", "sqlite3"]
+        if name in modules
+    ]
+    assert loaded == []
+
+
+def test_clients_are_created_on_first_use(mock_emr_client):
+    """Building the deployment does not create boto3 clients"""
+    emr_serverless = EMRServerless("application_id", "job_role", "us-east-1")
+    mock_emr_client.assert_not_called()
+
+    emr_serverless.get_job_run("job_run_id")
+    mock_emr_client.assert_called_once_with(
+        "emr-serverless", region="us-east-1", profile=""
+    )
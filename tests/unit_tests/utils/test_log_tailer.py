@@ -0,0 +1,64 @@
+"""Test cases for incremental tailing of gzip logs on S3"""
+
+import gzip
+import io
+
+from botocore.exceptions import ClientError
+
+from emrflow.utils import S3GzipLogTailer
+
+
+class FakeS3Client:
+    """Serve a single object and honour the Range header of get_object"""
+
+    def __init__(self, data: bytes = b""):
+        self.data = data
+        self.requested_ranges = []
+
+    def get_object(self, Bucket, Key, Range=None):
+        self.requested_ranges.append(Range)
+        if Range is None:
+            return {"Body": io.BytesIO(self.data)}
+        start = int(Range[len("bytes=") : -1])
+        if start >= len(self.data):
+            raise ClientError({"Error": {"Code": "InvalidRange"}}, "GetObject")
+        return {"Body": io.BytesIO(self.data[start:])}
+
+
+def test_tailer_reads_only_appended_bytes():
+    """Each poll only requests bytes after the already consumed offset"""
+    logs = "".join(f"line {i}\n" for i in range(100))
+    first = gzip.compress(logs.encode())
+    client = FakeS3Client(first)
+    tailer = S3GzipLogTailer(client, "s3://bucket/logs/stdout.gz")
+
+    assert tailer.read() == logs
+    assert tailer.position == len(logs)
+
+    client.data = first + gzip.compress(b"last line\n")
+    assert tailer.read() == "last line\n"
+    assert client.requested_ranges[-1] == f"bytes={len(first) - 64}-"
+
+    assert tailer.read() == ""
+    assert tailer.position == len(logs) + 10
+
+
+def test_tailer_replays_rewritten_object_without_repeating():
+    """A rewritten object is re-read from the start, skipping already shown logs"""
+    client = FakeS3Client(gzip.compress(b"hello\n", mtime=0))
+    tailer = S3GzipLogTailer(client, "s3://bucket/logs/stdout.gz")
+    assert tailer.read() == "hello\n"
+
+    client.data = gzip.compress(b"hello\nworld\n", mtime=0)
+    assert tailer.read() == "world\n"
+    assert tailer.position == 12
+
+
+def test_tailer_handles_rotated_object():
+    """A log that shrinks below the consumed offset is read again from the start"""
+    client = FakeS3Client(gzip.compress(b"a" * 1000 + b"\n"))
+    tailer = S3GzipLogTailer(client, "s3://bucket/logs/stdout.gz")
+    tailer.read()
+
+    client.data = b""
+    assert tailer.read() == ""
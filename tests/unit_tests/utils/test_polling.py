@@ -0,0 +1,48 @@
+"""Test cases for the adaptive polling of job runs"""
+
+from botocore.exceptions import ClientError
+
+from emrflow.utils import AdaptivePoller, is_throttling_error
+
+
+def test_poller_backs_off_until_state_changes():
+    """Delays grow while the state is unchanged and reset on transitions"""
+    poller = AdaptivePoller(max_interval=30, min_interval=2, jitter=0)
+
+    assert poller.next_delay(state_changed=True) == 2
+    assert poller.next_delay(state_changed=False) == 4
+    assert poller.next_delay(state_changed=False) == 8
+    assert poller.next_delay(state_changed=False) == 16
+    assert poller.next_delay(state_changed=False) == 30
+    assert poller.next_delay(state_changed=False) == 30
+    assert poller.next_delay(state_changed=True) == 2
+
+
+def test_poller_jitter_stays_within_bounds():
+    """Jittered delays never exceed the current delay"""
+    poller = AdaptivePoller(max_interval=30, min_interval=2, jitter=0.5)
+
+    assert 1 <= poller.next_delay(state_changed=True) <= 2
+    for _ in range(5):
+        poller.next_delay(state_changed=False)
+    for _ in range(20):
+        assert 15 <= poller.next_delay(state_changed=False) <= 30
+
+
+def test_poller_throttled_exceeds_max_interval():
+    """Throttling backs off beyond the normal maximum"""
+    poller = AdaptivePoller(max_interval=10, min_interval=2, jitter=0)
+
+    delays = [poller.throttled() for _ in range(6)]
+
+    assert delays == [4, 8, 16, 32, 40, 40]
+
+
+def test_is_throttling_error():
+    """Only throttling error codes are detected"""
+    throttled = ClientError({"Error": {"Code": "ThrottlingException"}}, "GetJobRun")
+    denied = ClientError({"Error": {"Code": "AccessDeniedException"}}, "GetJobRun")
+
+    assert is_throttling_error(throttled)
+    assert not is_throttling_error(denied)
+    assert not is_throttling_error(ValueError())
@@ -0,0 +1,248 @@
+"""Test cases for uploading artifacts to S3"""
+
+import hashlib
+import json
+import os
+from unittest.mock import Mock, patch
+
+import pytest
+from botocore.exceptions import ClientError
+from unit_tests.fixtures import emrflow_home, mock_s3_stream_client
+
+from emrflow.utils import (
+    DIGEST_METADATA_KEY,
+    MB,
+    FileDigestCache,
+    PrettyUploader,
+    file_sha256,
+    upload_package,
+)
+
+
+def test_pretty_uploader_uploads_in_parallel(tmp_path):
+    """Every file is uploaded with the configured multipart settings"""
+    src_target = {}
+    for name in ["a.zip", "b.tar.gz", "c.py"]:
+        path = tmp_path / name
+        path.write_bytes(b"x" * 10)
+        src_target[str(path)] = f"code/{name}"
+
+    s3_client = Mock()
+    s3_client.upload_file.side_effect = lambda src, bucket, key, **kwargs: kwargs[
+        "Callback"
+    ](10)
+
+    uploader = PrettyUploader(
+        s3_client, "bucket", src_target, concurrency=3, multipart_chunk_size=16
+    )
+    uploader.run()
+
+    assert s3_client.upload_file.call_count == 3
+    config = s3_client.upload_file.call_args.kwargs["Config"]
+    assert config.multipart_chunksize == 16 * MB
+    assert config.max_concurrency == 3
+    assert uploader._seensize == 30
+
+
+def test_upload_package_excludes(tmp_path, monkeypatch, emrflow_home):
+    """Excluded paths are mapped to S3 but not uploaded"""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "main.py").write_text("print('hello')")
+
+    s3_client = Mock()
+    result = upload_package(
+        s3_client,
+        "s3://bucket/code",
+        ["main.py", "dist/pyspark_deps.tar.gz"],
+        ["dist/pyspark_deps.tar.gz"],
+    )
+
+    assert result == {
+        "main.py": "s3://bucket/code/main.py",
+        "dist/pyspark_deps.tar.gz": "s3://bucket/code/dist/pyspark_deps.tar.gz",
+    }
+    s3_client.upload_file.assert_called_once()
+    assert s3_client.upload_file.call_args.args[:3] == (
+        "main.py",
+        "bucket",
+        "code/main.py",
+    )
+
+
+def test_upload_package_skips_unchanged(tmp_path, monkeypatch, emrflow_home):
+    """Artifacts whose digest matches the S3 object metadata are not uploaded"""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "main.py").write_text("print('hello')")
+    (tmp_path / "deps.zip").write_bytes(b"zip")
+
+    s3_client = Mock()
+    s3_client.head_object.side_effect = lambda Bucket, Key: (
+        {"Metadata": {DIGEST_METADATA_KEY: file_sha256("deps.zip")}}
+        if Key == "code/deps.zip"
+        else {}
+    )
+
+    upload_package(s3_client, "s3://bucket/code", ["main.py", "deps.zip"])
+
+    s3_client.upload_file.assert_called_once()
+    assert s3_client.upload_file.call_args.args[0] == "main.py"
+    assert s3_client.upload_file.call_args.kwargs["ExtraArgs"] == {
+        "Metadata": {DIGEST_METADATA_KEY: file_sha256("main.py")}
+    }
+
+
+def test_upload_package_missing_object(tmp_path, monkeypatch, emrflow_home):
+    """Artifacts missing from S3 are uploaded"""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "main.py").write_text("print('hello')")
+
+    s3_client = Mock()
+    s3_client.head_object.side_effect = ClientError(
+        {"Error": {"Code": "404"}}, "HeadObject"
+    )
+
+    upload_package(s3_client, "s3://bucket/code", ["main.py"])
+
+    s3_client.upload_file.assert_called_once()
+
+
+def test_file_digest_cache(tmp_path):
+    """Digests are only recomputed when the file size or mtime changes"""
+    artifact = tmp_path / "deps.tar.gz"
+    artifact.write_bytes(b"deps")
+    cache_path = str(tmp_path / "digests.json")
+
+    cache = FileDigestCache(cache_path)
+    digest = cache.digest(str(artifact))
+    cache.save()
+
+    with patch("emrflow.utils.file_sha256") as mock_sha256:
+        assert FileDigestCache(cache_path).digest(str(artifact)) == digest
+        mock_sha256.assert_not_called()
+
+    artifact.write_bytes(b"new deps")
+    assert FileDigestCache(cache_path).digest(str(artifact)) != digest
+
+
+def test_file_digest_cache_prunes_missing_files(tmp_path):
+    """Entries of deleted or renamed files are dropped when the cache is saved"""
+    kept, removed = tmp_path / "kept.zip", tmp_path / "removed.zip"
+    kept.write_bytes(b"kept")
+    removed.write_bytes(b"removed")
+    cache_path = str(tmp_path / "digests.json")
+
+    cache = FileDigestCache(cache_path)
+    cache.digest(str(kept))
+    cache.digest(str(removed))
+    cache.save()
+
+    removed.rename(tmp_path / "renamed.zip")
+    FileDigestCache(cache_path).save()
+
+    with open(cache_path) as cache_file:
+        assert list(json.load(cache_file)) == [str(kept)]
+
+
+def test_upload_package_content_addressed(tmp_path, monkeypatch, emrflow_home):
+    """Artifacts are stored under their digest and the mapping points there"""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "dist").mkdir()
+    (tmp_path / "dist" / "deps.zip").write_bytes(b"zip")
+    digest = file_sha256("dist/deps.zip")
+
+    s3_client = Mock()
+    s3_client.head_object.return_value = {}
+
+    result = upload_package(
+        s3_client, "s3://bucket/code", ["dist/deps.zip"], content_addressed=True
+    )
+
+    assert result == {"dist/deps.zip": f"s3://bucket/code/cas/{digest}/deps.zip"}
+    s3_client.head_object.assert_called_once_with(
+        Bucket="bucket", Key=f"code/cas/{digest}/deps.zip"
+    )
+    assert s3_client.upload_file.call_args.args[2] == f"code/cas/{digest}/deps.zip"
+
+
+def test_execute_bash_script_cancelled():
+    """A cancelled script is terminated with its process group"""
+    import threading
+    import time
+
+    from emrflow.utils import execute_bash_script
+
+    cancel_event = threading.Event()
+    threading.Timer(0.2, cancel_event.set).start()
+
+    start = time.monotonic()
+    return_code = execute_bash_script("sleep 30", cancel_event=cancel_event)
+
+    assert return_code == 1
+    assert time.monotonic() - start < 10
+
+
+def test_s3_stream_writer_multipart(mock_s3_stream_client, tmp_path):
+    """Streamed data is sent in parts, copied locally and its digest recorded"""
+    from emrflow.utils import S3StreamWriter
+
+    data = os.urandom(12 * MB)
+    local_path = str(tmp_path / "archive.zip")
+    with S3StreamWriter(
+        mock_s3_stream_client,
+        "s3://bucket/code/archive.zip",
+        local_path=local_path,
+        multipart_chunk_size=5,
+    ) as writer:
+        for start in range(0, len(data), MB):
+            writer.write(data[start : start + MB])
+        assert writer.tell() == len(data)
+
+    assert mock_s3_stream_client.objects[("bucket", "code/archive.zip")] == data
+    assert mock_s3_stream_client.upload_part.call_count == 3
+    assert writer.digest == hashlib.sha256(data).hexdigest()
+    assert file_sha256(local_path) == writer.digest
+    mock_s3_stream_client.copy.assert_called_once_with(
+        {"Bucket": "bucket", "Key": "code/archive.zip"},
+        "bucket",
+        "code/archive.zip",
+        ExtraArgs={
+            "Metadata": {DIGEST_METADATA_KEY: writer.digest},
+            "MetadataDirective": "REPLACE",
+        },
+    )
+
+
+def test_s3_stream_writer_small_stream(mock_s3_stream_client):
+    """A stream smaller than a part is sent with a single request"""
+    from emrflow.utils import S3StreamWriter
+
+    with S3StreamWriter(mock_s3_stream_client, "s3://bucket/small.zip") as writer:
+        writer.write(b"small")
+
+    assert mock_s3_stream_client.objects[("bucket", "small.zip")] == b"small"
+    mock_s3_stream_client.create_multipart_upload.assert_not_called()
+    assert mock_s3_stream_client.put_object.call_args.kwargs["Metadata"] == {
+        DIGEST_METADATA_KEY: hashlib.sha256(b"small").hexdigest()
+    }
+
+
+def test_s3_stream_writer_aborts_on_error(mock_s3_stream_client, tmp_path):
+    """A failed stream aborts the multipart upload and removes the local copy"""
+    from emrflow.utils import S3StreamWriter
+
+    local_path = tmp_path / "archive.zip"
+    with pytest.raises(RuntimeError):
+        with S3StreamWriter(
+            mock_s3_stream_client,
+            "s3://bucket/archive.zip",
+            local_path=str(local_path),
+            multipart_chunk_size=5,
+        ) as writer:
+            writer.write(b"x" * 6 * MB)
+            raise RuntimeError("packaging failed")
+
+    mock_s3_stream_client.abort_multipart_upload.assert_called_once_with(
+        Bucket="bucket", Key="archive.zip", UploadId="upload"
+    )
+    mock_s3_stream_client.complete_multipart_upload.assert_not_called()
+    assert not local_path.exists()